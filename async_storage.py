@@ -0,0 +1,83 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import storage
+
+# Awaitable versions of the storage.* functions. Storage does blocking disk
+# I/O, so calls run in a small bounded thread pool instead of on the event loop.
+STORAGE_WORKERS = int(os.getenv('STORAGE_WORKERS', '4'))
+
+_executor = ThreadPoolExecutor(max_workers=STORAGE_WORKERS, thread_name_prefix='storage')
+
+def _offload(func):
+    """Wrap a blocking storage function as a coroutine run in the storage pool"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+    return wrapper
+
+def shutdown() -> None:
+    """Wait for queued storage calls to finish and stop the pool"""
+    _executor.shutdown(wait=True)
+
+ConfigError = storage.ConfigError
+
+# These don't touch the disk, so they stay synchronous
+add_change_listener = storage.add_change_listener
+get_cache_stats = storage.get_cache_stats
+
+init = _offload(storage.init)
+flush_config = _offload(storage.flush_config)
+
+get_welcome_message = _offload(storage.get_welcome_message)
+update_welcome_message = _offload(storage.update_welcome_message)
+get_welcome_media = _offload(storage.get_welcome_media)
+update_welcome_media = _offload(storage.update_welcome_media)
+remove_welcome_media = _offload(storage.remove_welcome_media)
+
+get_groups = _offload(storage.get_groups)
+get_group_by_id = _offload(storage.get_group_by_id)
+get_group_by_chat_id = _offload(storage.get_group_by_chat_id)
+add_group = _offload(storage.add_group)
+delete_group = _offload(storage.delete_group)
+group_exists = _offload(storage.group_exists)
+
+get_referral_data = _offload(storage.get_referral_data)
+register_user = _offload(storage.register_user)
+mark_user_joined_group = _offload(storage.mark_user_joined_group)
+record_group_memberships = _offload(storage.record_group_memberships)
+get_user_referral_count = _offload(storage.get_user_referral_count)
+get_all_referral_stats = _offload(storage.get_all_referral_stats)
+get_top_referrers = _offload(storage.get_top_referrers)
+get_total_users = _offload(storage.get_total_users)
+get_total_referrals = _offload(storage.get_total_referrals)
+get_users_who_joined_groups = _offload(storage.get_users_who_joined_groups)
+check_aggregates = _offload(storage.check_aggregates)
+reset_all_referral_counts = _offload(storage.reset_all_referral_counts)
+
+get_competition = _offload(storage.get_competition)
+start_new_period = _offload(storage.start_new_period)
+get_archived_periods = _offload(storage.get_archived_periods)
+get_period_leaderboard = _offload(storage.get_period_leaderboard)
+
+schedule_message_deletion = _offload(storage.schedule_message_deletion)
+schedule_message_deletions = _offload(storage.schedule_message_deletions)
+pop_due_deletions = _offload(storage.pop_due_deletions)
+get_pending_deletion_count = _offload(storage.get_pending_deletion_count)
+
+get_user_ids_chunk = _offload(storage.get_user_ids_chunk)
+get_blocked_user_ids = _offload(storage.get_blocked_user_ids)
+mark_users_blocked = _offload(storage.mark_users_blocked)
+clear_user_blocked = _offload(storage.clear_user_blocked)
+get_broadcast = _offload(storage.get_broadcast)
+start_broadcast = _offload(storage.start_broadcast)
+update_broadcast_progress = _offload(storage.update_broadcast_progress)
+finish_broadcast = _offload(storage.finish_broadcast)
+
+pop_invite_link = _offload(storage.pop_invite_link)
+add_invite_links = _offload(storage.add_invite_links)
+get_invite_pool_sizes = _offload(storage.get_invite_pool_sizes)
+take_stale_invite_links = _offload(storage.take_stale_invite_links)
@@ -0,0 +1,95 @@
+"""Stress test: thousands of concurrent registrations and joins through async_storage.
+
+USERS users, each referred by one of REFERRERS referrers, register and click
+every group twice, all at once. Afterwards every referrer's referral_count
+must equal the number of users they referred, and check_aggregates() must
+find the stored counters consistent. Runs once per storage backend, each in
+a fresh interpreter with its own STORAGE_DIR; exits with status 1 on any
+mismatch.
+
+Run from the repository root:
+    python benchmarks/bench_concurrency.py [USERS]    # default 2000
+"""
+import asyncio
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+REFERRERS = 10
+GROUPS = 3
+
+async def stress(users):
+    sys.path.insert(0, ROOT)
+    import async_storage
+    import storage
+
+    groups = [storage.add_group(f'Group {i}', f'https://t.me/+g{i}')['id'] for i in range(GROUPS)]
+    referrers = [str(1000 + i) for i in range(REFERRERS)]
+    for referrer in referrers:
+        storage.register_user(referrer)
+
+    async def user_flow(i):
+        user_id = str(100000 + i)
+        await async_storage.register_user(user_id, referred_by=referrers[i % REFERRERS], username=f'user{i}')
+        # Double clicks race with each other as well
+        await asyncio.gather(*(
+            async_storage.mark_user_joined_group(user_id, group_id, GROUPS)
+            for group_id in groups * 2
+        ))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user_flow(i) for i in range(users)))
+    elapsed = time.perf_counter() - started
+    await async_storage.flush_config()
+
+    errors = []
+    for r, referrer in enumerate(referrers):
+        expected = len(range(r, users, REFERRERS))
+        actual = await async_storage.get_user_referral_count(referrer)
+        if actual != expected:
+            errors.append(f"referrer {referrer}: referral_count {actual}, expected {expected}")
+    check = await async_storage.check_aggregates(fix=False)
+    if not check['consistent']:
+        errors.append(f"aggregates stored {check['stored']}, actual {check['actual']}")
+    expected_totals = {'total_users': users + REFERRERS, 'joined_users': users, 'total_referrals': users}
+    if check['actual'] != expected_totals:
+        errors.append(f"aggregates {check['actual']}, expected {expected_totals}")
+
+    calls = users * (1 + 2 * GROUPS)
+    print(f"{calls} storage calls in {elapsed:.2f} s ({calls / elapsed:.0f}/s)")
+    for error in errors:
+        print(f"  MISMATCH {error}")
+    async_storage.shutdown()
+    return not errors
+
+def run(backend, users):
+    storage_dir = tempfile.mkdtemp(prefix='bench-concurrency-')
+    env = dict(os.environ, STORAGE_DIR=storage_dir, STORAGE_BACKEND=backend)
+    try:
+        result = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child', str(users)],
+            cwd=ROOT, env=env, capture_output=True, text=True
+        )
+    finally:
+        shutil.rmtree(storage_dir)
+    output = [line for line in result.stdout.splitlines() if not line.startswith('Migrated')]
+    print(f"{backend}: " + '\n'.join(output) + (result.stderr if result.returncode > 1 else ''))
+    return result.returncode == 0
+
+def main():
+    if sys.argv[1:2] == ['--child']:
+        sys.exit(0 if asyncio.run(stress(int(sys.argv[2]))) else 1)
+
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print(f"{users} users x {GROUPS} groups (each clicked twice), {REFERRERS} referrers")
+    results = [run(backend, users) for backend in ('json', 'sqlite')]
+    print("OK" if all(results) else "FAILED")
+    sys.exit(0 if all(results) else 1)
+
+if __name__ == '__main__':
+    main()
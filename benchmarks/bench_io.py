@@ -0,0 +1,134 @@
+"""Peak RSS and time of config.json I/O for large referral user sets.
+
+For each user count this builds a config.json and an export file, then runs
+every operation in a fresh interpreter, sampling RSS from /proc (Linux) so
+earlier steps don't hide the peak:
+
+  load          load_config(): json.load + conversion to UserRecord
+  save          save_config() with the default indent=2 format
+  save-compact  save_config() with CONFIG_COMPACT=1
+  export        storage.export_users() to line-delimited JSON
+  import        storage.import_users() into an empty storage dir
+
+Peak is the process RSS high-water mark during the operation; "added" is
+the peak minus the RSS right before it (for the save/export rows the loaded
+config is already resident).
+
+Run from the repository root:
+    python benchmarks/bench_io.py [USERS ...]    # default 10000 100000 1000000
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import uuid
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+CHILD = r"""
+import os, sys, threading, time
+sys.path.insert(0, os.getcwd())
+import storage
+
+op, export_path = sys.argv[1], sys.argv[2]
+page = os.sysconf('SC_PAGE_SIZE')
+
+def rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * page
+
+if op != 'import':
+    config = storage.load_config() if op != 'load' else None
+
+peak = before = rss()
+running = True
+def sample():
+    global peak
+    while running:
+        peak = max(peak, rss())
+        time.sleep(0.002)
+sampler = threading.Thread(target=sample)
+sampler.start()
+
+started = time.perf_counter()
+if op == 'load':
+    storage.load_config()
+elif op in ('save', 'save-compact'):
+    storage.save_config(config)
+elif op == 'export':
+    storage.export_users(export_path)
+elif op == 'import':
+    storage.import_users(export_path)
+elapsed = time.perf_counter() - started
+
+running = False
+sampler.join()
+peak = max(peak, rss())
+print(elapsed, peak, peak - before)
+"""
+
+OPS = ('load', 'save', 'save-compact', 'export', 'import')
+
+def build(users, storage_dir):
+    groups = [str(uuid.uuid4()) for _ in range(3)]
+    with open(os.path.join(storage_dir, 'config.json'), 'w', encoding='utf-8') as f:
+        f.write('{"welcome_message": "Welcome!", "groups": ')
+        json.dump([{'id': g, 'name': f'Group {i}', 'invite_link': f'https://t.me/+g{i}'} for i, g in enumerate(groups)], f)
+        f.write(', "referrals": {"users": {')
+        for i in range(users):
+            if i:
+                f.write(', ')
+            f.write(json.dumps(str(1000000 + i)) + ': ' + json.dumps({
+                'referral_count': i % 5,
+                'referred_by': str(1000000 + i // 2) if i else None,
+                'joined_at': '2025-10-28T12:00:00',
+                'has_joined_group': i % 3 == 0,
+                'groups_joined': groups[:i % 4],
+                'username': f'user{i}',
+                'first_name': 'Name'
+            }))
+        f.write('}}}')
+
+def run(op, storage_dir, export_path):
+    if op == 'import':
+        storage_dir = tempfile.mkdtemp(prefix='bench-io-import-')
+    env = dict(
+        os.environ, STORAGE_DIR=storage_dir, STORAGE_BACKEND='json', STORAGE_JOURNAL='0',
+        WRITE_BEHIND_MS='0', CONFIG_COMPACT='1' if op == 'save-compact' else '0'
+    )
+    try:
+        result = subprocess.run(
+            [sys.executable, '-c', CHILD, op, export_path],
+            cwd=ROOT, env=env, capture_output=True, text=True, check=True
+        )
+    finally:
+        if op == 'import':
+            shutil.rmtree(storage_dir)
+    elapsed, peak, added = result.stdout.split()[-3:]
+    return float(elapsed), int(peak), int(added)
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000]
+    mib = 1024 * 1024
+    for users in counts:
+        storage_dir = tempfile.mkdtemp(prefix='bench-io-')
+        try:
+            build(users, storage_dir)
+            config_path = os.path.join(storage_dir, 'config.json')
+            export_path = os.path.join(storage_dir, 'users.ndjson')
+            print(f"\n{users} users, config.json {os.path.getsize(config_path) / mib:.1f} MiB")
+            for op in OPS:
+                elapsed, peak, added = run(op, storage_dir, export_path)
+                size = ''
+                if op.startswith('save'):
+                    size = f"  file {os.path.getsize(config_path) / mib:7.1f} MiB"
+                elif op == 'export':
+                    size = f"  file {os.path.getsize(export_path) / mib:7.1f} MiB"
+                print(f"  {op:<13} {elapsed:7.2f} s  peak {peak / mib:7.1f} MiB  added {added / mib:7.1f} MiB{size}")
+        finally:
+            shutil.rmtree(storage_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""Microbenchmark: referral message rendering.
+
+Compares the template in messages.py with building the same text from
+f-strings on every request, as bot.py used to do.
+
+Run from the repository root:
+    python benchmarks/bench_messages.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import messages
+
+ROUNDS = 200000
+
+def fstring_message(bot_username, user_id, referral_count):
+    referral_link = f"https://t.me/{bot_username}?start=ref_{user_id}"
+    return (
+        f"📚 *Tapk Knygnesiu!*\n\n"
+        f"`{referral_link}`\n\n"
+        f"📊 *Tavo Taškai*\n"
+        f"🏆 Pakviesti draugai: *{referral_count}*\n\n"
+        f"💡 *Kaip tai veikia:*\n"
+        f"Pasidalinkite šia nuoroda su draugais ir kai jie prisijungs prie visų grupių, "
+        f"tau bus pridėtas taškas. Ir kiekvienos savaitės gale top 2 žmonės, "
+        f"pakviete daugiausiai draugų, gaus prizus! 🎁\n\n"
+        f"Pradėk dalintis dabar! 🚀"
+    )
+
+def report(name, func):
+    seconds = min(timeit.repeat(func, number=ROUNDS, repeat=5))
+    print(f"{name:<36} {seconds / ROUNDS * 1e6:8.3f} us/render")
+
+def main():
+    assert fstring_message('my_bot', 123456789, 42) == messages.render_referral_message('my_bot', 123456789, 42)
+    report("f-string (old)", lambda: fstring_message('my_bot', 123456789, 42))
+    report("Template.render", lambda: messages.REFERRAL_MESSAGE.render(
+        referral_link=messages.referral_link('my_bot', 123456789), referral_count=42
+    ))
+    report("render_referral_message (cached)", lambda: messages.render_referral_message('my_bot', 123456789, 42))
+    report("display_name (escaped)", lambda: messages.display_name({'username': 'some_user', 'user_id': '1'}))
+
+if __name__ == '__main__':
+    main()
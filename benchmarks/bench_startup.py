@@ -0,0 +1,89 @@
+"""Startup benchmark: import time of bot.py and time until the first /start can be served.
+
+Prints a `python -X importtime` summary (total, top-level packages and the
+slowest modules) and then times storage warm-up plus the first welcome
+render against a generated config.json with USERS users.
+
+Run from the repository root:
+    python benchmarks/bench_startup.py [USERS]
+"""
+import collections
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+def import_times():
+    """Run `import bot` in a fresh interpreter and parse its -X importtime output"""
+    env = dict(os.environ, STORAGE_DIR=tempfile.mkdtemp(prefix='bench-startup-'))
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import bot'],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    wall = time.perf_counter() - started
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows, wall
+
+def report_imports(top=10):
+    rows, wall = import_times()
+    total = next(cumulative for name, _, cumulative in rows if name == 'bot')
+    print(f"interpreter + import bot: {wall * 1000:.0f} ms wall, import bot: {total / 1000:.0f} ms")
+
+    packages = collections.Counter()
+    for name, self_us, _ in rows:
+        packages[name.split('.')[0]] += self_us
+    print("\nself time by top-level package:")
+    for package, self_us in packages.most_common(top):
+        print(f"  {package:<24} {self_us / 1000:7.1f} ms  {self_us / total * 100:5.1f}%")
+
+    print("\nslowest modules (self time):")
+    for name, self_us, _ in sorted(rows, key=lambda row: row[1], reverse=True)[:top]:
+        print(f"  {name:<48} {self_us / 1000:7.1f} ms")
+
+def report_first_start(users):
+    storage_dir = tempfile.mkdtemp(prefix='bench-startup-')
+    config = {
+        'welcome_message': 'Welcome!',
+        'groups': [{'id': str(i), 'name': f'Group {i}', 'invite_link': f'https://t.me/+g{i}'} for i in range(3)],
+        'referrals': {'users': {
+            str(uid): {'referral_count': uid % 7, 'referred_by': None, 'joined_at': '2025-01-01T00:00:00',
+                       'has_joined_group': True, 'groups_joined': ['0', '1', '2']}
+            for uid in range(users)
+        }}
+    }
+    with open(os.path.join(storage_dir, 'config.json'), 'w') as f:
+        json.dump(config, f)
+
+    code = (
+        "import time; t = time.perf_counter()\n"
+        "import asyncio, bot, async_storage\n"
+        "t_import = time.perf_counter()\n"
+        "async def main():\n"
+        "    await async_storage.init()\n"
+        "    await bot.get_rendered_welcome()\n"
+        "asyncio.run(main())\n"
+        "t_warm = time.perf_counter()\n"
+        "print(f'{(t_import - t) * 1000:.0f} {(t_warm - t_import) * 1000:.0f}')\n"
+    )
+    env = dict(os.environ, STORAGE_DIR=storage_dir)
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    import_ms, warm_ms = result.stdout.split()[-2:]
+    print(f"\nfirst /start with {users} users: import {import_ms} ms + storage warm-up and welcome render {warm_ms} ms")
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    report_imports()
+    report_first_start(users)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Memory benchmark: referrals.users as plain dicts vs UserRecord.
+
+Builds USERS users in the config.json layout (3 groups, ISO timestamps),
+then measures the memory held by the parsed dicts and by the same users
+converted to UserRecord, plus the conversion time.
+
+Run from the repository root:
+    python benchmarks/bench_user_records.py [USERS]
+"""
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from user_record import UserRecord
+
+def sample_json(users):
+    groups = [str(uuid.uuid4()) for _ in range(3)]
+    return json.dumps({
+        str(1000000 + i): {
+            'referral_count': i % 5,
+            'referred_by': str(1000000 + i // 2) if i else None,
+            'joined_at': '2025-10-28T12:00:00.123456',
+            'has_joined_group': i % 3 == 0,
+            'groups_joined': groups[:i % 4],
+            'username': f'user{i}',
+            'first_name': 'Name'
+        }
+        for i in range(users)
+    })
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    value = build()
+    elapsed = time.perf_counter() - started
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return value, size, elapsed
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    text = sample_json(users)
+
+    parsed, dict_bytes, parse_time = measure(lambda: json.loads(text))
+    print(f"{users} users as dicts:       {dict_bytes / 2**20:7.1f} MiB  (json.loads {parse_time:.2f}s)")
+
+    def compact():
+        data = json.loads(text)
+        for user_id, user in data.items():
+            data[user_id] = UserRecord.from_dict(user)
+        return data
+    del parsed
+    records, record_bytes, convert_time = measure(compact)
+    print(f"{users} users as UserRecord:  {record_bytes / 2**20:7.1f} MiB  (load + convert {convert_time:.2f}s)")
+    print(f"saved {(1 - record_bytes / dict_bytes) * 100:.0f}%")
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,33 @@
 import os
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import time
+
+# For startup time logging; set before the telegram imports below
+PROCESS_STARTED = time.monotonic()
+
+from collections import defaultdict
+from telegram import ChatMember, Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
 from telegram.ext import (
     Application,
+    BaseHandler,
     CommandHandler,
     CallbackQueryHandler,
+    ChatJoinRequestHandler,
+    ChatMemberHandler,
     MessageHandler,
     ConversationHandler,
     ContextTypes,
     filters
 )
-import storage
+import async_storage
+import invite_pool
+from journal import JournalError
+import messages
+import snapshot
+import telegram_cache
+from rate_limiter import PRIORITY_ADMIN, PRIORITY_BULK, PriorityRateLimiter, request_priority
+from update_processor import PerUserUpdateProcessor
 
 # Configure logging
 logging.basicConfig(
@@ -24,82 +41,309 @@ BOT_TOKEN = os.getenv('BOT_TOKEN')
 ADMIN_IDS = os.getenv('ADMIN_IDS', '').split(',')
 ADMIN_IDS = [admin_id.strip() for admin_id in ADMIN_IDS if admin_id.strip()]
 
+# Updates handled at once; each user's own updates still run in order
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '32'))
+
+# Referral messages are deleted this many seconds after they are sent
+REFERRAL_MESSAGE_TTL = 120
+
+# How often the deletion job checks for due messages, in seconds
+DELETION_SWEEP_INTERVAL = float(os.getenv('DELETION_SWEEP_INTERVAL', '5'))
+
+# Membership updates from groups with a chat ID are buffered and written to
+# storage in one batch this often, in seconds
+JOIN_FLUSH_INTERVAL = float(os.getenv('JOIN_FLUSH_INTERVAL', '2'))
+
+# Outgoing Bot API calls per second across all chats (Telegram allows about 30)
+RATE_LIMIT_PER_SECOND = float(os.getenv('RATE_LIMIT_PER_SECOND', '30'))
+
+# Update delivery: 'polling' (default) or 'webhook'
+BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()
+
+# Webhook mode settings. WEBHOOK_URL is the public base URL Telegram posts to
+# (e.g. https://your-bot.onrender.com); the embedded server listens locally.
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').rstrip('/')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram').strip('/')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or None
+
+# Log a warning when the bot isn't fully warmed up this many seconds after launch
+WARM_START_TARGET = float(os.getenv('WARM_START_TARGET', '10'))
+
+# Finished competition periods listed on the admin archive screen, newest first
+PERIODS_SHOWN = 10
+
 # Conversation states
-EDITING_WELCOME, ADDING_GROUP_NAME, ADDING_GROUP_ID, CONFIRMING_DELETE, UPLOADING_MEDIA = range(5)
+(
+    EDITING_WELCOME, ADDING_GROUP_NAME, ADDING_GROUP_ID, CONFIRMING_DELETE, UPLOADING_MEDIA,
+    BROADCASTING, CONFIRMING_BROADCAST, ADDING_GROUP_CHAT_ID
+) = range(8)
 
 def is_admin(user_id: int) -> bool:
     """Check if user is an admin"""
     return str(user_id) in ADMIN_IDS
 
+# Rendered /start payload (text, media, keyboard). It is rebuilt only after
+# storage reports a change to the welcome message, media or groups.
+_welcome_cache = None
+_welcome_generation = 0
+
+def invalidate_welcome_cache(topic: str) -> None:
+    """Storage change listener: drop the rendered welcome after relevant edits"""
+    global _welcome_cache, _welcome_generation
+    if topic in ('welcome', 'groups', 'reload'):
+        _welcome_generation += 1
+        _welcome_cache = None
+
+async def get_rendered_welcome() -> dict:
+    """Get the cached /start payload, rendering it from storage if needed"""
+    global _welcome_cache
+    cached = _welcome_cache
+    if cached is not None:
+        return cached
+    
+    generation = _welcome_generation
+    welcome_message = await async_storage.get_welcome_message()
+    welcome_media, media_type = await async_storage.get_welcome_media()
+    groups = await async_storage.get_groups()
+    
+    if not groups:
+        text = f"{welcome_message}\n\n⚠️ Šiuo metu nėra prieinamų grupių. Prašome pabandyti vėliau."
+        reply_markup = None
+    else:
+        # Create inline keyboard with group buttons
+        keyboard = []
+        for group in groups:
+            keyboard.append([InlineKeyboardButton(
+                group['name'],
+                callback_data=f"join_{group['id']}"
+            )])
+        
+        # Add referral button at the bottom
+        keyboard.append([InlineKeyboardButton(
+            "📚 Tapti Knygnesiu",
+            callback_data="get_referral_link"
+        )])
+        
+        text = welcome_message
+        reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    cached = {
+        'text': text,
+        'media': welcome_media if media_type else None,
+        'media_type': media_type if welcome_media else None,
+        'reply_markup': reply_markup
+    }
+    
+    # Don't store a render that an edit made stale while we were building it
+    if generation == _welcome_generation:
+        _welcome_cache = cached
+    return cached
+
+async def schedule_deletion(message, delay: float) -> None:
+    """Queue a sent message for deletion after delay seconds (survives restarts)"""
+    await async_storage.schedule_message_deletion(message.chat_id, message.message_id, time.time() + delay)
+
+async def delete_due_messages(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job: delete every queued message whose time has come, batched per chat"""
+    request_priority.set(PRIORITY_BULK)
+    due = await async_storage.pop_due_deletions(time.time())
+    if not due:
+        return
+    
+    by_chat = defaultdict(list)
+    for chat_id, message_id in due:
+        by_chat[chat_id].append(message_id)
+    
+    deleted = 0
+    retry = []
+    for chat_id, message_ids in by_chat.items():
+        # deleteMessages accepts at most 100 ids per call
+        for i in range(0, len(message_ids), 100):
+            batch = message_ids[i:i + 100]
+            try:
+                await context.bot.delete_messages(chat_id, batch)
+                deleted += len(batch)
+            except (BadRequest, Forbidden) as e:
+                # Already deleted, too old, or the user blocked the bot - nothing to retry
+                logger.warning(f"Could not delete {len(batch)} messages in chat {chat_id}: {e}")
+            except (NetworkError, RetryAfter) as e:
+                logger.error(f"Failed to delete {len(batch)} messages in chat {chat_id}, will retry: {e}")
+                retry_at = time.time() + DELETION_SWEEP_INTERVAL
+                retry.extend((chat_id, message_id, retry_at) for message_id in batch)
+            except TelegramError as e:
+                logger.error(f"Failed to delete {len(batch)} messages in chat {chat_id}: {e}")
+    
+    if retry:
+        # Requeue every failed batch with a single write
+        await async_storage.schedule_message_deletions(retry)
+    if deleted:
+        logger.info(f"Deleted {deleted} expired messages")
+
+# (chat_id, user_id, is_member) changes waiting for flush_membership_events
+_membership_events: list = []
+
+def is_group_member(member) -> bool:
+    """Check whether a ChatMember status means the user is in the group"""
+    if member.status in (ChatMember.MEMBER, ChatMember.ADMINISTRATOR, ChatMember.OWNER):
+        return True
+    return member.status == ChatMember.RESTRICTED and member.is_member
+
+async def track_membership(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Buffer joins and leaves in groups for the next batched flush"""
+    change = update.chat_member
+    was_member = is_group_member(change.old_chat_member)
+    is_member = is_group_member(change.new_chat_member)
+    if was_member != is_member:
+        user_id = change.new_chat_member.user.id
+        _membership_events.append((change.chat.id, user_id, is_member))
+        # Their pooled single-use link is used up (or no longer wanted)
+        context.application.user_data.get(user_id, {}).pop('invite_links', None)
+
+async def flush_membership_events(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job: credit real group joins from buffered membership updates in one storage call"""
+    if not _membership_events:
+        return
+    events = _membership_events[:]
+    _membership_events.clear()
+    credited = await async_storage.record_group_memberships(events)
+    if credited:
+        logger.info(f"Credited {credited} referrals from {len(events)} membership updates")
+
+async def handle_join_request(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Approve join requests to configured groups from users who came through the bot"""
+    join_request = update.chat_join_request
+    if not await async_storage.get_group_by_chat_id(join_request.chat.id):
+        return
+    # Others are left for the group admins to review
+    if not await async_storage.get_referral_data(str(join_request.from_user.id)):
+        return
+    try:
+        # The approval arrives as a chat_member update, which credits the join
+        await join_request.approve()
+    except TelegramError as e:
+        logger.warning(f"Could not approve join request of {join_request.from_user.id} to {join_request.chat.id}: {e}")
+
+async def get_referral_stats() -> tuple:
+    """Totals, top 10 and snapshot time for the stats screen, read from the stats snapshot once one is published"""
+    snap = snapshot.current()
+    if snap:
+        return snap.aggregates, snap.top(10), snap.created_at
+    totals = {
+        'total_users': await async_storage.get_total_users(),
+        'joined_users': await async_storage.get_users_who_joined_groups(),
+        'total_referrals': await async_storage.get_total_referrals()
+    }
+    return totals, await async_storage.get_top_referrers(10), None
+
+def format_leaderboard(top_referrers: list) -> str:
+    """Render top referrers as medal lines for the admin stats screens"""
+    if not top_referrers:
+        return "Dar nėra referalų.\n"
+    
+    text = ""
+    for i, stat in enumerate(top_referrers, 1):
+        count = stat['referral_count']
+        
+        # Get user display name, escaped so names with _ or * don't break Markdown
+        display_name = messages.display_name(stat)
+        
+        # Add medal emojis for top 3
+        if i == 1:
+            medal = "🥇"
+        elif i == 2:
+            medal = "🥈"
+        elif i == 3:
+            medal = "🥉"
+        else:
+            medal = f"{i}."
+        
+        referral_word = "referalas" if count == 1 else "referalai" if count < 10 else "referalų"
+        text += f"{medal} {display_name}: *{count}* {referral_word}\n"
+    return text
+
+def format_period_dates(period: dict) -> str:
+    """Render a competition period's start and end as dates"""
+    started = period['started_at'][:10] if period['started_at'] else "…"
+    ended = period['ended_at'][:10] if period.get('ended_at') else "dabar"
+    return f"{started} – {ended}"
+
+def format_broadcast_status(state: dict) -> str:
+    """Render broadcast progress for the admin panel"""
+    statuses = {'running': "⏳ Vykdoma", 'done': "✅ Baigta", 'cancelled': "⛔ Sustabdyta"}
+    return (
+        f"📣 *Žinutė Visiems*\n\n"
+        f"Būsena: {statuses.get(state['status'], state['status'])}\n"
+        f"Apdorota vartotojų: {state['processed']}\n"
+        f"Išsiųsta: {state['sent']}\n"
+        f"Nepavyko: {state['failed']}\n"
+        f"Užblokavo botą: {state['blocked']}"
+    )
+
+async def run_broadcast_task(application: Application, state: dict) -> None:
+    """Run a broadcast in the background and report the result to the admin who started it"""
+    import broadcast  # only needed once an admin starts a broadcast
+    
+    try:
+        result = await broadcast.run_broadcast(application.bot, state)
+    except Exception:
+        # Left as 'running' so it resumes from the last checkpoint on restart
+        logger.exception(f"Broadcast {state['id']} stopped unexpectedly")
+        return
+    
+    request_priority.set(PRIORITY_ADMIN)
+    try:
+        await application.bot.send_message(
+            chat_id=result['admin_id'],
+            text=format_broadcast_status(result),
+            parse_mode='Markdown'
+        )
+    except TelegramError as e:
+        logger.warning(f"Could not report broadcast result to admin {result['admin_id']}: {e}")
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /start command - show welcome message and group buttons"""
     user = update.effective_user
     
     # Handle referral deep linking
+    referrer_id = None
     if context.args:
         ref_param = context.args[0]
         if ref_param.startswith('ref_'):
             referrer_id = ref_param.replace('ref_', '')
-            # Register this user with the referrer
-            if referrer_id != str(user.id):  # Can't refer yourself
-                storage.register_user(user.id, referrer_id, user.username, user.first_name)
-                logger.info(f"User {user.id} registered via referral from {referrer_id}")
-    
-    # Register user if they're not already registered (without referrer)
-    if not storage.get_referral_data(str(user.id)):
-        storage.register_user(user.id, None, user.username, user.first_name)
-        logger.info(f"User {user.id} registered without referrer")
+            if referrer_id == str(user.id):  # Can't refer yourself
+                referrer_id = None
     
-    welcome_message = storage.get_welcome_message()
-    welcome_media, media_type = storage.get_welcome_media()
-    groups = storage.get_groups()
+    # A user who blocked the bot and came back can receive broadcasts again
+    await async_storage.clear_user_blocked(user.id)
     
-    if not groups:
-        message_text = f"{welcome_message}\n\n⚠️ Šiuo metu nėra prieinamų grupių. Prašome pabandyti vėliau."
-        
-        if welcome_media and media_type:
-            if media_type == "photo":
-                await update.message.reply_photo(photo=welcome_media, caption=message_text)
-            elif media_type == "video":
-                await update.message.reply_video(video=welcome_media, caption=message_text)
+    # Register user if they're not already registered
+    if await async_storage.register_user(user.id, referrer_id, user.username, user.first_name):
+        if referrer_id:
+            logger.info(f"User {user.id} registered via referral from {referrer_id}")
         else:
-            await update.message.reply_text(message_text)
-        return
-    
-    # Create inline keyboard with group buttons
-    keyboard = []
-    for group in groups:
-        keyboard.append([InlineKeyboardButton(
-            group['name'],
-            callback_data=f"join_{group['id']}"
-        )])
-    
-    # Add referral button at the bottom
-    keyboard.append([InlineKeyboardButton(
-        "📚 Tapti Knygnesiu",
-        callback_data="get_referral_link"
-    )])
+            logger.info(f"User {user.id} registered without referrer")
     
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    welcome = await get_rendered_welcome()
     
     # Send with media if available
-    if welcome_media and media_type:
-        if media_type == "photo":
-            await update.message.reply_photo(
-                photo=welcome_media,
-                caption=welcome_message,
-                reply_markup=reply_markup
-            )
-        elif media_type == "video":
-            await update.message.reply_video(
-                video=welcome_media,
-                caption=welcome_message,
-                reply_markup=reply_markup
-            )
-    else:
+    if welcome['media_type'] == "photo":
+        await update.message.reply_photo(
+            photo=welcome['media'],
+            caption=welcome['text'],
+            reply_markup=welcome['reply_markup']
+        )
+    elif welcome['media_type'] == "video":
+        await update.message.reply_video(
+            video=welcome['media'],
+            caption=welcome['text'],
+            reply_markup=welcome['reply_markup']
+        )
+    elif not welcome['media_type']:
         await update.message.reply_text(
-            welcome_message,
-            reply_markup=reply_markup
+            welcome['text'],
+            reply_markup=welcome['reply_markup']
         )
     
     logger.info(f"User {user.id} ({user.first_name}) used /start")
@@ -109,46 +353,21 @@ async def referral_info(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     user = update.effective_user
     
     # Ensure user is registered
-    if not storage.get_referral_data(str(user.id)):
-        storage.register_user(user.id, None, user.username, user.first_name)
+    if not await async_storage.get_referral_data(str(user.id)):
+        await async_storage.register_user(user.id, None, user.username, user.first_name)
     
     # Get user's referral count
-    referral_count = storage.get_user_referral_count(str(user.id))
-    
-    # Get bot username for generating the link
-    bot = context.bot
-    bot_username = (await bot.get_me()).username
-    
-    # Generate referral link
-    referral_link = f"https://t.me/{bot_username}?start=ref_{user.id}"
-    
-    # Create message in Lithuanian with new text
-    message = (
-        f"📚 *Tapk Knygnesiu!*\n\n"
-        f"`{referral_link}`\n\n"
-        f"📊 *Tavo Taškai*\n"
-        f"🏆 Pakviesti draugai: *{referral_count}*\n\n"
-        f"💡 *Kaip tai veikia:*\n"
-        f"Pasidalinkite šia nuoroda su draugais ir kai jie prisijungs prie visų grupių, "
-        f"tau bus pridėtas taškas. Ir kiekvienos savaitės gale top 2 žmonės, "
-        f"pakviete daugiausiai draugų, gaus prizus! 🎁\n\n"
-        f"Pradėk dalintis dabar! 🚀"
-    )
+    referral_count = await async_storage.get_user_referral_count(str(user.id))
+    
+    # Get bot username for generating the link (cached, resolved at startup)
+    bot_username = await telegram_cache.get_bot_username(context.bot)
+    
+    # Create message in Lithuanian from the shared template
+    message = messages.render_referral_message(bot_username, user.id, referral_count)
     
     # Send message and schedule deletion after 2 minutes
     sent_message = await update.message.reply_text(message, parse_mode='Markdown')
-    
-    # Schedule message deletion after 2 minutes (120 seconds)
-    import asyncio
-    async def delete_after_delay():
-        await asyncio.sleep(120)
-        try:
-            await sent_message.delete()
-            logger.info(f"Deleted referral message for user {user.id}")
-        except Exception as e:
-            logger.error(f"Failed to delete referral message: {e}")
-    
-    asyncio.create_task(delete_after_delay())
+    await schedule_deletion(sent_message, REFERRAL_MESSAGE_TTL)
     logger.info(f"User {user.id} checked referral stats (count: {referral_count})")
 
 async def admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -160,21 +379,24 @@ async def admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         logger.warning(f"Unauthorized admin access attempt by {user.id} ({user.first_name})")
         return
     
+    request_priority.set(PRIORITY_ADMIN)
+    
     keyboard = [
         [InlineKeyboardButton("📝 Redaguoti Sveikinimo Žinutę", callback_data="admin_edit_welcome")],
         [InlineKeyboardButton("🖼️ Įkelti Sveikinimo Mediją", callback_data="admin_upload_media")],
         [InlineKeyboardButton("🗑️ Pašalinti Sveikinimo Mediją", callback_data="admin_remove_media")],
         [InlineKeyboardButton("🔗 Valdyti Grupes", callback_data="admin_manage_groups")],
         [InlineKeyboardButton("📊 Referavimo Statistika", callback_data="admin_referral_stats")],
+        [InlineKeyboardButton("📣 Siųsti Žinutę Visiems", callback_data="admin_broadcast")],
         [InlineKeyboardButton("❌ Uždaryti", callback_data="admin_close")]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    groups_count = len(storage.get_groups())
-    media_file_id, media_type = storage.get_welcome_media()
+    groups_count = len(await async_storage.get_groups())
+    media_file_id, media_type = await async_storage.get_welcome_media()
     media_status = f"📷 {media_type.capitalize()}" if media_file_id else "❌ Nėra medijos"
-    total_users = storage.get_total_users()
-    total_referrals = storage.get_total_referrals()
+    total_users = await async_storage.get_total_users()
+    total_referrals = await async_storage.get_total_referrals()
     
     await update.message.reply_text(
         f"🔧 *Administravimo Skydelis*\n\n"
@@ -189,6 +411,76 @@ async def admin_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     
     logger.info(f"Admin {user.id} opened admin panel")
 
+async def check_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /checkstats command - recompute aggregate counters and fix any drift"""
+    user = update.effective_user
+    
+    if not is_admin(user.id):
+        await update.message.reply_text("❌ Prieiga uždrausta. Neturite leidimo naudoti šią komandą.")
+        logger.warning(f"Unauthorized /checkstats attempt by {user.id} ({user.first_name})")
+        return
+    
+    request_priority.set(PRIORITY_ADMIN)
+    
+    result = await async_storage.check_aggregates(fix=True)
+    stored = result['stored']
+    actual = result['actual']
+    
+    labels = [
+        ('total_users', "Viso vartotojų"),
+        ('joined_users', "Prisijungė prie grupių"),
+        ('total_referrals', "Viso referalų")
+    ]
+    
+    if result['consistent']:
+        text = "✅ *Statistika teisinga*\n\n"
+        for key, label in labels:
+            text += f"{label}: *{actual[key]}*\n"
+    else:
+        text = "⚠️ *Rasta neatitikimų - pataisyta*\n\n"
+        for key, label in labels:
+            text += f"{label}: {stored[key]} → *{actual[key]}*\n"
+    
+    await update.message.reply_text(text, parse_mode='Markdown')
+    logger.info(f"Admin {user.id} checked aggregate counters (consistent: {result['consistent']})")
+
+async def show_metrics(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /metrics command - show update processing and cache counters"""
+    user = update.effective_user
+    
+    if not is_admin(user.id):
+        await update.message.reply_text("❌ Prieiga uždrausta. Neturite leidimo naudoti šią komandą.")
+        logger.warning(f"Unauthorized /metrics attempt by {user.id} ({user.first_name})")
+        return
+    
+    request_priority.set(PRIORITY_ADMIN)
+    
+    application = context.application
+    processing = application.update_processor.metrics()
+    config_cache = async_storage.get_cache_stats()
+    lookups = telegram_cache.lookups.stats()
+    requests = application.bot.rate_limiter.metrics()
+    
+    await update.message.reply_text(
+        f"📈 *Sistemos Metrikos*\n\n"
+        f"*Atnaujinimai*\n"
+        f"Eilėje (Telegram): {application.update_queue.qsize()}\n"
+        f"Laukia: {processing['waiting']}\n"
+        f"Vykdomi: {processing['in_flight']} / {processing['max_concurrent']}\n"
+        f"Didžiausias vykdomų skaičius: {processing['peak_in_flight']}\n"
+        f"Apdorota: {processing['processed']}\n\n"
+        f"*Telegram API*\n"
+        f"Užklausos: {requests['requests']}\n"
+        f"Eilėje: {requests['queued']}\n"
+        f"Apribota: {requests['throttled']}\n"
+        f"Pakartota: {requests['retried']}\n"
+        f"Nepavyko: {requests['failed']}\n\n"
+        f"*Podėliai*\n"
+        f"Konfigūracija: {config_cache['hits']} hit / {config_cache['misses']} miss\n"
+        f"Telegram užklausos: {lookups['hits']} hit / {lookups['misses']} miss",
+        parse_mode='Markdown'
+    )
+
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle button callbacks"""
     query = update.callback_query
@@ -200,47 +492,22 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     # Handle referral link button
     if data == "get_referral_link":
         # Ensure user is registered
-        if not storage.get_referral_data(str(user.id)):
-            storage.register_user(user.id, None, user.username, user.first_name)
+        if not await async_storage.get_referral_data(str(user.id)):
+            await async_storage.register_user(user.id, None, user.username, user.first_name)
         
         # Get user's referral count
-        referral_count = storage.get_user_referral_count(str(user.id))
-        
-        # Get bot username for generating the link
-        bot = context.bot
-        bot_username = (await bot.get_me()).username
-        
-        # Generate referral link
-        referral_link = f"https://t.me/{bot_username}?start=ref_{user.id}"
-        
-        # Create message in Lithuanian with new text
-        message = (
-            f"📚 *Tapk Knygnesiu!*\n\n"
-            f"`{referral_link}`\n\n"
-            f"📊 *Tavo Taškai*\n"
-            f"🏆 Pakviesti draugai: *{referral_count}*\n\n"
-            f"💡 *Kaip tai veikia:*\n"
-            f"Pasidalinkite šia nuoroda su draugais ir kai jie prisijungs prie visų grupių, "
-            f"tau bus pridėtas taškas. Ir kiekvienos savaitės gale top 2 žmonės, "
-            f"pakviete daugiausiai draugų, gaus prizus! 🎁\n\n"
-            f"Pradėk dalintis dabar! 🚀"
-        )
+        referral_count = await async_storage.get_user_referral_count(str(user.id))
+        
+        # Get bot username for generating the link (cached, resolved at startup)
+        bot_username = await telegram_cache.get_bot_username(context.bot)
+        
+        # Create message in Lithuanian from the shared template
+        message = messages.render_referral_message(bot_username, user.id, referral_count)
         
         await query.answer()
         # Send message and schedule deletion after 2 minutes
         sent_message = await query.message.reply_text(message, parse_mode='Markdown')
-        
-        # Schedule message deletion after 2 minutes (120 seconds)
-        import asyncio
-        async def delete_after_delay():
-            await asyncio.sleep(120)
-            try:
-                await sent_message.delete()
-                logger.info(f"Deleted referral message for user {user.id}")
-            except Exception as e:
-                logger.error(f"Failed to delete referral message: {e}")
-        
-        asyncio.create_task(delete_after_delay())
+        await schedule_deletion(sent_message, REFERRAL_MESSAGE_TTL)
         logger.info(f"User {user.id} requested referral link from main menu (count: {referral_count})")
         
         return ConversationHandler.END
@@ -248,13 +515,14 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     # Handle user group selection
     if data.startswith("join_"):
         group_id = data.replace("join_", "")
-        group = storage.get_group_by_id(group_id)
+        group = await async_storage.get_group_by_id(group_id)
         
         if not group:
             await query.answer("❌ Grupė nerasta. Prašome bandyti /start iš naujo", show_alert=True)
             return ConversationHandler.END
         
-        invite_link = group.get('invite_link')
+        # A single-use link from the pool when the group has one, else the static link
+        invite_link = await invite_pool.get_invite_link(context, group)
         
         if not invite_link:
             await query.answer(
@@ -270,16 +538,18 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )]]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        # Count referral when user clicks the group button
-        total_groups = len(storage.get_groups())
-        was_counted = storage.mark_user_joined_group(user.id, group_id, total_groups)
-        
-        if was_counted:
-            logger.info(f"User {user.id} completed all required groups - referral counted!")
+        # Count referral when user clicks the group button. Groups with a chat ID
+        # are counted from the real membership update instead (track_membership).
+        if group.get('chat_id') is None:
+            total_groups = len(await async_storage.get_groups())
+            was_counted = await async_storage.mark_user_joined_group(user.id, group_id, total_groups)
+            
+            if was_counted:
+                logger.info(f"User {user.id} completed all required groups - referral counted!")
         
         await query.answer()
         await query.message.reply_text(
-            f"✅ *{group['name']}*",
+            f"✅ {messages.bold(group['name'])}",
             reply_markup=reply_markup,
             parse_mode='Markdown'
         )
@@ -293,19 +563,22 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await query.edit_message_text("❌ Prieiga uždrausta.")
         return ConversationHandler.END
     
+    request_priority.set(PRIORITY_ADMIN)
+    
     if data == "admin_edit_welcome":
+        welcome_message = await async_storage.get_welcome_message()
         await query.edit_message_text(
             "📝 *Redaguoti Sveikinimo Žinutę*\n\n"
             "Atsiųskite man naują sveikinimo žinutę.\n\n"
             "Dabartinė žinutė:\n"
-            f"_{storage.get_welcome_message()}_\n\n"
+            f"_{welcome_message}_\n\n"
             "Siųskite /cancel norėdami atšaukti.",
             parse_mode='Markdown'
         )
         return EDITING_WELCOME
     
     elif data == "admin_upload_media":
-        media_file_id, media_type = storage.get_welcome_media()
+        media_file_id, media_type = await async_storage.get_welcome_media()
         current = f"Dabartinė: {media_type.capitalize()}" if media_file_id else "Medija neįkelta"
         
         await query.edit_message_text(
@@ -318,7 +591,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return UPLOADING_MEDIA
     
     elif data == "admin_remove_media":
-        if storage.remove_welcome_media():
+        if await async_storage.remove_welcome_media():
             await query.edit_message_text(
                 "✅ Sveikinimo medija sėkmingai pašalinta!"
             )
@@ -330,15 +603,17 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return ConversationHandler.END
     
     elif data == "admin_referral_stats":
-        stats = storage.get_all_referral_stats()
-        total_users = storage.get_total_users()
-        users_joined_groups = storage.get_users_who_joined_groups()
-        total_referrals = storage.get_total_referrals()
+        totals, top_referrers, as_of = await get_referral_stats()
+        competition = await async_storage.get_competition()
+        total_users = totals['total_users']
+        users_joined_groups = totals['joined_users']
+        total_referrals = totals['total_referrals']
         
-        if not stats:
+        if not total_users:
             text = "📊 *Referavimo Statistika*\n\n" "Dar nėra užregistruotų vartotojų."
         else:
-            text = f"📊 *Referavimo Statistika*\n\n"
+            text = f"📊 *Referavimo Statistika*\n"
+            text += f"🏁 Konkursas #{competition['period']} ({format_period_dates(competition)})\n\n"
             text += f"👥 Viso vartotojų: *{total_users}*\n"
             text += f"✅ Prisijungė prie grupių: *{users_joined_groups}*\n"
             text += f"🔗 Viso referalų: *{total_referrals}*\n"
@@ -358,45 +633,14 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             text += "🏆 *Geriausi Referalai:*\n"
             text += "_(Skaičiuojami tik vartotojai, prisijungę prie grupių)_\n\n"
             
-            # Show top 10 referrers
-            top_referrers = [s for s in stats if s['referral_count'] > 0][:10]
+            text += format_leaderboard(top_referrers)
             
-            if not top_referrers:
-                text += "Dar nėra referalų.\n"
-            else:
-                for i, stat in enumerate(top_referrers, 1):
-                    user_id = stat['user_id']
-                    count = stat['referral_count']
-                    
-                    # Get user display name
-                    user_data = storage.get_referral_data(user_id)
-                    if user_data:
-                        username = user_data.get('username')
-                        first_name = user_data.get('first_name')
-                        if username:
-                            display_name = f"@{username}"
-                        elif first_name:
-                            display_name = first_name
-                        else:
-                            display_name = f"ID: {user_id}"
-                    else:
-                        display_name = f"ID: {user_id}"
-                    
-                    # Add medal emojis for top 3
-                    if i == 1:
-                        medal = "🥇"
-                    elif i == 2:
-                        medal = "🥈"
-                    elif i == 3:
-                        medal = "🥉"
-                    else:
-                        medal = f"{i}."
-                    
-                    referral_word = "referalas" if count == 1 else "referalai" if count < 10 else "referalų"
-                    text += f"{medal} {display_name}: *{count}* {referral_word}\n"
+            if as_of:
+                text += f"\n_Duomenys atnaujinti {time.strftime('%H:%M:%S', time.localtime(as_of))}_"
         
         keyboard = [
-            [InlineKeyboardButton("🔄 Atstatyti Visus Taškus", callback_data="admin_reset_referrals")],
+            [InlineKeyboardButton("🔄 Pradėti Naują Konkursą", callback_data="admin_reset_referrals")],
+            [InlineKeyboardButton("🗂 Ankstesni Konkursai", callback_data="admin_periods")],
             [InlineKeyboardButton("⬅️ Grįžti į Pagrindinį Meniu", callback_data="admin_back")]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -408,6 +652,55 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         )
         return ConversationHandler.END
     
+    elif data == "admin_periods":
+        periods = await async_storage.get_archived_periods()
+        
+        if not periods:
+            text = "🗂 *Ankstesni Konkursai*\n\nDar nėra baigtų konkursų."
+        else:
+            text = "🗂 *Ankstesni Konkursai*\n\nPasirinkite konkursą, kad pamatytumėte jo rezultatus:"
+        
+        keyboard = [
+            [InlineKeyboardButton(
+                f"#{period['period']} · {format_period_dates(period)} · {period['total_referrals']} ref.",
+                callback_data=f"period_{period['period']}"
+            )]
+            for period in periods[:PERIODS_SHOWN]
+        ]
+        keyboard.append([InlineKeyboardButton("⬅️ Grįžti", callback_data="admin_referral_stats")])
+        
+        await query.edit_message_text(
+            text,
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode='Markdown'
+        )
+        return ConversationHandler.END
+    
+    elif data.startswith("period_"):
+        period_id = int(data.replace("period_", ""))
+        top_referrers = await async_storage.get_period_leaderboard(period_id, 10)
+        period = next(
+            (p for p in await async_storage.get_archived_periods() if p['period'] == period_id), None
+        )
+        
+        if top_referrers is None or period is None:
+            await query.edit_message_text("❌ Konkursas nerastas.")
+            return ConversationHandler.END
+        
+        text = f"🏁 *Konkursas #{period_id}*\n"
+        text += f"📅 {format_period_dates(period)}\n"
+        text += f"🔗 Viso referalų: *{period['total_referrals']}*\n\n"
+        text += "🏆 *Geriausi Referalai:*\n\n"
+        text += format_leaderboard(top_referrers)
+        
+        keyboard = [[InlineKeyboardButton("⬅️ Grįžti", callback_data="admin_periods")]]
+        await query.edit_message_text(
+            text,
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode='Markdown'
+        )
+        return ConversationHandler.END
+    
     elif data == "admin_manage_groups":
         keyboard = [
             [InlineKeyboardButton("➕ Pridėti Naują Grupę", callback_data="admin_add_group")],
@@ -436,15 +729,17 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return ADDING_GROUP_NAME
     
     elif data == "admin_view_groups":
-        groups = storage.get_groups()
+        groups = await async_storage.get_groups()
         
         if not groups:
             text = "📋 *All Groups*\n\n" "No groups configured yet."
         else:
             text = "📋 *All Groups*\n\n"
             for i, group in enumerate(groups, 1):
-                text += f"{i}. *{group['name']}*\n"
+                text += f"{i}. {messages.bold(group['name'])}\n"
                 text += f"   Invite Link: `{group.get('invite_link', 'N/A')}`\n"
+                if group.get('chat_id') is not None:
+                    text += f"   Chat ID: `{group['chat_id']}` (joins verified)\n"
                 text += f"   ID: `{group['id']}`\n\n"
         
         keyboard = [[InlineKeyboardButton("⬅️ Back", callback_data="admin_manage_groups")]]
@@ -458,7 +753,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return ConversationHandler.END
     
     elif data == "admin_delete_group":
-        groups = storage.get_groups()
+        groups = await async_storage.get_groups()
         
         if not groups:
             keyboard = [[InlineKeyboardButton("⬅️ Back", callback_data="admin_manage_groups")]]
@@ -491,7 +786,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     elif data.startswith("delete_"):
         group_id = data.replace("delete_", "")
-        group = storage.get_group_by_id(group_id)
+        group = await async_storage.get_group_by_id(group_id)
         
         if not group:
             await query.edit_message_text("❌ Group not found.")
@@ -511,7 +806,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await query.edit_message_text(
             f"⚠️ *Confirm Deletion*\n\n"
             f"Are you sure you want to delete:\n"
-            f"*{group['name']}*\n"
+            f"{messages.bold(group['name'])}\n"
             f"Invite Link: `{group.get('invite_link', 'N/A')}`\n\n"
             f"This action cannot be undone!",
             reply_markup=reply_markup,
@@ -526,12 +821,12 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             await query.edit_message_text("❌ Error: No group selected for deletion.")
             return ConversationHandler.END
         
-        group = storage.get_group_by_id(group_id)
+        group = await async_storage.get_group_by_id(group_id)
         group_name = group['name'] if group else "Unknown"
         
-        if storage.delete_group(group_id):
+        if await async_storage.delete_group(group_id):
             await query.edit_message_text(
-                f"✅ Successfully deleted group: *{group_name}*",
+                f"✅ Successfully deleted group: {messages.bold(group_name)}",
                 parse_mode='Markdown'
             )
             logger.info(f"Admin {user.id} deleted group {group_name}")
@@ -553,15 +848,16 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             [InlineKeyboardButton("🗑️ Remove Welcome Media", callback_data="admin_remove_media")],
             [InlineKeyboardButton("🔗 Manage Groups", callback_data="admin_manage_groups")],
             [InlineKeyboardButton("📊 Referral Statistics", callback_data="admin_referral_stats")],
+            [InlineKeyboardButton("📣 Broadcast", callback_data="admin_broadcast")],
             [InlineKeyboardButton("❌ Close", callback_data="admin_close")]
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        groups_count = len(storage.get_groups())
-        media_file_id, media_type = storage.get_welcome_media()
+        groups_count = len(await async_storage.get_groups())
+        media_file_id, media_type = await async_storage.get_welcome_media()
         media_status = f"📷 {media_type.capitalize()}" if media_file_id else "❌ No media"
-        total_users = storage.get_total_users()
-        total_referrals = storage.get_total_referrals()
+        total_users = await async_storage.get_total_users()
+        total_referrals = await async_storage.get_total_referrals()
         
         await query.edit_message_text(
             f"🔧 *Admin Panel*\n\n"
@@ -587,24 +883,28 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         
         await query.edit_message_text(
             "⚠️ *Patvirtinimas*\n\n"
-            "Ar tikrai norite atstatyti VISŲ vartotojų taškus į 0?\n\n"
-            "Tai naudojama pradedant naują savaitės konkursą.\n\n"
-            "⚠️ Šis veiksmas negrįžtamas!",
+            "Ar tikrai norite baigti dabartinį konkursą ir pradėti naują?\n\n"
+            "VISŲ vartotojų taškai bus atstatyti į 0. Dabartinio konkurso "
+            "rezultatai bus išsaugoti skiltyje „Ankstesni Konkursai“.",
             reply_markup=reply_markup,
             parse_mode='Markdown'
         )
         return ConversationHandler.END
     
     elif data == "confirm_reset_yes":
-        # Reset all referral counts
-        if storage.reset_all_referral_counts():
+        # Archive the current period and start the next one; users aren't touched
+        archived = await async_storage.start_new_period()
+        if archived:
             await query.edit_message_text(
                 "✅ *Sėkmingai Atstatyta!*\n\n"
+                f"Konkursas #{archived['period']} baigtas ir išsaugotas archyve.\n"
                 "Visų vartotojų taškai atstatyti į 0.\n"
-                "Naujas konkursas gali prasidėti! 🎉",
+                f"Konkursas #{archived['period'] + 1} gali prasidėti! 🎉",
                 parse_mode='Markdown'
             )
-            logger.info(f"Admin {user.id} reset all referral counts")
+            logger.info(f"Admin {user.id} ended competition period {archived['period']}")
+            # Don't leave the stats screen showing the old counts until the next publish
+            context.job_queue.run_once(snapshot.publish_job, 0)
         else:
             await query.edit_message_text(
                 "❌ Klaida atstačius taškus."
@@ -615,6 +915,74 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await query.edit_message_text("✅ Atšaukta. Taškai nebuvo pakeisti.")
         return ConversationHandler.END
     
+    elif data == "admin_broadcast":
+        state = await async_storage.get_broadcast()
+        
+        if state and state['status'] == 'running':
+            keyboard = [
+                [InlineKeyboardButton("🔄 Atnaujinti", callback_data="admin_broadcast")],
+                [InlineKeyboardButton("⛔ Sustabdyti", callback_data="broadcast_stop")],
+                [InlineKeyboardButton("⬅️ Grįžti į Pagrindinį Meniu", callback_data="admin_back")]
+            ]
+            await query.edit_message_text(
+                format_broadcast_status(state),
+                reply_markup=InlineKeyboardMarkup(keyboard),
+                parse_mode='Markdown'
+            )
+            return ConversationHandler.END
+        
+        total_users = await async_storage.get_total_users()
+        await query.edit_message_text(
+            "📣 *Žinutė Visiems*\n\n"
+            f"Atsiųskite žinutę (tekstą, nuotrauką ar vaizdo įrašą), kuri bus nukopijuota "
+            f"visiems vartotojams ({total_users}).\n\n"
+            "Siųskite /cancel norėdami atšaukti.",
+            parse_mode='Markdown'
+        )
+        return BROADCASTING
+    
+    elif data == "broadcast_confirm_yes":
+        message = context.user_data.pop('broadcast_message', None)
+        
+        if not message:
+            await query.edit_message_text("❌ Klaida: žinutė nepasirinkta.")
+            return ConversationHandler.END
+        
+        state = await async_storage.start_broadcast(message['chat_id'], message['message_id'], user.id)
+        if not state:
+            await query.edit_message_text("❌ Kita žinutė jau siunčiama. Palaukite, kol ji bus baigta.")
+            return ConversationHandler.END
+        
+        context.application.create_task(run_broadcast_task(context.application, state))
+        
+        keyboard = [[InlineKeyboardButton("🔄 Rodyti Eigą", callback_data="admin_broadcast")]]
+        await query.edit_message_text(
+            "✅ *Siuntimas pradėtas!*\n\n"
+            "Kai visi vartotojai gaus žinutę, atsiųsiu ataskaitą.",
+            reply_markup=InlineKeyboardMarkup(keyboard),
+            parse_mode='Markdown'
+        )
+        logger.info(f"Admin {user.id} started broadcast {state['id']}")
+        return ConversationHandler.END
+    
+    elif data == "broadcast_confirm_no":
+        context.user_data.pop('broadcast_message', None)
+        await query.edit_message_text("✅ Atšaukta. Žinutė nebuvo išsiųsta.")
+        return ConversationHandler.END
+    
+    elif data == "broadcast_stop":
+        state = await async_storage.get_broadcast()
+        
+        if state and await async_storage.finish_broadcast(state['id'], 'cancelled'):
+            await query.edit_message_text(
+                "⛔ Siuntimas sustabdytas.\n\n" + format_broadcast_status(dict(state, status='cancelled')),
+                parse_mode='Markdown'
+            )
+            logger.info(f"Admin {user.id} stopped broadcast {state['id']}")
+        else:
+            await query.edit_message_text("✅ Šiuo metu niekas nesiunčiama.")
+        return ConversationHandler.END
+    
     elif data == "admin_close":
         await query.edit_message_text("✅ Administravimo skydelis uždarytas.")
         return ConversationHandler.END
@@ -623,9 +991,10 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 async def receive_welcome_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Receive new welcome message from admin"""
+    request_priority.set(PRIORITY_ADMIN)
     new_message = update.message.text
     
-    if storage.update_welcome_message(new_message):
+    if await async_storage.update_welcome_message(new_message):
         # Show success message with admin menu
         keyboard = [
             [InlineKeyboardButton("📝 Edit Welcome Message", callback_data="admin_edit_welcome")],
@@ -636,8 +1005,8 @@ async def receive_welcome_message(update: Update, context: ContextTypes.DEFAULT_
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        groups_count = len(storage.get_groups())
-        media_file_id, media_type = storage.get_welcome_media()
+        groups_count = len(await async_storage.get_groups())
+        media_file_id, media_type = await async_storage.get_welcome_media()
         media_status = f"📷 {media_type.capitalize()}" if media_file_id else "❌ No media"
         
         await update.message.reply_text(
@@ -659,6 +1028,7 @@ async def receive_welcome_message(update: Update, context: ContextTypes.DEFAULT_
 
 async def receive_group_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Receive group name from admin"""
+    request_priority.set(PRIORITY_ADMIN)
     group_name = update.message.text.strip()
     
     if not group_name:
@@ -668,7 +1038,7 @@ async def receive_group_name(update: Update, context: ContextTypes.DEFAULT_TYPE)
     context.user_data['new_group_name'] = group_name
     
     await update.message.reply_text(
-        f"✅ Group name: *{group_name}*\n\n"
+        f"✅ Group name: {messages.bold(group_name)}\n\n"
         f"Step 2: Send the group's invite link\n\n"
         f"📋 To get the invite link:\n"
         f"1. Open your private group\n"
@@ -684,6 +1054,7 @@ async def receive_group_name(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 async def receive_group_invite_link(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Receive invite link from admin"""
+    request_priority.set(PRIORITY_ADMIN)
     group_name = context.user_data.get('new_group_name', 'Unknown')
     
     if not update.message.text:
@@ -706,7 +1077,7 @@ async def receive_group_invite_link(update: Update, context: ContextTypes.DEFAUL
         return ADDING_GROUP_ID
     
     # Check if group with this link already exists
-    if storage.group_exists(invite_link):
+    if await async_storage.group_exists(invite_link):
         await update.message.reply_text(
             "❌ A group with this invite link already exists.\n\n"
             "Please check your groups or use a different link."
@@ -714,8 +1085,65 @@ async def receive_group_invite_link(update: Update, context: ContextTypes.DEFAUL
         context.user_data.pop('new_group_name', None)
         return ConversationHandler.END
     
+    context.user_data['new_group_link'] = invite_link
+    
+    await update.message.reply_text(
+        f"✅ Invite link saved\n\n"
+        f"Step 3 (optional): Send the group's chat ID to count only real joins\n\n"
+        f"📋 For this the bot must be an admin of the group. Without it, a join is "
+        f"counted when the user clicks the group button.\n"
+        f"The chat ID looks like: `-1001234567890`\n\n"
+        f"Send /skip to count clicks, or /cancel to abort.",
+        parse_mode='Markdown'
+    )
+    
+    return ADDING_GROUP_CHAT_ID
+
+async def receive_group_chat_id(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Receive the group's chat ID from admin, checking the bot can see its members"""
+    request_priority.set(PRIORITY_ADMIN)
+    text = update.message.text.strip()
+    
+    if not text.lstrip('-').isdigit() or not text.startswith('-'):
+        await update.message.reply_text(
+            "❌ Invalid chat ID. Group chat IDs are negative numbers, e.g. -1001234567890\n\n"
+            "Please try again, send /skip or /cancel to abort."
+        )
+        return ADDING_GROUP_CHAT_ID
+    
+    chat_id = int(text)
+    try:
+        member = await context.bot.get_chat_member(chat_id, context.bot.id)
+    except TelegramError as e:
+        logger.warning(f"Could not check bot membership in {chat_id}: {e}")
+        member = None
+    
+    # Telegram only sends chat_member updates to administrators
+    if not member or member.status not in (ChatMember.ADMINISTRATOR, ChatMember.OWNER):
+        await update.message.reply_text(
+            "❌ The bot is not an admin of this group, so it can't see who joins.\n\n"
+            "Add the bot as an admin and send the chat ID again, send /skip or /cancel to abort."
+        )
+        return ADDING_GROUP_CHAT_ID
+    
+    return await finish_add_group(update, context, chat_id)
+
+async def skip_group_chat_id(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Add the group without a chat ID, counting joins by button clicks"""
+    request_priority.set(PRIORITY_ADMIN)
+    return await finish_add_group(update, context, None)
+
+async def finish_add_group(update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id) -> int:
+    """Save the group collected by the add group steps and show the admin menu"""
+    group_name = context.user_data.get('new_group_name', 'Unknown')
+    invite_link = context.user_data.get('new_group_link')
+    
+    if not invite_link:
+        await update.message.reply_text("❌ Error: No invite link. Please add the group again.")
+        return ConversationHandler.END
+    
     # Add the group to storage
-    new_group = storage.add_group(group_name, invite_link)
+    new_group = await async_storage.add_group(group_name, invite_link, chat_id)
     
     # Show success message with admin menu
     keyboard = [
@@ -725,13 +1153,14 @@ async def receive_group_invite_link(update: Update, context: ContextTypes.DEFAUL
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    groups_count = len(storage.get_groups())
+    groups_count = len(await async_storage.get_groups())
     
     await update.message.reply_text(
         f"✅ *Group added successfully!*\n\n"
-        f"Name: *{new_group['name']}*\n"
-        f"Invite Link: `{new_group['invite_link']}`\n\n"
-        f"Users will receive this link when they click the '{group_name}' button.\n\n"
+        f"Name: {messages.bold(new_group['name'])}\n"
+        f"Invite Link: `{new_group['invite_link']}`\n"
+        f"Joins: {'verified from the group' if chat_id is not None else 'counted on click'}\n\n"
+        f"Users will receive this link when they click the '{messages.md(group_name)}' button.\n\n"
         f"━━━━━━━━━━━━━━━━━━━━\n\n"
         f"🔧 *Admin Panel*\n\n"
         f"Groups configured: {groups_count}\n\n"
@@ -743,10 +1172,12 @@ async def receive_group_invite_link(update: Update, context: ContextTypes.DEFAUL
     logger.info(f"Admin {update.effective_user.id} added group {group_name} with invite link")
     
     context.user_data.pop('new_group_name', None)
+    context.user_data.pop('new_group_link', None)
     return ConversationHandler.END
 
 async def receive_media(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Receive photo or video from admin for welcome media"""
+    request_priority.set(PRIORITY_ADMIN)
     media_file_id = None
     media_type = None
     
@@ -765,7 +1196,7 @@ async def receive_media(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         return UPLOADING_MEDIA
     
     # Save the media
-    if storage.update_welcome_media(media_file_id, media_type):
+    if await async_storage.update_welcome_media(media_file_id, media_type):
         # Show success message with admin menu
         keyboard = [
             [InlineKeyboardButton("📝 Edit Welcome Message", callback_data="admin_edit_welcome")],
@@ -776,7 +1207,7 @@ async def receive_media(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        groups_count = len(storage.get_groups())
+        groups_count = len(await async_storage.get_groups())
         
         await update.message.reply_text(
             f"✅ *Welcome {media_type} uploaded successfully!*\n\n"
@@ -795,6 +1226,34 @@ async def receive_media(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     
     return ConversationHandler.END
 
+async def receive_broadcast_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Receive the message to broadcast from admin and ask for confirmation"""
+    request_priority.set(PRIORITY_ADMIN)
+    
+    # Only the message reference is kept; it's copied to each user as-is
+    context.user_data['broadcast_message'] = {
+        'chat_id': update.effective_chat.id,
+        'message_id': update.message.message_id
+    }
+    total_users = await async_storage.get_total_users()
+    blocked_users = len(await async_storage.get_blocked_user_ids())
+    
+    keyboard = [
+        [
+            InlineKeyboardButton("✅ Taip, Siųsti", callback_data="broadcast_confirm_yes"),
+            InlineKeyboardButton("❌ Ne, Atšaukti", callback_data="broadcast_confirm_no")
+        ]
+    ]
+    
+    await update.message.reply_text(
+        "⚠️ *Patvirtinimas*\n\n"
+        f"Ar tikrai norite išsiųsti šią žinutę {total_users} vartotojams?\n"
+        f"(Praleidžiami užblokavę botą: {blocked_users})",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode='Markdown'
+    )
+    return CONFIRMING_BROADCAST
+
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Cancel the current conversation"""
     await update.message.reply_text(
@@ -804,6 +1263,109 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     context.user_data.clear()
     return ConversationHandler.END
 
+def get_allowed_updates(application: Application) -> list:
+    """Derive the minimal allowed_updates list from the registered handlers.
+
+    Falls back to Update.ALL_TYPES if a handler type isn't known, so a new
+    handler can never silently stop receiving its updates.
+    """
+    allowed = set()
+    unknown = []
+    
+    def visit(handler: BaseHandler) -> None:
+        if isinstance(handler, ConversationHandler):
+            nested = list(handler.entry_points) + list(handler.fallbacks)
+            for state_handlers in handler.states.values():
+                nested.extend(state_handlers)
+            for child in nested:
+                visit(child)
+        elif isinstance(handler, (CommandHandler, MessageHandler)):
+            allowed.update((Update.MESSAGE, Update.EDITED_MESSAGE))
+        elif isinstance(handler, CallbackQueryHandler):
+            allowed.add(Update.CALLBACK_QUERY)
+        elif isinstance(handler, ChatMemberHandler):
+            if handler.chat_member_types in (ChatMemberHandler.MY_CHAT_MEMBER, ChatMemberHandler.ANY_CHAT_MEMBER):
+                allowed.add(Update.MY_CHAT_MEMBER)
+            if handler.chat_member_types in (ChatMemberHandler.CHAT_MEMBER, ChatMemberHandler.ANY_CHAT_MEMBER):
+                allowed.add(Update.CHAT_MEMBER)
+        elif isinstance(handler, ChatJoinRequestHandler):
+            allowed.add(Update.CHAT_JOIN_REQUEST)
+        else:
+            unknown.append(type(handler).__name__)
+    
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            visit(handler)
+    
+    if unknown:
+        logger.warning(f"Can't derive update types for {', '.join(unknown)}; subscribing to all updates")
+        return list(Update.ALL_TYPES)
+    return sorted(allowed)
+
+# Set when storage can't be loaded; the bot then stops instead of serving
+# (and saving) an empty config
+_startup_error = None
+
+async def warm_start(application: Application) -> None:
+    """Load storage and render the welcome message in the background after startup"""
+    global _startup_error
+    started = time.monotonic()
+    try:
+        await async_storage.init()
+    except JournalError as e:
+        _startup_error = e
+        logger.critical(f"Stopping: the storage journal can't be replayed, fix or move it first. {e}")
+        application.stop_running()
+        return
+    except async_storage.ConfigError as e:
+        _startup_error = e
+        logger.critical(f"Stopping: the config file can't be loaded, restore it from a backup first. {e}")
+        application.stop_running()
+        return
+    await get_rendered_welcome()
+    
+    # Pending deletions are persisted, so the deletion job also picks up the ones left over from before a restart
+    pending = await async_storage.get_pending_deletion_count()
+    
+    # Resume a broadcast interrupted by a restart from its last checkpoint
+    state = await async_storage.get_broadcast()
+    if state and state['status'] == 'running':
+        logger.info(f"Resuming broadcast {state['id']} after {state['processed']} users")
+        application.create_task(run_broadcast_task(application, state))
+    
+    elapsed = time.monotonic() - started
+    since_launch = time.monotonic() - PROCESS_STARTED
+    logger.info(
+        f"Warm start done in {elapsed * 1000:.0f} ms, {since_launch:.1f}s after launch ({pending} pending deletions)"
+    )
+    if since_launch > WARM_START_TARGET:
+        logger.warning(f"Startup took longer than the {WARM_START_TARGET:.0f}s target")
+
+async def post_init(application: Application) -> None:
+    """Start background jobs and warm caches without delaying the first update"""
+    # getMe already ran during initialize, so this doesn't make a request
+    bot_username = await telegram_cache.get_bot_username(application.bot)
+    logger.info(f"Running as @{bot_username}")
+    
+    application.job_queue.run_repeating(delete_due_messages, interval=DELETION_SWEEP_INTERVAL, first=1)
+    application.job_queue.run_repeating(flush_membership_events, interval=JOIN_FLUSH_INTERVAL, first=JOIN_FLUSH_INTERVAL)
+    application.job_queue.run_repeating(invite_pool.maintain_pools, interval=invite_pool.INVITE_POOL_INTERVAL, first=2)
+    application.job_queue.run_repeating(snapshot.publish_job, interval=snapshot.SNAPSHOT_INTERVAL, first=5)
+    
+    # Updates that arrive meanwhile just wait on the storage lock for the load to finish
+    application.create_task(warm_start(application))
+
+async def post_shutdown(application: Application) -> None:
+    """Flush pending storage writes before the process exits"""
+    if _startup_error:
+        async_storage.shutdown()
+        return
+    if _membership_events:
+        await async_storage.record_group_memberships(_membership_events[:])
+        _membership_events.clear()
+    await async_storage.flush_config()
+    async_storage.shutdown()
+
 def main() -> None:
     """Start the bot"""
     if not BOT_TOKEN:
@@ -816,8 +1378,26 @@ def main() -> None:
         print("ERROR: ADMIN_IDS environment variable is required!")
         return
     
+    if BOT_MODE not in ('polling', 'webhook'):
+        logger.error(f"Unknown BOT_MODE '{BOT_MODE}' (expected 'polling' or 'webhook')")
+        print("ERROR: BOT_MODE must be 'polling' or 'webhook'!")
+        return
+    
+    if BOT_MODE == 'webhook' and not WEBHOOK_URL:
+        logger.error("WEBHOOK_URL environment variable is not set!")
+        print("ERROR: WEBHOOK_URL environment variable is required in webhook mode!")
+        return
+    
     # Create the Application
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES))
+        .rate_limiter(PriorityRateLimiter(overall_rate=RATE_LIMIT_PER_SECOND))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
     # Conversation handler for admin operations
     conv_handler = ConversationHandler(
@@ -837,8 +1417,18 @@ def main() -> None:
             ADDING_GROUP_ID: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, receive_group_invite_link)
             ],
+            ADDING_GROUP_CHAT_ID: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, receive_group_chat_id),
+                CommandHandler('skip', skip_group_chat_id)
+            ],
             CONFIRMING_DELETE: [
                 CallbackQueryHandler(button_callback)
+            ],
+            BROADCASTING: [
+                MessageHandler(~filters.COMMAND, receive_broadcast_message)
+            ],
+            CONFIRMING_BROADCAST: [
+                CallbackQueryHandler(button_callback)
             ]
         },
         fallbacks=[CommandHandler('cancel', cancel)],
@@ -846,18 +1436,42 @@ def main() -> None:
         per_chat=True
     )
     
+    async_storage.add_change_listener(invalidate_welcome_cache)
+    
     # Register handlers
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("admin", admin_menu))
     application.add_handler(CommandHandler("referral", referral_info))
+    application.add_handler(CommandHandler("checkstats", check_stats))
+    application.add_handler(CommandHandler("metrics", show_metrics))
     application.add_handler(conv_handler)
     application.add_handler(CallbackQueryHandler(button_callback))
+    application.add_handler(ChatMemberHandler(track_membership, ChatMemberHandler.CHAT_MEMBER))
+    application.add_handler(ChatJoinRequestHandler(handle_join_request))
     
     # Start the bot
     logger.info("Multi-Group Portal Bot started successfully!")
     logger.info(f"Authorized admin IDs: {', '.join(ADMIN_IDS)}")
     print("Bot is running...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    
+    allowed_updates = get_allowed_updates(application)
+    logger.info(f"Subscribed to updates: {', '.join(allowed_updates)}")
+    
+    if BOT_MODE == 'webhook':
+        logger.info(f"Serving webhook on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}")
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=allowed_updates
+        )
+    else:
+        application.run_polling(allowed_updates=allowed_updates)
+    
+    if _startup_error:
+        raise SystemExit(1)
 
 if __name__ == '__main__':
     main()
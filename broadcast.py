@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import os
+from typing import Dict
+
+from telegram.error import BadRequest, Forbidden, TelegramError
+
+import async_storage
+from rate_limiter import PRIORITY_BULK, request_priority
+
+logger = logging.getLogger(__name__)
+
+# Users read from storage per chunk; progress is checkpointed after each one,
+# so a crash re-sends at most one chunk
+BROADCAST_CHUNK_SIZE = int(os.getenv('BROADCAST_CHUNK_SIZE', '200'))
+
+# Messages sent at once. The rate limiter still applies, this only bounds
+# how many sends are waiting on it.
+BROADCAST_WORKERS = int(os.getenv('BROADCAST_WORKERS', '8'))
+
+async def run_broadcast(bot, broadcast: Dict) -> Dict:
+    """Copy the broadcast message to every registered user, resuming from its checkpoint.
+
+    Users that blocked the bot or deleted their account are recorded and
+    skipped by later broadcasts. Returns the final broadcast state.
+    """
+    request_priority.set(PRIORITY_BULK)
+
+    broadcast_id = broadcast['id']
+    after = broadcast['last_user_id']
+    processed = broadcast['processed']
+    counts = {key: broadcast[key] for key in ('sent', 'failed', 'blocked')}
+    skip = set(await async_storage.get_blocked_user_ids())
+    slots = asyncio.Semaphore(BROADCAST_WORKERS)
+
+    async def send(user_id: str, newly_blocked: list) -> None:
+        async with slots:
+            try:
+                await bot.copy_message(
+                    chat_id=int(user_id),
+                    from_chat_id=broadcast['from_chat_id'],
+                    message_id=broadcast['message_id']
+                )
+                counts['sent'] += 1
+            except Forbidden:
+                newly_blocked.append(user_id)
+            except BadRequest as e:
+                if 'chat not found' in str(e).lower():
+                    newly_blocked.append(user_id)
+                else:
+                    counts['failed'] += 1
+                    logger.warning(f"Broadcast to {user_id} failed: {e}")
+            except TelegramError as e:
+                counts['failed'] += 1
+                logger.warning(f"Broadcast to {user_id} failed: {e}")
+
+    logger.info(f"Broadcast {broadcast_id} running after {processed} users")
+    status = 'done'
+    while True:
+        user_ids = await async_storage.get_user_ids_chunk(after, BROADCAST_CHUNK_SIZE)
+        if not user_ids:
+            break
+
+        newly_blocked = []
+        await asyncio.gather(*(
+            send(user_id, newly_blocked) for user_id in user_ids if user_id not in skip
+        ))
+        after = user_ids[-1]
+        processed += len(user_ids)
+
+        if newly_blocked:
+            counts['blocked'] += len(newly_blocked)
+            skip.update(newly_blocked)
+            await async_storage.mark_users_blocked(newly_blocked)
+
+        # False means an admin stopped the broadcast meanwhile
+        if not await async_storage.update_broadcast_progress(broadcast_id, after, processed, **counts):
+            status = 'cancelled'
+            break
+
+    if status == 'done':
+        await async_storage.finish_broadcast(broadcast_id, 'done')
+    logger.info(
+        f"Broadcast {broadcast_id} {status}: {counts['sent']} sent, "
+        f"{counts['failed']} failed, {counts['blocked']} blocked"
+    )
+    return dict(broadcast, status=status, last_user_id=after, processed=processed, **counts)
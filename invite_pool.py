@@ -0,0 +1,95 @@
+import logging
+import os
+import time
+from typing import Dict
+
+from telegram.error import TelegramError
+
+import async_storage
+from rate_limiter import PRIORITY_BULK, request_priority
+
+logger = logging.getLogger(__name__)
+
+# Single-use links kept ready per group with a chat ID. The pool is topped up
+# to INVITE_POOL_SIZE once it drops to INVITE_POOL_LOW_WATER links.
+INVITE_POOL_SIZE = int(os.getenv('INVITE_POOL_SIZE', '10'))
+INVITE_POOL_LOW_WATER = int(os.getenv('INVITE_POOL_LOW_WATER', '3'))
+
+# Lifetime of a pooled link, in seconds. Links are handed out only while they
+# have at least INVITE_LINK_MIN_TTL left, so users have time to open them;
+# older ones are revoked.
+INVITE_LINK_TTL = int(os.getenv('INVITE_LINK_TTL', '86400'))
+INVITE_LINK_MIN_TTL = int(os.getenv('INVITE_LINK_MIN_TTL', '900'))
+
+# How often the maintenance job revokes stale links and refills pools, in seconds
+INVITE_POOL_INTERVAL = float(os.getenv('INVITE_POOL_INTERVAL', '60'))
+
+# Groups with a refill in progress, so a burst of clicks starts only one
+_refilling = set()
+
+async def refill_pool(bot, group: Dict, size: int) -> int:
+    """Create links until the group's pool holds INVITE_POOL_SIZE. Returns links created"""
+    if group['id'] in _refilling:
+        return 0
+    _refilling.add(group['id'])
+    request_priority.set(PRIORITY_BULK)
+    try:
+        links = []
+        expires_at = int(time.time()) + INVITE_LINK_TTL
+        for _ in range(INVITE_POOL_SIZE - size):
+            try:
+                invite = await bot.create_chat_invite_link(
+                    group['chat_id'], expire_date=expires_at, member_limit=1
+                )
+            except TelegramError as e:
+                logger.error(f"Could not create invite link for group {group['name']}: {e}")
+                break
+            links.append({'link': invite.invite_link, 'chat_id': group['chat_id'], 'expires_at': expires_at})
+        if links:
+            await async_storage.add_invite_links(group['id'], links)
+        return len(links)
+    finally:
+        _refilling.discard(group['id'])
+
+async def maintain_pools(context) -> None:
+    """Job: revoke stale pooled links and refill pools that are running low"""
+    request_priority.set(PRIORITY_BULK)
+    now = time.time()
+
+    stale = await async_storage.take_stale_invite_links(now + INVITE_LINK_MIN_TTL)
+    for chat_id, link in stale:
+        try:
+            await context.bot.revoke_chat_invite_link(chat_id, link)
+        except TelegramError as e:
+            # Already expired or the bot lost its admin rights; nothing left to do
+            logger.debug(f"Could not revoke invite link in chat {chat_id}: {e}")
+    if stale:
+        logger.info(f"Revoked {len(stale)} unused invite links")
+
+    sizes = await async_storage.get_invite_pool_sizes()
+    for group in await async_storage.get_groups():
+        size = sizes.get(group['id'], 0)
+        if group.get('chat_id') is not None and size <= INVITE_POOL_LOW_WATER:
+            created = await refill_pool(context.bot, group, size)
+            if created:
+                logger.info(f"Added {created} invite links to the pool of group {group['name']}")
+
+async def get_invite_link(context, group: Dict) -> str:
+    """Get a single-use invite link for the user, falling back to the group's static link"""
+    if group.get('chat_id') is None:
+        return group['invite_link']
+
+    # Repeated clicks reuse the user's link instead of draining the pool
+    user_links = context.user_data.setdefault('invite_links', {})
+    link, expires_at = user_links.get(group['id'], (None, 0))
+    if link and expires_at - time.time() > INVITE_LINK_MIN_TTL:
+        return link
+
+    entry, left = await async_storage.pop_invite_link(group['id'], time.time() + INVITE_LINK_MIN_TTL)
+    if left <= INVITE_POOL_LOW_WATER and group['id'] not in _refilling:
+        context.application.create_task(refill_pool(context.bot, group, left))
+    if not entry:
+        return group['invite_link']
+
+    user_links[group['id']] = (entry['link'], entry['expires_at'])
+    return entry['link']
@@ -0,0 +1,144 @@
+import json
+import os
+import tempfile
+from typing import Callable, Dict, Iterator, List, Optional
+
+class JournalError(Exception):
+    """The journal can't be replayed. Raised instead of skipping events, which would lose data"""
+
+class Journal:
+    """Append-only JSON-lines event log with rotation into an archive directory.
+
+    Each event is one line, written with a single O_APPEND write, so a crash
+    can at most leave a torn last line; it is skipped when reading and cut
+    off before the next append. Any other unreadable line is corruption and
+    raises JournalError.
+    """
+
+    def __init__(self, path: str, archive_dir: str, fsync: bool = False):
+        self.path = path
+        self.archive_dir = archive_dir
+        self.fsync = fsync
+        self._fd: Optional[int] = None
+
+    def _open(self) -> int:
+        if self._fd is None:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+            size = os.fstat(fd).st_size
+            if size and os.pread(fd, 1, size - 1) != b'\n':
+                # Drop a torn last line left by a crash mid-append
+                with open(self.path, 'rb') as f:
+                    end = f.read().rfind(b'\n') + 1
+                os.ftruncate(fd, end)
+            self._fd = fd
+        return self._fd
+
+    def append(self, events: List[Dict]) -> None:
+        """Write events as one append"""
+        data = ''.join(json.dumps(event, ensure_ascii=False) + '\n' for event in events)
+        fd = self._open()
+        os.write(fd, data.encode('utf-8'))
+        if self.fsync:
+            os.fsync(fd)
+
+    def read(self) -> Iterator[Dict]:
+        """Yield the events of the current segment, oldest first. Raises JournalError on a corrupt line"""
+        try:
+            # Binary, so a bad UTF-8 byte is reported with its line like any other corruption
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            for number, line in enumerate(f, 1):
+                if not line.endswith(b'\n'):
+                    break  # torn last line
+                try:
+                    event = json.loads(line)
+                except ValueError as e:
+                    raise JournalError(f"{self.path} line {number} is corrupt: {e}") from e
+                if not isinstance(event, dict) or 'seq' not in event or 'type' not in event:
+                    raise JournalError(f"{self.path} line {number} is not a journal event")
+                yield event
+
+    def rotate(self, name: str) -> Optional[str]:
+        """Move the current segment into the archive. Returns its new path, or None if it was empty"""
+        self.close()
+        try:
+            if os.path.getsize(self.path) == 0:
+                return None
+        except FileNotFoundError:
+            return None
+        os.makedirs(self.archive_dir, exist_ok=True)
+        archived = os.path.join(self.archive_dir, name)
+        os.replace(self.path, archived)
+        return archived
+
+    def rewrite(self, events: List[Dict]) -> None:
+        """Atomically replace the current segment with events: write a temp file, fsync, then rename"""
+        self.close()
+        data = ''.join(json.dumps(event, ensure_ascii=False) + '\n' for event in events)
+        fd, tmp_path = tempfile.mkstemp(prefix='.journal-', suffix='.tmp', dir=os.path.dirname(self.path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data.encode('utf-8'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+class StateLog:
+    """Small operational state (queues, pools) persisted as its own event log instead of in config.json.
+
+    The state lives in memory; every change appends one event. After
+    compact_events appends the log is rewritten as a single event holding the
+    whole state, so the file stays proportional to the state, not its history.
+    apply(state, event) must handle that event as well as the change events.
+    """
+
+    def __init__(self, path: str, apply: Callable[[object, Dict], None],
+                 compact_events: int = 1000, fsync: bool = False):
+        self.journal = Journal(path, os.path.dirname(path), fsync=fsync)
+        self.apply = apply
+        self.compact_events = compact_events
+        self._seq = 0
+        self._events = 0
+
+    def load(self, state):
+        """Replay the log into state and return it. Raises JournalError if an event can't be read or applied"""
+        for event in self.journal.read():
+            try:
+                self.apply(state, event)
+            except (KeyError, TypeError, ValueError) as e:
+                raise JournalError(f"Can't replay event {event['seq']} ({event['type']}) from {self.journal.path}: {e!r}") from e
+            self._seq = event['seq']
+            self._events += 1
+        return state
+
+    def compact(self, event: Dict) -> None:
+        """Rewrite the log as the single whole-state event. Raises OSError if it can't be written"""
+        self._seq += 1
+        self.journal.rewrite([dict(event, seq=self._seq)])
+        self._events = 1
+
+    def record(self, event: Dict, compacted: Callable[[], Dict]) -> None:
+        """Persist a change already made to the state. compacted() builds the whole-state event.
+
+        Raises OSError if the log can't be written.
+        """
+        if self._events + 1 >= self.compact_events:
+            self.compact(compacted())
+            return
+        self._seq += 1
+        event['seq'] = self._seq
+        self.journal.append([event])
+        self._events += 1
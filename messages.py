@@ -0,0 +1,98 @@
+import functools
+import string
+from typing import Dict, Iterable, Optional
+
+# Same escaping as telegram.helpers.escape_markdown(version=1), as a
+# translate table instead of a regex substitution per call
+_MARKDOWN_ESCAPES = str.maketrans({char: '\\' + char for char in '_*`['})
+
+def md(value) -> str:
+    """Escape a value placed outside any entity in messages sent with parse_mode='Markdown'.
+
+    Not for values inside *bold*, _italic_ or `code`: legacy Markdown shows
+    backslashes there literally. Use bold() for bold values.
+    """
+    return str(value).translate(_MARKDOWN_ESCAPES)
+
+def bold(value) -> str:
+    """Render a value in bold for parse_mode='Markdown'.
+
+    Inside an entity everything but its closing character is literal, so the
+    value goes in as is. A value containing '*' can't be bolded at all; it is
+    shown escaped without bold instead.
+    """
+    value = str(value)
+    if '*' in value:
+        return md(value)
+    return f"*{value}*"
+
+class Template:
+    """Message template parsed once into static parts and fields.
+
+    Rendering only joins the cached static text with the field values, which
+    are Markdown-escaped unless listed in raw. Escaping only works outside
+    entities, so fields inside `code` or *bold* must be raw (or numbers).
+    """
+
+    def __init__(self, text: str, raw: Iterable[str] = ()):
+        self.parts = []
+        self.fields = []
+        raw = set(raw)
+        for literal, field, _, _ in string.Formatter().parse(text):
+            self.parts.append(literal)
+            if field is not None:
+                self.fields.append((field, field in raw))
+        if len(self.parts) == len(self.fields):
+            self.parts.append('')
+
+    def render(self, **values) -> str:
+        out = [self.parts[0]]
+        for (field, is_raw), literal in zip(self.fields, self.parts[1:]):
+            value = values[field]
+            # Numbers can't contain Markdown characters
+            if is_raw or isinstance(value, int):
+                out.append(str(value))
+            else:
+                out.append(md(value))
+            out.append(literal)
+        return ''.join(out)
+
+REFERRAL_MESSAGE = Template(
+    "📚 *Tapk Knygnesiu!*\n\n"
+    "`{referral_link}`\n\n"
+    "📊 *Tavo Taškai*\n"
+    "🏆 Pakviesti draugai: *{referral_count}*\n\n"
+    "💡 *Kaip tai veikia:*\n"
+    "Pasidalinkite šia nuoroda su draugais ir kai jie prisijungs prie visų grupių, "
+    "tau bus pridėtas taškas. Ir kiekvienos savaitės gale top 2 žmonės, "
+    "pakviete daugiausiai draugų, gaus prizus! 🎁\n\n"
+    "Pradėk dalintis dabar! 🚀",
+    raw=('referral_link',)
+)
+
+@functools.lru_cache(maxsize=4)
+def _referral_link_prefix(bot_username: str) -> str:
+    return f"https://t.me/{bot_username}?start=ref_"
+
+def referral_link(bot_username: str, user_id: int) -> str:
+    """Get the deep link that registers new users as referred by user_id"""
+    return f"{_referral_link_prefix(bot_username)}{user_id}"
+
+# Users tend to open /referral repeatedly while their count stays the same
+@functools.lru_cache(maxsize=4096)
+def render_referral_message(bot_username: str, user_id: int, referral_count: int) -> str:
+    """Render the /referral message with the user's link and points"""
+    return REFERRAL_MESSAGE.render(
+        referral_link=referral_link(bot_username, user_id),
+        referral_count=referral_count
+    )
+
+def display_name(stat: Dict) -> str:
+    """Markdown-safe name for a user in the referral stats: @username, first name or ID"""
+    username: Optional[str] = stat.get('username')
+    first_name: Optional[str] = stat.get('first_name')
+    if username:
+        return md(f"@{username}")
+    if first_name:
+        return md(first_name)
+    return f"ID: {stat['user_id']}"
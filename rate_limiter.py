@@ -0,0 +1,195 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Request priorities, lower runs first when the global limit is saturated
+PRIORITY_USER = 0  # replies to regular users
+PRIORITY_ADMIN = 1  # admin panel screens
+PRIORITY_BULK = 2  # broadcasts and other background sends
+
+# Priority for requests made by the current handler. It's a context
+# variable, so setting it in one update's handler doesn't leak to others.
+request_priority: contextvars.ContextVar[int] = contextvars.ContextVar(
+    'request_priority', default=PRIORITY_USER
+)
+
+class TokenBucket:
+    """Token bucket that hands out reservations instead of blocking"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        """Take a token and return how many seconds to wait before using it"""
+        self._refill()
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def is_idle(self) -> bool:
+        """True if the bucket is full, i.e. it can be dropped without changing behavior"""
+        self._refill()
+        return self.tokens >= self.capacity
+
+class PriorityRateLimiter(BaseRateLimiter[Dict]):
+    """Global plus per-chat token bucket limiter for outgoing Bot API calls.
+
+    Every request takes a token from the global bucket; requests with a
+    chat_id first take one from that chat's bucket (private chats and groups
+    have separate limits). Calls without a chat_id, such as
+    answerCallbackQuery, count against the global limit too, as they do in
+    python-telegram-bot's own AIORateLimiter. When the global bucket is
+    empty, waiting requests are released in priority order (see
+    request_priority), so user replies go out before admin screens and
+    broadcasts. A RetryAfter from Telegram pauses all requests for the
+    requested time and the call is retried.
+    """
+
+    # Drop idle per-chat buckets once this many are tracked
+    MAX_IDLE_BUCKETS = 10000
+
+    def __init__(
+        self,
+        overall_rate: float = 30,
+        private_chat_rate: float = 1,
+        private_chat_burst: float = 3,
+        group_rate: float = 20 / 60,
+        group_burst: float = 3,
+        max_retries: int = 3
+    ):
+        self._overall = TokenBucket(overall_rate, overall_rate)
+        self._private_chat_rate = private_chat_rate
+        self._private_chat_burst = private_chat_burst
+        self._group_rate = group_rate
+        self._group_burst = group_burst
+        self._max_retries = max_retries
+
+        self._chat_buckets: Dict[Union[int, str], TokenBucket] = {}
+        self._waiters: List[tuple] = []
+        self._sequence = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._paused_until = 0.0
+
+        self.counters = {'requests': 0, 'throttled': 0, 'retried': 0, 'failed': 0}
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+
+    def _chat_bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= self.MAX_IDLE_BUCKETS:
+                for key in [k for k, b in self._chat_buckets.items() if b.is_idle()]:
+                    del self._chat_buckets[key]
+            # Negative ids and @usernames are groups and channels
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            if is_group:
+                bucket = TokenBucket(self._group_rate, self._group_burst)
+            else:
+                bucket = TokenBucket(self._private_chat_rate, self._private_chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _acquire_overall(self, priority: int) -> bool:
+        """Wait for a global token. Returns True if the request had to wait"""
+        if not self._waiters and time.monotonic() >= self._paused_until:
+            wait = self._overall.reserve()
+            if wait == 0:
+                return False
+            # Give the token back and queue up instead, so priorities apply
+            self._overall.tokens += 1
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+        return True
+
+    async def _dispatch(self) -> None:
+        """Release queued requests one token at a time, highest priority first"""
+        while self._waiters:
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            wait = self._overall.reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            while self._waiters:
+                _, _, future = heapq.heappop(self._waiters)
+                if not future.done():
+                    future.set_result(None)
+                    break
+            else:
+                # Every waiter was cancelled; return the unused token
+                self._overall.tokens += 1
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict, List[Dict]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Dict]
+    ) -> Union[bool, Dict, List[Dict]]:
+        priority = (rate_limit_args or {}).get('priority', request_priority.get())
+        chat_id = data.get('chat_id')
+        if isinstance(chat_id, str) and chat_id.lstrip('-').isdigit():
+            chat_id = int(chat_id)
+
+        self.counters['requests'] += 1
+        attempt = 0
+        while True:
+            throttled = False
+            if chat_id is not None:
+                wait = self._chat_bucket(chat_id).reserve()
+                if wait > 0:
+                    throttled = True
+                    await asyncio.sleep(wait)
+            throttled = await self._acquire_overall(priority) or throttled
+            if throttled:
+                self.counters['throttled'] += 1
+
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                if attempt >= self._max_retries:
+                    self.counters['failed'] += 1
+                    logger.error(f"{endpoint}: flood control still active after {attempt} retries")
+                    raise
+                attempt += 1
+                self.counters['retried'] += 1
+                retry_after = exc.retry_after
+                if not isinstance(retry_after, (int, float)):
+                    retry_after = retry_after.total_seconds()
+                logger.warning(f"{endpoint}: flood control, retrying in {retry_after}s")
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after + 0.1)
+
+    def metrics(self) -> Dict:
+        """Get request counters and the current queue length"""
+        return dict(self.counters, queued=len(self._waiters))
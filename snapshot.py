@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import time
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import storage
+import user_record
+
+logger = logging.getLogger(__name__)
+
+# Read-only stats snapshot for the admin screens: aggregate counters plus one
+# fixed-width record per user, sorted by referral_count (highest first). A
+# job rewrites it every SNAPSHOT_INTERVAL seconds; readers mmap the file and
+# decode only the records they show, without the storage lock or the parsed
+# config.
+SNAPSHOT_FILE = os.path.join(storage.STORAGE_DIR, 'stats.snap')
+SNAPSHOT_INTERVAL = float(os.getenv('SNAPSHOT_INTERVAL', '60'))
+
+MAGIC = b'REFSNAP1'
+# magic, created_at, total_users, joined_users, total_referrals, record count
+HEADER = struct.Struct('<8sqqqqq')
+# user_id, referral_count, joined_at, referred_by (0 = none), has_joined_group,
+# username, first_name (UTF-8, zero-padded, truncated to fit)
+RECORD = struct.Struct('<qiqq?32s64s')
+
+def _encode_name(value: Optional[str], size: int) -> bytes:
+    encoded = (value or '').encode('utf-8')[:size]
+    # Don't leave half of a multibyte character at the end
+    return encoded.decode('utf-8', 'ignore').encode('utf-8')
+
+def _decode_name(value: bytes) -> Optional[str]:
+    return value.rstrip(b'\0').decode('utf-8') or None
+
+def write_snapshot(path: str, aggregates: Dict, rows: Iterable[tuple]) -> int:
+    """Atomically write a snapshot from rows as returned by storage.get_snapshot_source.
+
+    Rows whose user ID isn't numeric are left out. Returns records written.
+    """
+    records = []
+    for user_id, referral_count, joined_at, has_joined_group, referred_by, username, first_name in rows:
+        try:
+            records.append((
+                int(user_id), referral_count, joined_at or 0,
+                int(referred_by) if referred_by and str(referred_by).isdigit() else 0, has_joined_group,
+                _encode_name(username, 32), _encode_name(first_name, 64)
+            ))
+        except ValueError:
+            continue
+    records.sort(key=lambda record: record[1], reverse=True)
+
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(prefix='.stats-', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(HEADER.pack(
+                MAGIC, int(time.time()), aggregates['total_users'],
+                aggregates['joined_users'], aggregates['total_referrals'], len(records)
+            ))
+            buffer = bytearray(RECORD.size * 4096)
+            for start in range(0, len(records), 4096):
+                chunk = records[start:start + 4096]
+                for i, record in enumerate(chunk):
+                    RECORD.pack_into(buffer, i * RECORD.size, *record)
+                f.write(memoryview(buffer)[:len(chunk) * RECORD.size])
+        # Readers that still map the old file keep it until they reopen
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    return len(records)
+
+class Snapshot:
+    """A mapped snapshot file. Records are decoded on access straight from the mapping"""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self.stat = os.fstat(f.fileno())
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.created_at, total_users, joined_users, total_referrals, self.count = HEADER.unpack_from(self._map)
+        if magic != MAGIC or len(self._map) != HEADER.size + self.count * RECORD.size:
+            self._map.close()
+            raise ValueError(f"{path} is not a complete stats snapshot")
+        self.aggregates = {
+            'total_users': total_users,
+            'joined_users': joined_users,
+            'total_referrals': total_referrals
+        }
+
+    def record(self, index: int) -> Dict:
+        user_id, referral_count, joined_at, referred_by, has_joined_group, username, first_name = \
+            RECORD.unpack_from(self._map, HEADER.size + index * RECORD.size)
+        return {
+            'user_id': str(user_id),
+            'referral_count': referral_count,
+            'referred_by': str(referred_by) if referred_by else None,
+            'joined_at': user_record.to_iso(joined_at or None),
+            'has_joined_group': has_joined_group,
+            'username': _decode_name(username),
+            'first_name': _decode_name(first_name)
+        }
+
+    def records(self, start: int = 0) -> Iterator[Dict]:
+        """All records from start on, highest referral_count first"""
+        for index in range(start, self.count):
+            yield self.record(index)
+
+    def top(self, limit: int) -> List[Dict]:
+        """Like storage.get_top_referrers: users with referral_count > 0, highest first"""
+        top = []
+        for index in range(min(limit, self.count)):
+            record = self.record(index)
+            if record['referral_count'] <= 0:
+                break
+            top.append(record)
+        return top
+
+    def close(self) -> None:
+        self._map.close()
+
+_current: Optional[Snapshot] = None
+
+def current() -> Optional[Snapshot]:
+    """The latest published snapshot, remapped when the file was replaced. None if there is none yet"""
+    global _current
+    try:
+        stat = os.stat(SNAPSHOT_FILE)
+    except FileNotFoundError:
+        return None
+    if _current is not None:
+        if (stat.st_ino, stat.st_mtime_ns) == (_current.stat.st_ino, _current.stat.st_mtime_ns):
+            return _current
+        _current.close()
+        _current = None
+    try:
+        _current = Snapshot(SNAPSHOT_FILE)
+    except (OSError, ValueError):
+        return None
+    return _current
+
+_published_version = None
+
+def publish(force: bool = False) -> Optional[int]:
+    """Write a new snapshot unless storage is unchanged since the last one. Returns records written"""
+    global _published_version
+    source = storage.get_snapshot_source(None if force else _published_version)
+    if source is None:
+        return None
+    version, aggregates, rows = source
+    count = write_snapshot(SNAPSHOT_FILE, aggregates, rows)
+    _published_version = version
+    return count
+
+async def publish_job(context) -> None:
+    """Job: publish a new snapshot off the event loop"""
+    loop = asyncio.get_running_loop()
+    started = time.monotonic()
+    count = await loop.run_in_executor(None, publish)
+    if count is not None:
+        logger.debug(f"Published stats snapshot of {count} users in {(time.monotonic() - started) * 1000:.0f} ms")
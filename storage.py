@@ -1,14 +1,47 @@
+import atexit
+import copy
+import functools
+import heapq
+import itertools
 import json
 import os
+import tempfile
+import threading
 import uuid
-from typing import Dict, List, Optional
+from typing import Callable, Dict, Iterable, List, Optional
+
+from journal import Journal, JournalError, StateLog
+from user_record import UserRecord
+import user_record
 
 # Use persistent disk path on Render, fallback to local path for development
 STORAGE_DIR = os.getenv('STORAGE_DIR', '/var/data')
 CONFIG_FILE = os.path.join(STORAGE_DIR, 'config.json')
 
-# Ensure storage directory exists
-os.makedirs(STORAGE_DIR, exist_ok=True)
+# Backend for groups and referral users: 'json' keeps them in config.json,
+# 'sqlite' moves them into an SQLite database (welcome settings stay in JSON)
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json').lower()
+SQLITE_FILE = os.path.join(STORAGE_DIR, 'storage.db')
+
+# Write-behind delay: 0 writes config.json on every save, >0 coalesces saves
+# into at most one disk write per this many milliseconds
+WRITE_BEHIND_MS = int(os.getenv('WRITE_BEHIND_MS', '0'))
+
+# Write config.json without indentation, encoding referral users one at a
+# time instead of pretty-printing the whole tree (about half the bytes and
+# several times faster for large user counts)
+CONFIG_COMPACT = os.getenv('CONFIG_COMPACT', '0') == '1'
+
+# With the JSON backend, referral changes (registrations, joins, credits and
+# resets) are appended to an event journal instead of rewriting config.json.
+# config.json becomes a snapshot, rewritten every JOURNAL_SNAPSHOT_EVENTS
+# events (or by any other save); older journal segments are archived in
+# JOURNAL_ARCHIVE_DIR as an audit trail.
+STORAGE_JOURNAL = os.getenv('STORAGE_JOURNAL', '1') == '1'
+JOURNAL_FILE = os.path.join(STORAGE_DIR, 'events.log')
+JOURNAL_ARCHIVE_DIR = os.path.join(STORAGE_DIR, 'journal')
+JOURNAL_SNAPSHOT_EVENTS = int(os.getenv('JOURNAL_SNAPSHOT_EVENTS', '1000'))
+JOURNAL_FSYNC = os.getenv('JOURNAL_FSYNC', '0') == '1'
 
 DEFAULT_CONFIG = {
     "welcome_message": "👋 Welcome to our community portal!\n\nPlease select a group below to get your invite link:",
@@ -20,88 +53,492 @@ DEFAULT_CONFIG = {
     }
 }
 
+# Process-wide config cache. save_config keeps it in sync; the file stamp
+# (inode, mtime, size) detects changes made to the file by someone else.
+_config_cache: Optional[Dict] = None
+_config_stamp: Optional[tuple] = None
+_cache_hits = 0
+_cache_misses = 0
+
+# Write-behind state: the cached config has changes not yet on disk
+_io_lock = threading.RLock()
+_dirty = False
+_flush_timer: Optional[threading.Timer] = None
+
+# Bumped on every save so callers can tell whether data changed
+_config_version = 0
+
+_storage_dir_ready = False
+
+_journal = Journal(JOURNAL_FILE, JOURNAL_ARCHIVE_DIR, fsync=JOURNAL_FSYNC)
+_events_since_snapshot = 0
+
+class ConfigError(Exception):
+    """config.json exists but can't be loaded. Raised instead of falling back to defaults, which would overwrite it"""
+
+def synchronized(func):
+    """Run a storage function under the storage lock.
+
+    Every load -> mutate -> save sequence holds the lock for its whole
+    duration, so concurrent handlers (threads or the async facade) can't
+    interleave and lose each other's updates.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with _io_lock:
+            return func(*args, **kwargs)
+    return wrapper
+
+def _file_stamp() -> Optional[tuple]:
+    """Return (inode, mtime_ns, size) of the config file, or None if it is missing"""
+    try:
+        st = os.stat(CONFIG_FILE)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
 def load_config() -> Dict:
-    """Load configuration from JSON file"""
-    if not os.path.exists(CONFIG_FILE):
-        save_config(DEFAULT_CONFIG)
-        return DEFAULT_CONFIG.copy()
+    """Load configuration, served from the in-memory cache while the file is unchanged"""
+    global _config_cache, _config_stamp, _cache_hits, _cache_misses
     
+    with _io_lock:
+        stamp = _file_stamp()
+        if _config_cache is not None and (_dirty or stamp == _config_stamp):
+            _cache_hits += 1
+            return _config_cache
+        
+        _cache_misses += 1
+        if stamp is None:
+            config = copy.deepcopy(DEFAULT_CONFIG)
+            _replay_journal(config)
+            save_config(config)
+            return config
+        
+        try:
+            with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            _compact_users(config)
+            _replay_journal(config)
+        except JournalError as e:
+            # Never hand out defaults here: the next save would overwrite
+            # config.json and archive the journal, losing both
+            print(f"Error replaying journal: {e}")
+            raise
+        except Exception as e:
+            # Same for an unreadable config.json: only a missing file gets defaults
+            print(f"Error loading config: {e}")
+            raise ConfigError(f"Can't load {CONFIG_FILE}: {e!r}") from e
+        
+        reloaded = _config_cache is not None
+        _config_cache = config
+        _config_stamp = stamp
+        if reloaded:
+            _notify('reload')
+        return config
+
+def _compact_users(config: Dict) -> None:
+    """Replace the referrals.users dicts with UserRecords, one at a time so each parsed dict is freed right away"""
+    referrals = config.get('referrals')
+    users = referrals.get('users') if isinstance(referrals, dict) else None
+    if users:
+        for user_id, data in users.items():
+            if not isinstance(data, UserRecord):
+                users[user_id] = UserRecord.from_dict(data)
+
+def _export_config(config: Dict) -> Dict:
+    """Shallow copy of config with users in the plain config.json layout"""
+    exported = dict(config)
+    referrals = config.get('referrals')
+    if referrals and 'users' in referrals:
+        exported['referrals'] = dict(
+            referrals,
+            users={user_id: record.to_dict() for user_id, record in referrals['users'].items()}
+        )
+    return exported
+
+def _ensure_storage_dir() -> None:
+    """Create STORAGE_DIR on first write instead of at import time"""
+    global _storage_dir_ready
+    if not _storage_dir_ready:
+        os.makedirs(STORAGE_DIR, exist_ok=True)
+        _storage_dir_ready = True
+
+def _write_config(config: Dict) -> None:
+    """Atomically replace the config file: write a temp file, fsync, then rename"""
+    _ensure_storage_dir()
+    fd, tmp_path = tempfile.mkstemp(prefix='.config-', suffix='.tmp', dir=STORAGE_DIR)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            if CONFIG_COMPACT:
+                _dump_compact(config, f)
+            else:
+                json.dump(config, f, indent=2, ensure_ascii=False, default=user_record.encode)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, CONFIG_FILE)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    
+    # Persist the rename itself
     try:
-        with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"Error loading config: {e}")
-        return DEFAULT_CONFIG.copy()
+        dir_fd = os.open(STORAGE_DIR, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+_dumps_compact = functools.partial(
+    json.dumps, ensure_ascii=False, separators=(',', ':'), default=user_record.encode
+)
+
+def _dump_compact(config: Dict, f) -> None:
+    """Write config without indentation, streaming referrals.users in batches of encoded users"""
+    referrals = config.get('referrals')
+    users = referrals.get('users') if isinstance(referrals, dict) else None
+    if not users:
+        f.write(_dumps_compact(config))
+        return
+    
+    # Everything but the users is small: encode it whole, leave its objects
+    # open and append referrals.users as the last key
+    rest = _dumps_compact({key: value for key, value in config.items() if key != 'referrals'})
+    f.write(rest[:-1] + (',' if len(rest) > 2 else '') + '"referrals":')
+    rest = _dumps_compact({key: value for key, value in referrals.items() if key != 'users'})
+    f.write(rest[:-1] + (',' if len(rest) > 2 else '') + '"users":{')
+    
+    items = iter(users.items())
+    separator = ''
+    while True:
+        batch = list(itertools.islice(items, 1000))
+        if not batch:
+            break
+        f.write(separator)
+        f.write(','.join(_dumps_compact(user_id) + ':' + _dumps_compact(record) for user_id, record in batch))
+        separator = ','
+    f.write('}}}')
 
 def save_config(config: Dict) -> bool:
-    """Save configuration to JSON file"""
+    """Save configuration and update the cache. With WRITE_BEHIND_MS the disk write is deferred"""
+    global _config_cache, _dirty, _config_version
+    
+    with _io_lock:
+        _config_cache = config
+        _config_version += 1
+        _dirty = True
+        if WRITE_BEHIND_MS > 0:
+            _schedule_flush()
+            return True
+        return flush_config()
+
+def _schedule_flush() -> None:
+    """Start the write-behind timer unless one is already pending"""
+    global _flush_timer
+    if _flush_timer is None:
+        _flush_timer = threading.Timer(WRITE_BEHIND_MS / 1000, flush_config)
+        _flush_timer.daemon = True
+        _flush_timer.start()
+
+def flush_config() -> bool:
+    """Write pending config changes to disk. Returns False if the write failed"""
+    global _config_stamp, _dirty, _flush_timer
+    
+    with _io_lock:
+        if _flush_timer is not None:
+            _flush_timer.cancel()
+            _flush_timer = None
+        if not _dirty:
+            return True
+        try:
+            _write_config(_config_cache)
+        except Exception as e:
+            print(f"Error saving config: {e}")
+            if WRITE_BEHIND_MS > 0:
+                _schedule_flush()
+            else:
+                # Nothing will retry a synchronous save; re-read the file next time
+                invalidate_config_cache()
+            return False
+        _dirty = False
+        _config_stamp = _file_stamp()
+        _rotate_journal(_config_cache)
+        return True
+
+atexit.register(flush_config)
+
+def _replay_journal(config: Dict) -> None:
+    """Apply journal events newer than the snapshot's journal_seq to a freshly loaded config.
+
+    Raises JournalError if an event can't be read or applied; config is then
+    partly replayed and must be discarded.
+    """
+    global _events_since_snapshot
+    if not STORAGE_JOURNAL:
+        return
+    replayed = 0
+    for event in _journal.read():
+        if event['seq'] <= config.get('journal_seq', 0):
+            continue  # already in the snapshot (crash between snapshot and rotation)
+        try:
+            _apply_event(config, event)
+        except (KeyError, TypeError, ValueError) as e:
+            raise JournalError(f"Can't replay event {event['seq']} ({event['type']}) from {JOURNAL_FILE}: {e!r}") from e
+        config['journal_seq'] = event['seq']
+        replayed += 1
+    _events_since_snapshot = replayed
+    if replayed:
+        print(f"Replayed {replayed} journal events")
+
+def _rotate_journal(config: Dict) -> None:
+    """Archive the journal segment once a snapshot containing all its events is on disk"""
+    global _events_since_snapshot
+    if not STORAGE_JOURNAL:
+        return
     try:
-        with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(config, f, indent=2, ensure_ascii=False)
+        _journal.rotate(f"events-{config.get('journal_seq', 0):012d}.log")
+    except OSError as e:
+        # The events stay in the current segment and are skipped on replay by seq
+        print(f"Error rotating journal: {e}")
+        return
+    _events_since_snapshot = 0
+
+def _record_events(config: Dict, events: List[Dict]) -> bool:
+    """Persist referral changes already applied to config: journal them, or save the whole config"""
+    global _config_version, _events_since_snapshot
+    if not STORAGE_JOURNAL:
+        return save_config(config)
+    if not events:
         return True
-    except Exception as e:
-        print(f"Error saving config: {e}")
-        return False
+    
+    at = user_record.now()
+    seq = config.get('journal_seq', 0)
+    for event in events:
+        seq += 1
+        event['seq'] = seq
+        event.setdefault('at', at)
+    try:
+        _ensure_storage_dir()
+        _journal.append(events)
+    except OSError as e:
+        print(f"Error appending to journal: {e}")
+        config['journal_seq'] = seq
+        return save_config(config)
+    
+    config['journal_seq'] = seq
+    _config_version += 1
+    _events_since_snapshot += len(events)
+    if _events_since_snapshot >= JOURNAL_SNAPSHOT_EVENTS:
+        return save_config(config)
+    return True
+
+def invalidate_config_cache() -> None:
+    """Drop the cached config so the next load_config re-reads the file"""
+    global _config_cache, _config_stamp, _dirty
+    with _io_lock:
+        _config_cache = None
+        _config_stamp = None
+        _dirty = False
 
+def get_cache_stats() -> Dict:
+    """Get config cache hit/miss counters"""
+    return {'hits': _cache_hits, 'misses': _cache_misses}
+
+def get_config_version() -> int:
+    """Get the number of saves made by this process"""
+    return _config_version
+
+# Change listeners are called with a topic after a change is saved:
+# 'welcome' (message or media), 'groups', or 'reload' when config.json
+# was changed on disk by someone else. They run under the storage lock,
+# so they must be cheap and must not call back into storage.
+_change_listeners: List[Callable[[str], None]] = []
+
+def add_change_listener(callback: Callable[[str], None]) -> None:
+    """Register a callback for storage change notifications"""
+    _change_listeners.append(callback)
+
+def _notify(topic: str) -> None:
+    """Call every change listener with topic"""
+    for callback in _change_listeners:
+        try:
+            callback(topic)
+        except Exception as e:
+            print(f"Error in storage change listener: {e}")
+
+_sqlite = None
+
+def _db():
+    """Return the SQLite backend when enabled, opening and migrating it on first use"""
+    global _sqlite
+    if STORAGE_BACKEND != 'sqlite':
+        return None
+    if _sqlite is None:
+        import storage_sqlite
+        _ensure_storage_dir()
+        storage_sqlite.connect(SQLITE_FILE)
+        if not storage_sqlite.is_migrated():
+            count = storage_sqlite.migrate_from_config(_export_config(load_config()))
+            print(f"Migrated {count} users from {CONFIG_FILE} to {SQLITE_FILE}")
+        _sqlite = storage_sqlite
+    return _sqlite
+
+@synchronized
+def init() -> None:
+    """Create the storage directory and preload config, indexes and the SQLite backend.
+
+    Nothing here is required (everything is built on first use), but doing it
+    once at startup keeps that cost off the first requests.
+    """
+    _ensure_storage_dir()
+    config = load_config()
+    _get_aggregates(config)
+    _get_group_index(config)
+    _get_leaderboard(config)
+    _get_deletions_heap()
+    _get_invite_pools()
+    _get_broadcast_state()
+    _db()
+
+@synchronized
 def get_welcome_message() -> str:
     """Get the current welcome message"""
     config = load_config()
     return config.get('welcome_message', DEFAULT_CONFIG['welcome_message'])
 
+@synchronized
 def update_welcome_message(message: str) -> bool:
     """Update the welcome message"""
     config = load_config()
     config['welcome_message'] = message
-    return save_config(config)
+    saved = save_config(config)
+    _notify('welcome')
+    return saved
 
+@synchronized
 def get_welcome_media() -> tuple:
     """Get the welcome media (file_id, media_type)"""
     config = load_config()
     return (config.get('welcome_media'), config.get('welcome_media_type'))
 
+@synchronized
 def update_welcome_media(file_id: str, media_type: str) -> bool:
     """Update the welcome media"""
     config = load_config()
     config['welcome_media'] = file_id
     config['welcome_media_type'] = media_type
-    return save_config(config)
+    saved = save_config(config)
+    _notify('welcome')
+    return saved
 
+@synchronized
 def remove_welcome_media() -> bool:
     """Remove the welcome media"""
     config = load_config()
     config['welcome_media'] = None
     config['welcome_media_type'] = None
-    return save_config(config)
+    saved = save_config(config)
+    _notify('welcome')
+    return saved
+
+# Groups indexed by id, invite_link and Telegram chat id for O(1) lookups on
+# the join_ path and for membership updates. Built once per loaded config
+# object and kept in sync by add/delete_group.
+_groups_by_id: Dict[str, Dict] = {}
+_groups_by_link: Dict[str, Dict] = {}
+_groups_by_chat_id: Dict[int, Dict] = {}
+_group_index_config: Optional[Dict] = None
+
+def _rebuild_group_index(config: Dict) -> None:
+    """Force the group index to be rebuilt from config on next use"""
+    global _group_index_config
+    _group_index_config = None
+    _get_group_index(config)
 
+def _get_group_index(config: Dict) -> tuple:
+    """Return (by_id, by_invite_link, by_chat_id) for this config object, rebuilding after a reload"""
+    global _groups_by_id, _groups_by_link, _groups_by_chat_id, _group_index_config
+    if config is not _group_index_config:
+        _groups_by_id = {}
+        _groups_by_link = {}
+        _groups_by_chat_id = {}
+        for group in config.get('groups', []):
+            _groups_by_id.setdefault(group.get('id'), group)
+            _groups_by_link.setdefault(group.get('invite_link'), group)
+            if group.get('chat_id') is not None:
+                _groups_by_chat_id.setdefault(group['chat_id'], group)
+        _group_index_config = config
+    return _groups_by_id, _groups_by_link, _groups_by_chat_id
+
+@synchronized
 def get_groups() -> List[Dict]:
     """Get all groups"""
+    db = _db()
+    if db:
+        return db.get_groups()
     config = load_config()
     return config.get('groups', [])
 
+@synchronized
 def get_group_by_id(group_id: str) -> Optional[Dict]:
     """Get a specific group by ID"""
-    groups = get_groups()
-    for group in groups:
-        if group.get('id') == group_id:
-            return group
-    return None
+    db = _db()
+    if db:
+        return db.get_group_by_id(group_id)
+    by_id, _, _ = _get_group_index(load_config())
+    return by_id.get(group_id)
+
+@synchronized
+def get_group_by_chat_id(chat_id: int) -> Optional[Dict]:
+    """Get the group with the given Telegram chat id, if one is configured"""
+    db = _db()
+    if db:
+        return db.get_group_by_chat_id(chat_id)
+    _, _, by_chat_id = _get_group_index(load_config())
+    return by_chat_id.get(chat_id)
 
-def add_group(name: str, invite_link: str) -> Dict:
-    """Add a new group with its invite link"""
+@synchronized
+def add_group(name: str, invite_link: str, chat_id: Optional[int] = None) -> Dict:
+    """Add a new group with its invite link. With a chat_id, joins are verified from membership updates"""
+    db = _db()
+    if db:
+        new_group = db.add_group(name, invite_link, chat_id)
+        _notify('groups')
+        return new_group
     config = load_config()
     
     new_group = {
         'id': str(uuid.uuid4()),
         'name': name,
-        'invite_link': invite_link
+        'invite_link': invite_link,
+        'chat_id': chat_id
     }
     
+    by_id, by_link, by_chat_id = _get_group_index(config)
     config['groups'].append(new_group)
+    by_id[new_group['id']] = new_group
+    by_link.setdefault(invite_link, new_group)
+    if chat_id is not None:
+        by_chat_id.setdefault(chat_id, new_group)
     save_config(config)
+    _notify('groups')
     return new_group
 
+@synchronized
 def delete_group(group_id: str) -> bool:
     """Delete a group by ID"""
+    db = _db()
+    if db:
+        deleted = db.delete_group(group_id)
+        if deleted:
+            _notify('groups')
+        return deleted
     config = load_config()
     groups = config.get('groups', [])
     
@@ -112,30 +549,139 @@ def delete_group(group_id: str) -> bool:
         return False  # Group not found
     
     config['groups'] = new_groups
-    return save_config(config)
+    _rebuild_group_index(config)
+    saved = save_config(config)
+    _notify('groups')
+    return saved
 
+@synchronized
 def group_exists(invite_link: str) -> bool:
     """Check if a group with the given invite_link already exists"""
-    groups = get_groups()
-    return any(g.get('invite_link') == invite_link for g in groups)
+    db = _db()
+    if db:
+        return db.group_exists(invite_link)
+    _, by_link, _ = _get_group_index(load_config())
+    return invite_link in by_link
 
 # ============================================
 # Referral System Functions
 # ============================================
 
+# Referral counts belong to a competition period. Starting a new period
+# archives the current top LEADERBOARD_SIZE and bumps the period id; users
+# keep their old counts, which read as 0 until they are credited again.
+def _get_competition(config: Dict) -> Dict:
+    """Return config['competition'], creating it for files that predate periods"""
+    competition = config.get('competition')
+    if not isinstance(competition, dict):
+        competition = config['competition'] = {'period': 1, 'started_at': None, 'archive': []}
+    return competition
+
+def _current_period(config: Dict) -> int:
+    competition = config.get('competition')
+    return competition['period'] if competition else 1
+
+# Top referrers of the current period kept sorted by referral_count so the
+# stats screen is O(K). Counts only grow within a period, so a user who drops
+# out of the top K can only come back through an increment, which re-checks them.
+LEADERBOARD_SIZE = int(os.getenv('LEADERBOARD_SIZE', '50'))
+
+_leaderboard: List[str] = []
+_leaderboard_config: Optional[Dict] = None
+
+def _get_leaderboard(config: Dict) -> List[str]:
+    """Return the top-K user ids for this config object, rebuilding it after a reload"""
+    global _leaderboard, _leaderboard_config
+    if config is not _leaderboard_config:
+        users = config.get('referrals', {}).get('users', {})
+        period = _current_period(config)
+        _leaderboard = heapq.nlargest(
+            LEADERBOARD_SIZE,
+            (uid for uid, record in users.items() if record.count_in(period) > 0),
+            key=lambda uid: users[uid].referral_count
+        )
+        _leaderboard_config = config
+    return _leaderboard
+
+def _leaderboard_update(config: Dict, user_id: str) -> None:
+    """Re-rank a user whose referral_count just increased (all ranked users are in the current period)"""
+    leaderboard = _get_leaderboard(config)
+    users = config['referrals']['users']
+    count = users[user_id].referral_count
+    
+    if user_id not in leaderboard:
+        if len(leaderboard) >= LEADERBOARD_SIZE and count <= users[leaderboard[-1]].referral_count:
+            return
+        leaderboard.append(user_id)
+    
+    leaderboard.sort(key=lambda uid: users[uid].referral_count, reverse=True)
+    del leaderboard[LEADERBOARD_SIZE:]
+
+# Aggregate counters persisted in referrals.stats and updated by the
+# mutators, so the admin screens don't scan every user
+AGGREGATE_KEYS = ('total_users', 'joined_users', 'total_referrals')
+
+def _compute_aggregates(users: Dict, period: int) -> Dict:
+    """Recompute the aggregate counters from scratch; total_referrals counts the given period"""
+    stats = {key: 0 for key in AGGREGATE_KEYS}
+    for record in users.values():
+        stats['total_users'] += 1
+        if record.has_joined_group:
+            stats['joined_users'] += 1
+        stats['total_referrals'] += record.count_in(period)
+    return stats
+
+def _get_aggregates(config: Dict) -> Dict:
+    """Return the stored counters, computing them once for files that predate them.
+
+    Mutators must call this before changing users so the counters they
+    increment start from the pre-change state.
+    """
+    referrals = config.setdefault('referrals', {})
+    users = referrals.setdefault('users', {})
+    stats = referrals.get('stats')
+    if not isinstance(stats, dict) or any(key not in stats for key in AGGREGATE_KEYS):
+        stats = _compute_aggregates(users, _current_period(config))
+        referrals['stats'] = stats
+    return stats
+
+@synchronized
 def get_referral_data(user_id: str) -> Optional[Dict]:
     """Get referral data for a specific user"""
+    db = _db()
+    if db:
+        return db.get_referral_data(user_id)
     config = load_config()
     referrals = config.get('referrals', {})
     users = referrals.get('users', {})
-    return users.get(str(user_id))
+    record = users.get(str(user_id))
+    if not record:
+        return None
+    data = record.to_dict()
+    period = _current_period(config)
+    if record.period != period:
+        # A count from an earlier period reads as 0
+        data.update(referral_count=0, period=period)
+    return data
 
+@synchronized
 def register_user(user_id: str, referred_by: Optional[str] = None, username: Optional[str] = None, first_name: Optional[str] = None) -> bool:
     """Register a new user or update existing user with referrer info"""
-    from datetime import datetime
-    
+    db = _db()
+    if db:
+        return db.register_user(user_id, referred_by, username, first_name)
     config = load_config()
-    
+    at = user_record.now()
+    if not _apply_register(config, user_id, referred_by, username, first_name, at):
+        return False  # User already registered
+    return _record_events(config, [{
+        'type': 'user_registered', 'user_id': str(user_id),
+        'referred_by': str(referred_by) if referred_by else None,
+        'username': username, 'first_name': first_name, 'at': at
+    }])
+
+def _apply_register(config: Dict, user_id: str, referred_by: Optional[str], username: Optional[str], first_name: Optional[str], at: int) -> bool:
+    """Add a new user to the loaded config without saving. Returns False if already registered"""
     # Ensure referrals structure exists
     if 'referrals' not in config:
         config['referrals'] = {'users': {}}
@@ -144,30 +690,30 @@ def register_user(user_id: str, referred_by: Optional[str] = None, username: Opt
     
     user_id_str = str(user_id)
     users = config['referrals']['users']
+    stats = _get_aggregates(config)
     
     # If user already exists, don't override their referrer
     if user_id_str in users:
         return False  # User already registered
     
     # Create new user entry (tracking joined groups)
-    users[user_id_str] = {
-        'referral_count': 0,
-        'referred_by': str(referred_by) if referred_by else None,
-        'joined_at': datetime.utcnow().isoformat(),
-        'has_joined_group': False,  # Track if they've completed joining
-        'groups_joined': [],  # Track which groups they've joined
-        'username': username,  # Store username for display
-        'first_name': first_name  # Store first name as backup
-    }
+    users[user_id_str] = UserRecord(
+        period=_current_period(config),
+        referred_by=str(referred_by) if referred_by else None,
+        joined_at=at,
+        username=username,  # Store username for display
+        first_name=first_name  # Store first name as backup
+    )
     
-    # Don't increment referral count yet - only when they join all required groups
+    stats['total_users'] += 1
     
-    return save_config(config)
+    # Don't increment referral count yet - only when they join all required groups
+    return True
 
-def mark_user_joined_group(user_id: str, group_id: str, total_groups: int) -> bool:
-    """Mark that a user has clicked join for a group. Count referral only when all groups joined (if 3+)"""
-    config = load_config()
-    
+def _apply_group_join(config: Dict, user_id: str, group_id: str, total_groups: int, at: Optional[int] = None) -> bool:
+    """Record a group join on the loaded config without saving. Returns mark_user_joined_group's result"""
+    if at is None:
+        at = user_record.now()
     # Ensure referrals structure exists
     if 'referrals' not in config:
         config['referrals'] = {'users': {}}
@@ -176,133 +722,849 @@ def mark_user_joined_group(user_id: str, group_id: str, total_groups: int) -> bo
     
     user_id_str = str(user_id)
     users = config['referrals']['users']
+    stats = _get_aggregates(config)
     
     # If user doesn't exist, create them first
-    if user_id_str not in users:
-        from datetime import datetime
-        users[user_id_str] = {
-            'referral_count': 0,
-            'referred_by': None,
-            'joined_at': datetime.utcnow().isoformat(),
-            'has_joined_group': False,
-            'groups_joined': [group_id],
-            'username': None,
-            'first_name': None
-        }
-    else:
-        # Add group to joined list if not already there
-        groups_joined = users[user_id_str].get('groups_joined', [])
-        if group_id not in groups_joined:
-            groups_joined.append(group_id)
-            users[user_id_str]['groups_joined'] = groups_joined
+    record = users.get(user_id_str)
+    if record is None:
+        record = users[user_id_str] = UserRecord(period=_current_period(config), joined_at=at)
+        stats['total_users'] += 1
     
-    # Check if user has joined enough groups to count as referral
-    groups_joined = users[user_id_str].get('groups_joined', [])
+    # Add group to joined list if not already there
+    record.add_group(group_id)
     
     # If already counted, don't count again
-    if users[user_id_str].get('has_joined_group', False):
-        return save_config(config)
+    if record.has_joined_group:
+        return True
     
     # Determine if referral should be counted
     # MUST join ALL groups, regardless of how many there are
-    should_count = len(groups_joined) >= total_groups
+    should_count = len(record.groups) >= total_groups
     
     if should_count:
         # Mark user as having completed joining
-        users[user_id_str]['has_joined_group'] = True
+        record.has_joined_group = True
+        stats['joined_users'] += 1
         
         # If this user was referred by someone, NOW increment their referral count
-        referred_by = users[user_id_str].get('referred_by')
+        referred_by = record.referred_by
         if referred_by and str(referred_by) in users:
-            users[str(referred_by)]['referral_count'] += 1
-            save_config(config)
+            users[str(referred_by)].credit(_current_period(config))
+            stats['total_referrals'] += 1
+            _leaderboard_update(config, str(referred_by))
             return True  # Referral was counted
         elif referred_by:
             # Create the referrer entry if they don't exist yet
-            from datetime import datetime
-            users[str(referred_by)] = {
-                'referral_count': 1,
-                'referred_by': None,
-                'joined_at': datetime.utcnow().isoformat(),
-                'has_joined_group': False,
-                'groups_joined': [],
-                'username': None,
-                'first_name': None
-            }
-            save_config(config)
+            users[str(referred_by)] = UserRecord(referral_count=1, period=_current_period(config), joined_at=at)
+            stats['total_users'] += 1
+            stats['total_referrals'] += 1
+            _leaderboard_update(config, str(referred_by))
             return True  # Referral was counted
     
-    save_config(config)
     return False  # Not yet counted
 
+@synchronized
+def mark_user_joined_group(user_id: str, group_id: str, total_groups: int) -> bool:
+    """Mark that a user has clicked join for a group. Count referral only when all groups joined (if 3+)"""
+    db = _db()
+    if db:
+        return db.mark_user_joined_group(user_id, group_id, total_groups)
+    config = load_config()
+    record = config.get('referrals', {}).get('users', {}).get(str(user_id))
+    if record is not None and record.has_joined_group and record.has_group(group_id):
+        return True  # Repeated click after completing, nothing to record
+    
+    already_counted = record is not None and record.has_joined_group
+    at = user_record.now()
+    counted = _apply_group_join(config, user_id, group_id, total_groups, at)
+    events = [{
+        'type': 'group_clicked', 'user_id': str(user_id), 'group_id': group_id,
+        'total_groups': total_groups, 'at': at
+    }]
+    if counted and not already_counted:
+        events.append(_credit_event(config, user_id))
+    saved = _record_events(config, events)
+    return counted and saved
+
+@synchronized
+def record_group_memberships(events: List[tuple]) -> int:
+    """Apply a batch of (chat_id, user_id, is_member) membership changes in one save.
+
+    Joins of registered users to configured groups are recorded like a join
+    click; leaves undo a join that hasn't completed all groups yet. Events
+    for other chats or users are ignored. Returns the number of referrals credited.
+    """
+    db = _db()
+    if db:
+        return db.record_group_memberships(events)
+    config = load_config()
+    _, _, by_chat_id = _get_group_index(config)
+    users = config.get('referrals', {}).get('users', {})
+    total_groups = len(config.get('groups', []))
+    
+    at = user_record.now()
+    changes = []
+    credited = 0
+    for chat_id, user_id, is_member in events:
+        group = by_chat_id.get(chat_id)
+        record = users.get(str(user_id))
+        if not group or not record:
+            continue
+        change = {
+            'user_id': str(user_id), 'group_id': group['id'],
+            'total_groups': total_groups, 'at': at
+        }
+        if is_member:
+            if record.has_group(group['id']):
+                continue
+            already_counted = record.has_joined_group
+            counted = _apply_group_join(config, user_id, group['id'], total_groups, at)
+            changes.append(dict(change, type='group_joined'))
+            if counted and not already_counted:
+                credited += 1
+                changes.append(_credit_event(config, user_id))
+        elif not record.has_joined_group and record.remove_group(group['id']):
+            changes.append(dict(change, type='group_left'))
+    
+    if changes:
+        _record_events(config, changes)
+    return credited
+
+def _credit_event(config: Dict, user_id: str) -> Dict:
+    """Audit event for a referral credited by user_id's join; replay recomputes it from the join"""
+    referred_by = config['referrals']['users'][str(user_id)].referred_by
+    return {'type': 'referral_credited', 'user_id': str(referred_by), 'referred': str(user_id)}
+
+def _apply_event(config: Dict, event: Dict) -> None:
+    """Re-apply a journal event to a config loaded from an older snapshot"""
+    kind = event['type']
+    if kind == 'user_registered':
+        _apply_register(
+            config, event['user_id'], event['referred_by'],
+            event['username'], event['first_name'], event['at']
+        )
+    elif kind in ('group_clicked', 'group_joined'):
+        _apply_group_join(config, event['user_id'], event['group_id'], event['total_groups'], event['at'])
+    elif kind == 'group_left':
+        record = config.get('referrals', {}).get('users', {}).get(event['user_id'])
+        if record is not None and not record.has_joined_group:
+            record.remove_group(event['group_id'])
+    elif kind == 'period_started':
+        _apply_new_period(config, event['at'])
+    elif kind == 'counts_reset':
+        # Written by reset_all_referral_counts before competition periods;
+        # starting a period is what a reset means now
+        _apply_new_period(config, event.get('at'))
+    elif kind != 'referral_credited':  # referral_credited is only an audit record
+        raise ValueError(f"unknown event type {kind!r}")
+
+@synchronized
 def get_user_referral_count(user_id: str) -> int:
     """Get the number of users referred by this user"""
-    data = get_referral_data(user_id)
-    if not data:
-        return 0
-    return data.get('referral_count', 0)
+    db = _db()
+    if db:
+        data = db.get_referral_data(user_id)
+        return data['referral_count'] if data else 0
+    config = load_config()
+    record = config.get('referrals', {}).get('users', {}).get(str(user_id))
+    return record.count_in(_current_period(config)) if record else 0
 
+@synchronized
 def get_all_referral_stats() -> List[Dict]:
     """Get all users with their referral stats, sorted by referral count"""
+    db = _db()
+    if db:
+        return db.get_all_referral_stats()
     config = load_config()
     referrals = config.get('referrals', {})
     users = referrals.get('users', {})
+    period = _current_period(config)
     
     stats = []
-    for user_id, data in users.items():
+    for user_id, record in users.items():
         stats.append({
             'user_id': user_id,
-            'referral_count': data.get('referral_count', 0),
-            'referred_by': data.get('referred_by'),
-            'joined_at': data.get('joined_at')
+            'referral_count': record.count_in(period),
+            'referred_by': record.referred_by,
+            'joined_at': user_record.to_iso(record.joined_at)
         })
     
     # Sort by referral count (highest first)
     stats.sort(key=lambda x: x['referral_count'], reverse=True)
     return stats
 
+@synchronized
+def get_top_referrers(limit: int = 10) -> List[Dict]:
+    """Get the top referrers with referral_count > 0, highest first (at most LEADERBOARD_SIZE)"""
+    db = _db()
+    if db:
+        return db.get_top_referrers(limit)
+    config = load_config()
+    users = config.get('referrals', {}).get('users', {})
+    
+    top = []
+    for user_id in _get_leaderboard(config)[:limit]:
+        record = users[user_id]
+        top.append({
+            'user_id': user_id,
+            'referral_count': record.referral_count,
+            'username': record.username,
+            'first_name': record.first_name
+        })
+    return top
+
+@synchronized
 def get_total_users() -> int:
     """Get total number of registered users"""
-    config = load_config()
-    referrals = config.get('referrals', {})
-    users = referrals.get('users', {})
-    return len(users)
+    db = _db()
+    if db:
+        return db.get_total_users()
+    return _get_aggregates(load_config())['total_users']
 
+@synchronized
 def get_total_referrals() -> int:
     """Get total number of successful referrals (users who joined groups)"""
-    config = load_config()
-    referrals = config.get('referrals', {})
-    users = referrals.get('users', {})
-    
-    total = 0
-    for data in users.values():
-        total += data.get('referral_count', 0)
-    return total
+    db = _db()
+    if db:
+        return db.get_total_referrals()
+    return _get_aggregates(load_config())['total_referrals']
 
+@synchronized
 def get_users_who_joined_groups() -> int:
     """Get count of users who have joined at least one group"""
+    db = _db()
+    if db:
+        return db.get_users_who_joined_groups()
+    return _get_aggregates(load_config())['joined_users']
+
+@synchronized
+def check_aggregates(fix: bool = True) -> Dict:
+    """Recompute aggregate counters from scratch and compare them with the stored ones.
+
+    Returns {'stored': ..., 'actual': ..., 'consistent': bool}. With fix=True
+    mismatched counters are overwritten with the recomputed values.
+    """
+    db = _db()
+    if db:
+        return db.check_aggregates(fix)
     config = load_config()
-    referrals = config.get('referrals', {})
-    users = referrals.get('users', {})
+    stored = dict(_get_aggregates(config))
+    actual = _compute_aggregates(config['referrals']['users'], _current_period(config))
+    consistent = stored == actual
     
-    count = 0
-    for data in users.values():
-        if data.get('has_joined_group', False):
-            count += 1
-    return count
+    if not consistent and fix:
+        config['referrals']['stats'] = actual
+        save_config(config)
+    
+    return {'stored': stored, 'actual': actual, 'consistent': consistent}
+
+def get_snapshot_source(since_version: Optional[int] = None) -> Optional[tuple]:
+    """Data for a stats snapshot: (version, aggregates, rows), or None if unchanged since since_version.
+
+    rows yields (user_id, referral_count, joined_at, has_joined_group,
+    referred_by, username, first_name) with joined_at as an epoch int. With
+    the JSON backend only the list of user IDs is copied under the lock; rows
+    are read from the live records afterwards, so counts may be slightly
+    newer than the aggregates. The SQLite backend reads everything on its own
+    read-only connection without taking the lock.
+    """
+    if STORAGE_BACKEND == 'sqlite':
+        if _sqlite is None:
+            with _io_lock:
+                _ensure_storage_dir()
+                _db()
+        source = _sqlite.get_snapshot_source(since_version)
+        if source is None:
+            return None
+        version, aggregates, rows = source
+        return version, aggregates, (
+            (user_id, count, _snapshot_epoch(joined_at), bool(joined), referred_by, username, first_name)
+            for user_id, count, joined_at, joined, referred_by, username, first_name in rows
+        )
+    
+    with _io_lock:
+        _ensure_storage_dir()
+        config = load_config()
+        version = _config_version
+        if since_version is not None and since_version == version:
+            return None
+        aggregates = dict(_get_aggregates(config))
+        users = config.get('referrals', {}).get('users', {})
+        period = _current_period(config)
+        # Only the keys: a million (id, record) tuples would also set off
+        # several full garbage collections while the lock is held
+        user_ids = list(users)
+    rows = (
+        (user_id, record.count_in(period), record.joined_at, record.has_joined_group,
+         record.referred_by, record.username, record.first_name)
+        for user_id, record in zip(user_ids, map(users.__getitem__, user_ids))
+    )
+    return version, aggregates, rows
+
+def _snapshot_epoch(joined_at: Optional[str]) -> Optional[int]:
+    """Epoch int of a stored ISO timestamp, None if missing or unparseable"""
+    try:
+        return user_record.to_epoch(joined_at) if joined_at else None
+    except ValueError:
+        return None
 
+@synchronized
 def reset_all_referral_counts() -> bool:
-    """Reset referral counts for all users to 0 (for new competitions/weeks)"""
+    """Reset referral counts for all users to 0 (for new competitions/weeks) by starting a new period"""
+    return start_new_period() is not None
+
+
+# ============================================
+# Competition Periods
+# ============================================
+
+@synchronized
+def get_competition() -> Dict:
+    """Get the current period: {'period': id, 'started_at': ISO timestamp or None}"""
+    db = _db()
+    if db:
+        return db.get_competition()
+    competition = _get_competition(load_config())
+    return {'period': competition['period'], 'started_at': competition['started_at']}
+
+@synchronized
+def start_new_period() -> Optional[Dict]:
+    """Archive the current period's top referrers and start the next period.
+
+    No user is touched: their counts belong to the finished period and read
+    as 0 from now on. Returns the archived period, or None if saving failed.
+    """
+    db = _db()
+    if db:
+        return db.start_new_period(LEADERBOARD_SIZE)
     config = load_config()
+    at = user_record.now()
+    archived = _apply_new_period(config, at)
+    if not _record_events(config, [{'type': 'period_started', 'period': archived['period'] + 1, 'at': at}]):
+        return None
+    return archived
+
+def _apply_new_period(config: Dict, at: int) -> Dict:
+    """Archive the current period on the loaded config without saving. Returns the archive entry"""
+    competition = _get_competition(config)
+    stats = _get_aggregates(config)
+    users = config['referrals']['users']
     
-    if 'referrals' not in config or 'users' not in config['referrals']:
-        return True  # Nothing to reset
+    archived = {
+        'period': competition['period'],
+        'started_at': competition['started_at'],
+        'ended_at': user_record.to_iso(at),
+        'total_referrals': stats['total_referrals'],
+        'top': [
+            {
+                'user_id': user_id,
+                'referral_count': users[user_id].referral_count,
+                'username': users[user_id].username,
+                'first_name': users[user_id].first_name
+            }
+            for user_id in _get_leaderboard(config)
+        ]
+    }
+    competition['archive'].append(archived)
+    competition['period'] += 1
+    competition['started_at'] = archived['ended_at']
+    stats['total_referrals'] = 0
     
-    users = config['referrals']['users']
+    if config is _leaderboard_config:
+        _leaderboard.clear()
+    return archived
+
+@synchronized
+def get_archived_periods() -> List[Dict]:
+    """Get finished periods, newest first, without their leaderboards"""
+    db = _db()
+    if db:
+        return db.get_archived_periods()
+    archive = _get_competition(load_config())['archive']
+    return [
+        {key: entry[key] for key in ('period', 'started_at', 'ended_at', 'total_referrals')}
+        for entry in reversed(archive)
+    ]
+
+@synchronized
+def get_period_leaderboard(period: int, limit: int = 10) -> Optional[List[Dict]]:
+    """Get the top referrers of a period, current or archived. None if there is no such period"""
+    db = _db()
+    if db:
+        return db.get_period_leaderboard(period, limit)
+    competition = _get_competition(load_config())
+    if period == competition['period']:
+        return get_top_referrers(limit)
+    for entry in reversed(competition['archive']):
+        if entry['period'] == period:
+            return entry['top'][:limit]
+    return None
+
+
+# ============================================
+# Scheduled Message Deletions
+# ============================================
+
+# Pending deletions are a heap of [delete_at, chat_id, message_id] entries,
+# so the next due entry is always at index 0. The heap lives in memory and is
+# persisted in its own small log, DELETIONS_FILE (one line per scheduled
+# batch or sweep), instead of in config.json: every referral message adds
+# one, and rewriting the whole config for each would dwarf the change.
+DELETIONS_FILE = os.path.join(STORAGE_DIR, 'deletions.log')
+
+def _apply_deletion_event(heap: List[list], event: Dict) -> None:
+    kind = event['type']
+    if kind == 'state':
+        heap[:] = [list(entry) for entry in event['entries']]
+        heapq.heapify(heap)
+    elif kind == 'scheduled':
+        for delete_at, chat_id, message_id in event['entries']:
+            heapq.heappush(heap, [delete_at, chat_id, message_id])
+    elif kind == 'popped':
+        for _ in range(event['count']):
+            heapq.heappop(heap)
+    else:
+        raise ValueError(f"unknown event type {kind!r}")
+
+_deletions_log = StateLog(DELETIONS_FILE, _apply_deletion_event, fsync=JOURNAL_FSYNC)
+_deletions_heap: Optional[List[list]] = None
+
+def _get_deletions_heap() -> List[list]:
+    """Return the pending deletions heap, loading it from DELETIONS_FILE on first use"""
+    global _deletions_heap
+    if _deletions_heap is None:
+        heap = _deletions_log.load([])
+        # Deletions scheduled before they moved out of config.json
+        config = load_config()
+        legacy = config.get('pending_deletions')
+        if legacy:
+            for entry in legacy:
+                heapq.heappush(heap, list(entry))
+            _ensure_storage_dir()
+            _deletions_log.compact({'type': 'state', 'entries': heap})
+        _deletions_heap = heap
+        if 'pending_deletions' in config:
+            del config['pending_deletions']
+            save_config(config)
+    return _deletions_heap
+
+def _record_deletions(event: Dict) -> bool:
+    """Append a change already made to the deletions heap to DELETIONS_FILE"""
+    try:
+        _ensure_storage_dir()
+        _deletions_log.record(event, lambda: {'type': 'state', 'entries': _deletions_heap})
+    except OSError as e:
+        print(f"Error saving pending deletions: {e}")
+        return False
+    return True
+
+@synchronized
+def schedule_message_deletions(entries: List[tuple]) -> bool:
+    """Persist (chat_id, message_id, delete_at) messages to be deleted at their unix timestamps"""
+    if not entries:
+        return True
+    heap = _get_deletions_heap()
+    scheduled = [[delete_at, chat_id, message_id] for chat_id, message_id, delete_at in entries]
+    for entry in scheduled:
+        heapq.heappush(heap, entry)
+    return _record_deletions({'type': 'scheduled', 'entries': scheduled})
+
+def schedule_message_deletion(chat_id: int, message_id: int, delete_at: float) -> bool:
+    """Persist a message to be deleted at the given unix timestamp"""
+    return schedule_message_deletions([(chat_id, message_id, delete_at)])
+
+@synchronized
+def pop_due_deletions(now: float, limit: int = 1000) -> List[tuple]:
+    """Remove and return up to limit (chat_id, message_id) pairs due at or before now"""
+    heap = _get_deletions_heap()
     
-    # Reset all referral counts to 0
-    for user_data in users.values():
-        user_data['referral_count'] = 0
+    due = []
+    while heap and heap[0][0] <= now and len(due) < limit:
+        _, chat_id, message_id = heapq.heappop(heap)
+        due.append((chat_id, message_id))
     
-    return save_config(config)
+    if due:
+        _record_deletions({'type': 'popped', 'count': len(due)})
+    return due
 
+@synchronized
+def get_pending_deletion_count() -> int:
+    """Get the number of messages waiting to be deleted"""
+    return len(_get_deletions_heap())
+
+# ============================================
+# Broadcasts
+# ============================================
+
+# Key snapshot for paging through the users dict: (user ids, index of the
+# next chunk, the id right before it). Consecutive chunks continue from the
+# index instead of scanning the dict again.
+_user_ids_cursor: Optional[tuple] = None
+
+@synchronized
+def get_user_ids_chunk(after: Optional[str], limit: int) -> List[str]:
+    """Get up to limit registered user ids following the user id after, in registration order.
+
+    Pass None for the first chunk and the last id returned for the next one.
+    Users registered meanwhile are picked up at the end. Returns [] if after
+    isn't registered (anymore).
+    """
+    global _user_ids_cursor
+    db = _db()
+    if db:
+        return db.get_user_ids_chunk(after, limit)
+    
+    cursor = _user_ids_cursor
+    if cursor is not None and cursor[2] == after and cursor[1] < len(cursor[0]):
+        keys, start = cursor[0], cursor[1]
+    else:
+        # First chunk, resume after a restart, or end of the snapshot: take a
+        # new one. New users are appended to the dict, so they follow after.
+        users = load_config().get('referrals', {}).get('users', {})
+        if after is not None and after not in users:
+            return []
+        keys = list(users)
+        start = keys.index(after) + 1 if after is not None else 0
+    
+    chunk = keys[start:start + limit]
+    _user_ids_cursor = (keys, start + len(chunk), chunk[-1] if chunk else after)
+    return chunk
+
+# The current (or last) broadcast and the users who blocked the bot live in
+# memory, persisted in their own log, BROADCAST_FILE, like the deletion
+# queue: a broadcast checkpoints every chunk, and rewriting config.json under
+# the storage lock for each would stall every other request.
+BROADCAST_FILE = os.path.join(STORAGE_DIR, 'broadcast.log')
+
+def _apply_broadcast_event(state: Dict, event: Dict) -> None:
+    kind = event['type']
+    if kind == 'state':
+        state['broadcast'] = event['broadcast']
+        state['blocked_users'] = dict(event['blocked_users'])
+    elif kind == 'broadcast':
+        state['broadcast'] = event['broadcast']
+    elif kind == 'progress':
+        state['broadcast'].update(event['progress'])
+    elif kind == 'blocked':
+        for user_id in event['user_ids']:
+            state['blocked_users'][user_id] = event['at']
+    elif kind == 'unblocked':
+        state['blocked_users'].pop(event['user_id'], None)
+    else:
+        raise ValueError(f"unknown event type {kind!r}")
+
+_broadcast_log = StateLog(BROADCAST_FILE, _apply_broadcast_event, fsync=JOURNAL_FSYNC)
+_broadcast_state: Optional[Dict] = None
+
+def _get_broadcast_state() -> Dict:
+    """Return {'broadcast', 'blocked_users'}, loading them from BROADCAST_FILE on first use"""
+    global _broadcast_state
+    if _broadcast_state is None:
+        state = _broadcast_log.load({'broadcast': None, 'blocked_users': {}})
+        # Kept in config.json by older versions
+        config = load_config()
+        if config.get('broadcast') or config.get('blocked_users'):
+            if config.get('broadcast'):
+                state['broadcast'] = config['broadcast']
+            state['blocked_users'].update(config.get('blocked_users') or {})
+            _ensure_storage_dir()
+            _broadcast_log.compact(dict(state, type='state'))
+        _broadcast_state = state
+        if 'broadcast' in config or 'blocked_users' in config:
+            config.pop('broadcast', None)
+            config.pop('blocked_users', None)
+            save_config(config)
+    return _broadcast_state
+
+def _record_broadcast(event: Dict) -> bool:
+    """Append a change already made to the broadcast state to BROADCAST_FILE"""
+    try:
+        _ensure_storage_dir()
+        _broadcast_log.record(event, lambda: dict(_broadcast_state, type='state'))
+    except OSError as e:
+        print(f"Error saving broadcast state: {e}")
+        return False
+    return True
+
+@synchronized
+def get_blocked_user_ids() -> List[str]:
+    """Get ids of users who blocked the bot or deleted their account"""
+    return list(_get_broadcast_state()['blocked_users'])
+
+@synchronized
+def mark_users_blocked(user_ids: List[str]) -> bool:
+    """Remember users that can't be messaged so broadcasts skip them"""
+    if not user_ids:
+        return True
+    from datetime import datetime
+    blocked = _get_broadcast_state()['blocked_users']
+    user_ids = [str(user_id) for user_id in user_ids]
+    now = datetime.utcnow().isoformat()
+    for user_id in user_ids:
+        blocked[user_id] = now
+    return _record_broadcast({'type': 'blocked', 'user_ids': user_ids, 'at': now})
+
+@synchronized
+def clear_user_blocked(user_id: str) -> bool:
+    """Forget a blocked mark once the user talks to the bot again. Returns True if one was cleared"""
+    blocked = _get_broadcast_state()['blocked_users']
+    if str(user_id) not in blocked:
+        return False
+    del blocked[str(user_id)]
+    _record_broadcast({'type': 'unblocked', 'user_id': str(user_id)})
+    return True
+
+@synchronized
+def get_broadcast() -> Optional[Dict]:
+    """Get the state of the current or last broadcast"""
+    broadcast = _get_broadcast_state()['broadcast']
+    return dict(broadcast) if broadcast else None
+
+@synchronized
+def start_broadcast(from_chat_id: int, message_id: int, admin_id: int) -> Optional[Dict]:
+    """Start a broadcast of a message to every user. Returns None if one is already running"""
+    from datetime import datetime
+    state = _get_broadcast_state()
+    current = state['broadcast']
+    if current and current.get('status') == 'running':
+        return None
+    
+    state['broadcast'] = {
+        'id': str(uuid.uuid4()),
+        'from_chat_id': from_chat_id,
+        'message_id': message_id,
+        'admin_id': admin_id,
+        'status': 'running',
+        'last_user_id': None,
+        'processed': 0,
+        'sent': 0,
+        'failed': 0,
+        'blocked': 0,
+        'started_at': datetime.utcnow().isoformat(),
+        'finished_at': None
+    }
+    _record_broadcast({'type': 'broadcast', 'broadcast': state['broadcast']})
+    return dict(state['broadcast'])
+
+def _running_broadcast(broadcast_id: str) -> Optional[Dict]:
+    broadcast = _get_broadcast_state()['broadcast']
+    if not broadcast or broadcast['id'] != broadcast_id or broadcast['status'] != 'running':
+        return None
+    return broadcast
+
+@synchronized
+def update_broadcast_progress(broadcast_id: str, last_user_id: str, processed: int, sent: int, failed: int, blocked: int) -> bool:
+    """Checkpoint broadcast progress after the user last_user_id. Returns False if the broadcast is no longer running"""
+    broadcast = _running_broadcast(broadcast_id)
+    if not broadcast:
+        return False
+    progress = {
+        'last_user_id': last_user_id, 'processed': processed,
+        'sent': sent, 'failed': failed, 'blocked': blocked
+    }
+    broadcast.update(progress)
+    _record_broadcast({'type': 'progress', 'progress': progress})
+    return True
+
+@synchronized
+def finish_broadcast(broadcast_id: str, status: str) -> bool:
+    """Mark a broadcast as 'done' or 'cancelled'"""
+    from datetime import datetime
+    broadcast = _running_broadcast(broadcast_id)
+    if not broadcast:
+        return False
+    progress = {'status': status, 'finished_at': datetime.utcnow().isoformat()}
+    broadcast.update(progress)
+    return _record_broadcast({'type': 'progress', 'progress': progress})
+
+# ============================================
+# Invite Link Pool
+# ============================================
+
+# Pre-created single-use invite links per group, {group_id: [{link,
+# chat_id, expires_at}, ...]}. Each list is sorted by expires_at, latest
+# first, so the link handed out next (the one expiring soonest) is popped
+# from the end. Like the deletion queue, the pools live in memory and are
+# persisted in their own log, INVITE_POOL_FILE, so a click appends one short
+# line instead of rewriting config.json.
+INVITE_POOL_FILE = os.path.join(STORAGE_DIR, 'invite_pool.log')
+
+def _sort_pool(pool: List[Dict]) -> None:
+    pool.sort(key=lambda entry: entry['expires_at'], reverse=True)
+
+def _apply_invite_pool_event(pools: Dict[str, List[Dict]], event: Dict) -> None:
+    kind = event['type']
+    if kind == 'state':
+        pools.clear()
+        pools.update(event['pools'])
+    elif kind == 'added':
+        pool = pools.setdefault(event['group_id'], [])
+        pool.extend(event['links'])
+        _sort_pool(pool)
+    elif kind == 'popped':
+        pool = pools[event['group_id']]
+        del pool[len(pool) - event['count']:]
+    elif kind == 'dropped':
+        del pools[event['group_id']]
+    else:
+        raise ValueError(f"unknown event type {kind!r}")
+
+_invite_pool_log = StateLog(INVITE_POOL_FILE, _apply_invite_pool_event, fsync=JOURNAL_FSYNC)
+_invite_pools: Optional[Dict[str, List[Dict]]] = None
+
+def _get_invite_pools() -> Dict[str, List[Dict]]:
+    """Return the invite link pools, loading them from INVITE_POOL_FILE on first use"""
+    global _invite_pools
+    if _invite_pools is None:
+        pools = _invite_pool_log.load({})
+        # Pools kept in config.json by older versions
+        config = load_config()
+        legacy = config.get('invite_pool')
+        if legacy:
+            for group_id, links in legacy.items():
+                _apply_invite_pool_event(pools, {'type': 'added', 'group_id': group_id, 'links': links})
+            _ensure_storage_dir()
+            _invite_pool_log.compact({'type': 'state', 'pools': pools})
+        _invite_pools = pools
+        if 'invite_pool' in config:
+            del config['invite_pool']
+            save_config(config)
+    return _invite_pools
+
+def _record_invite_pools(event: Dict) -> bool:
+    """Append a change already made to the pools to INVITE_POOL_FILE"""
+    try:
+        _ensure_storage_dir()
+        _invite_pool_log.record(event, lambda: {'type': 'state', 'pools': _invite_pools})
+    except OSError as e:
+        print(f"Error saving invite pool: {e}")
+        return False
+    return True
+
+@synchronized
+def pop_invite_link(group_id: str, valid_until: float) -> tuple:
+    """Take the next pooled link still valid at valid_until. Returns (entry or None, links left)"""
+    pool = _get_invite_pools().get(group_id)
+    if not pool:
+        return None, 0
+    
+    found = None
+    popped = 0
+    while pool:
+        entry = pool.pop()
+        popped += 1
+        if entry['expires_at'] > valid_until:
+            found = entry
+            break
+    _record_invite_pools({'type': 'popped', 'group_id': group_id, 'count': popped})
+    return found, len(pool)
+
+@synchronized
+def add_invite_links(group_id: str, links: List[Dict]) -> int:
+    """Add freshly created links to a group's pool. Returns the pool size"""
+    pool = _get_invite_pools().setdefault(group_id, [])
+    pool.extend(links)
+    _sort_pool(pool)
+    _record_invite_pools({'type': 'added', 'group_id': group_id, 'links': links})
+    return len(pool)
+
+@synchronized
+def get_invite_pool_sizes() -> Dict[str, int]:
+    """Get the number of pooled links per group id"""
+    return {group_id: len(pool) for group_id, pool in _get_invite_pools().items()}
+
+@synchronized
+def take_stale_invite_links(expires_before: float) -> List[tuple]:
+    """Remove links expiring before the given time or belonging to removed groups.
+
+    Returns (chat_id, link) pairs so the caller can revoke them.
+    """
+    pools = _get_invite_pools()
+    if not pools:
+        return []
+    
+    stale = []
+    for group_id in list(pools):
+        pool = pools[group_id]
+        group = get_group_by_id(group_id)
+        if not group or group.get('chat_id') is None:
+            stale.extend((entry['chat_id'], entry['link']) for entry in pool)
+            del pools[group_id]
+            _record_invite_pools({'type': 'dropped', 'group_id': group_id})
+            continue
+        popped = 0
+        while pool and pool[-1]['expires_at'] < expires_before:
+            entry = pool.pop()
+            stale.append((entry['chat_id'], entry['link']))
+            popped += 1
+        if popped:
+            _record_invite_pools({'type': 'popped', 'group_id': group_id, 'count': popped})
+    return stale
+
+
+# ============================================
+# Export / Import
+# ============================================
+
+# Referral users as line-delimited JSON, one {"user_id": ..., <record>} per
+# line, so a full export or import never holds the whole user set as text
+
+@synchronized
+def export_users(path: str) -> int:
+    """Write every referral user to path as one JSON line each. Returns users written"""
+    db = _db()
+    if db:
+        users = db.iter_users()
+    else:
+        users = (
+            (user_id, record.to_dict())
+            for user_id, record in load_config().get('referrals', {}).get('users', {}).items()
+        )
+    
+    count = 0
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for user_id, data in users:
+            f.write(_dumps_compact({'user_id': user_id, **data}))
+            f.write('\n')
+            count += 1
+    os.replace(tmp_path, path)
+    return count
+
+def _read_user_lines(f) -> Iterable[tuple]:
+    """Yield (user_id, record) from an export file, skipping blank lines"""
+    for line in f:
+        if line.strip():
+            data = json.loads(line)
+            yield str(data.pop('user_id')), data
+
+@synchronized
+def import_users(path: str, replace: bool = False) -> int:
+    """Load users exported by export_users, overwriting users with the same ID.
+
+    With replace=True all existing users are removed first. Aggregate
+    counters are recomputed and the config is written out immediately.
+    Returns users imported.
+    """
+    global _leaderboard_config
+    db = _db()
+    with open(path, 'r', encoding='utf-8') as f:
+        if db:
+            return db.import_users(_read_user_lines(f), replace)
+        
+        config = load_config()
+        referrals = config.setdefault('referrals', {})
+        if replace or 'users' not in referrals:
+            referrals['users'] = {}
+        users = referrals['users']
+        count = 0
+        for user_id, data in _read_user_lines(f):
+            users[user_id] = UserRecord.from_dict(data)
+            count += 1
+    
+    referrals['stats'] = _compute_aggregates(users, _current_period(config))
+    _leaderboard_config = None
+    # Not journaled: snapshot now so later journal events apply on top of the import
+    save_config(config)
+    flush_config()
+    return count
@@ -0,0 +1,589 @@
+import itertools
+import json
+import sqlite3
+import uuid
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional
+
+# SQLite backend for groups and referral users. storage.py dispatches to these
+# functions when STORAGE_BACKEND=sqlite; signatures match the storage.* API.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS groups (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    invite_link TEXT NOT NULL,
+    chat_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_groups_invite_link ON groups(invite_link);
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    referral_count INTEGER NOT NULL DEFAULT 0,
+    period INTEGER NOT NULL DEFAULT 1,
+    referred_by TEXT,
+    joined_at TEXT,
+    has_joined_group INTEGER NOT NULL DEFAULT 0,
+    username TEXT,
+    first_name TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_users_referral_count ON users(referral_count);
+CREATE INDEX IF NOT EXISTS idx_users_has_joined_group ON users(has_joined_group);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS group_joins (
+    user_id TEXT NOT NULL,
+    group_id TEXT NOT NULL,
+    UNIQUE (user_id, group_id)
+);
+CREATE TABLE IF NOT EXISTS periods (
+    period INTEGER PRIMARY KEY,
+    started_at TEXT,
+    ended_at TEXT,
+    total_referrals INTEGER NOT NULL,
+    top TEXT NOT NULL
+);
+"""
+
+AGGREGATE_KEYS = ('total_users', 'joined_users', 'total_referrals')
+
+_conn: Optional[sqlite3.Connection] = None
+_path: Optional[str] = None
+
+# Separate read-only connection for the stats snapshot. In WAL mode its reads
+# don't block writers on _conn, so it never holds up the storage lock.
+_snapshot_conn: Optional[sqlite3.Connection] = None
+
+# Current competition period, kept in meta. users.referral_count only counts
+# for users whose period matches it.
+_period = 1
+
+def connect(path: str) -> sqlite3.Connection:
+    """Open the database in WAL mode and create the schema if needed"""
+    global _conn, _path, _period
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    # Databases created before groups had a chat_id
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(groups)")}
+    if 'chat_id' not in columns:
+        conn.execute("ALTER TABLE groups ADD COLUMN chat_id INTEGER")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_groups_chat_id ON groups(chat_id)")
+    # Databases created before competition periods
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(users)")}
+    if 'period' not in columns:
+        conn.execute("ALTER TABLE users ADD COLUMN period INTEGER NOT NULL DEFAULT 1")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_period_count ON users(period, referral_count)")
+    row = conn.execute("SELECT value FROM meta WHERE key = 'period'").fetchone()
+    _period = int(row[0]) if row else 1
+    _conn = conn
+    _path = path
+    if conn.execute("SELECT COUNT(*) FROM counters").fetchone()[0] < len(AGGREGATE_KEYS):
+        with conn:
+            _store_counters(_compute_counters())
+    return conn
+
+def close() -> None:
+    """Close the database connection"""
+    global _conn, _snapshot_conn
+    if _snapshot_conn is not None:
+        _snapshot_conn.close()
+        _snapshot_conn = None
+    if _conn is not None:
+        _conn.close()
+        _conn = None
+
+def is_migrated() -> bool:
+    """Check whether config.json data has already been imported"""
+    row = _conn.execute("SELECT value FROM meta WHERE key = 'migrated_at'").fetchone()
+    return row is not None
+
+def migrate_from_config(config: Dict) -> int:
+    """Import groups, referral users and competition periods from the config.json layout. Returns users imported"""
+    global _period
+    users = config.get('referrals', {}).get('users', {})
+    competition = config.get('competition') or {'period': 1, 'started_at': None, 'archive': []}
+    with _conn:
+        _conn.executemany(
+            "INSERT OR IGNORE INTO groups (id, name, invite_link, chat_id) VALUES (?, ?, ?, ?)",
+            [
+                (g['id'], g.get('name', ''), g.get('invite_link', ''), g.get('chat_id'))
+                for g in config.get('groups', [])
+            ]
+        )
+        _conn.executemany(
+            "INSERT OR IGNORE INTO users (user_id, referral_count, period, referred_by, joined_at, "
+            "has_joined_group, username, first_name) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [_user_row(user_id, data) for user_id, data in users.items()]
+        )
+        _conn.executemany(
+            "INSERT OR IGNORE INTO group_joins (user_id, group_id) VALUES (?, ?)",
+            [
+                (user_id, group_id)
+                for user_id, data in users.items()
+                for group_id in data.get('groups_joined', [])
+            ]
+        )
+        _conn.executemany(
+            "INSERT OR IGNORE INTO periods (period, started_at, ended_at, total_referrals, top) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [
+                (entry['period'], entry['started_at'], entry['ended_at'],
+                 entry['total_referrals'], json.dumps(entry['top'], ensure_ascii=False))
+                for entry in competition['archive']
+            ]
+        )
+        _set_period(competition['period'], competition['started_at'])
+        _conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated_at', ?)",
+            (datetime.utcnow().isoformat(),)
+        )
+        _period = competition['period']
+        _store_counters(_compute_counters())
+    return len(users)
+
+def _user_row(user_id: str, data: Dict) -> tuple:
+    """Column values of a users row from a record in the config.json layout"""
+    return (
+        user_id,
+        data.get('referral_count', 0),
+        data.get('period', 1),
+        data.get('referred_by'),
+        data.get('joined_at'),
+        1 if data.get('has_joined_group') else 0,
+        data.get('username'),
+        data.get('first_name')
+    )
+
+# ============================================
+# Aggregate counters
+# ============================================
+
+def _compute_counters() -> Dict:
+    """Recompute the aggregate counters from the users table"""
+    row = _conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(has_joined_group), 0), "
+        "COALESCE(SUM(CASE WHEN period = ? THEN referral_count ELSE 0 END), 0) FROM users",
+        (_period,)
+    ).fetchone()
+    return dict(zip(AGGREGATE_KEYS, row))
+
+def _store_counters(counters: Dict) -> None:
+    """Overwrite the stored counters (caller holds the transaction)"""
+    _conn.executemany(
+        "INSERT OR REPLACE INTO counters (name, value) VALUES (?, ?)",
+        list(counters.items())
+    )
+
+def _bump(name: str, delta: int = 1) -> None:
+    """Increment a stored counter (caller holds the transaction)"""
+    _conn.execute("UPDATE counters SET value = value + ? WHERE name = ?", (delta, name))
+
+def _get_counter(name: str) -> int:
+    """Read a stored counter"""
+    row = _conn.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else 0
+
+def check_aggregates(fix: bool = True) -> Dict:
+    """Recompute counters and compare them with the stored ones, fixing mismatches if asked"""
+    stored = {name: _get_counter(name) for name in AGGREGATE_KEYS}
+    actual = _compute_counters()
+    consistent = stored == actual
+    if not consistent and fix:
+        with _conn:
+            _store_counters(actual)
+    return {'stored': stored, 'actual': actual, 'consistent': consistent}
+
+# ============================================
+# Groups
+# ============================================
+
+def get_groups() -> List[Dict]:
+    """Get all groups in the order they were added"""
+    rows = _conn.execute("SELECT id, name, invite_link, chat_id FROM groups ORDER BY rowid").fetchall()
+    return [dict(row) for row in rows]
+
+def get_group_by_id(group_id: str) -> Optional[Dict]:
+    """Get a specific group by ID"""
+    row = _conn.execute(
+        "SELECT id, name, invite_link, chat_id FROM groups WHERE id = ?", (group_id,)
+    ).fetchone()
+    return dict(row) if row else None
+
+def get_group_by_chat_id(chat_id: int) -> Optional[Dict]:
+    """Get the group with the given Telegram chat id, if one is configured"""
+    row = _conn.execute(
+        "SELECT id, name, invite_link, chat_id FROM groups WHERE chat_id = ? ORDER BY rowid LIMIT 1",
+        (chat_id,)
+    ).fetchone()
+    return dict(row) if row else None
+
+def add_group(name: str, invite_link: str, chat_id: Optional[int] = None) -> Dict:
+    """Add a new group with its invite link"""
+    new_group = {
+        'id': str(uuid.uuid4()),
+        'name': name,
+        'invite_link': invite_link,
+        'chat_id': chat_id
+    }
+    with _conn:
+        _conn.execute(
+            "INSERT INTO groups (id, name, invite_link, chat_id) VALUES (:id, :name, :invite_link, :chat_id)",
+            new_group
+        )
+    return new_group
+
+def delete_group(group_id: str) -> bool:
+    """Delete a group by ID"""
+    with _conn:
+        cur = _conn.execute("DELETE FROM groups WHERE id = ?", (group_id,))
+    return cur.rowcount > 0
+
+def group_exists(invite_link: str) -> bool:
+    """Check if a group with the given invite_link already exists"""
+    row = _conn.execute(
+        "SELECT 1 FROM groups WHERE invite_link = ? LIMIT 1", (invite_link,)
+    ).fetchone()
+    return row is not None
+
+# ============================================
+# Referral users
+# ============================================
+
+def get_referral_data(user_id: str) -> Optional[Dict]:
+    """Get referral data for a specific user in the config.json record shape"""
+    row = _conn.execute("SELECT * FROM users WHERE user_id = ?", (str(user_id),)).fetchone()
+    if not row:
+        return None
+    groups_joined = [
+        r[0] for r in _conn.execute(
+            "SELECT group_id FROM group_joins WHERE user_id = ? ORDER BY rowid", (str(user_id),)
+        )
+    ]
+    # A count from an earlier period reads as 0
+    current = row['period'] == _period
+    return {
+        'referral_count': row['referral_count'] if current else 0,
+        'period': _period,
+        'referred_by': row['referred_by'],
+        'joined_at': row['joined_at'],
+        'has_joined_group': bool(row['has_joined_group']),
+        'groups_joined': groups_joined,
+        'username': row['username'],
+        'first_name': row['first_name']
+    }
+
+def register_user(user_id: str, referred_by: Optional[str] = None, username: Optional[str] = None, first_name: Optional[str] = None) -> bool:
+    """Register a new user. Returns False if the user already exists"""
+    with _conn:
+        cur = _conn.execute(
+            "INSERT OR IGNORE INTO users (user_id, referred_by, joined_at, username, first_name) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (
+                str(user_id),
+                str(referred_by) if referred_by else None,
+                datetime.utcnow().isoformat(),
+                username,
+                first_name
+            )
+        )
+        if cur.rowcount > 0:
+            _bump('total_users')
+    return cur.rowcount > 0
+
+def _apply_group_join(user_id_str: str, group_id: str, total_groups: int) -> bool:
+    """Record a group join (caller holds the transaction). Returns mark_user_joined_group's result"""
+    cur = _conn.execute(
+        "INSERT OR IGNORE INTO users (user_id, joined_at) VALUES (?, ?)",
+        (user_id_str, datetime.utcnow().isoformat())
+    )
+    if cur.rowcount > 0:
+        _bump('total_users')
+    _conn.execute(
+        "INSERT OR IGNORE INTO group_joins (user_id, group_id) VALUES (?, ?)",
+        (user_id_str, group_id)
+    )
+    row = _conn.execute(
+        "SELECT has_joined_group, referred_by FROM users WHERE user_id = ?", (user_id_str,)
+    ).fetchone()
+
+    # If already counted, don't count again
+    if row['has_joined_group']:
+        return True
+
+    joined = _conn.execute(
+        "SELECT COUNT(*) FROM group_joins WHERE user_id = ?", (user_id_str,)
+    ).fetchone()[0]
+
+    # MUST join ALL groups, regardless of how many there are
+    if joined < total_groups:
+        return False
+
+    _conn.execute("UPDATE users SET has_joined_group = 1 WHERE user_id = ?", (user_id_str,))
+    _bump('joined_users')
+
+    referred_by = row['referred_by']
+    if not referred_by:
+        return False
+
+    # Create the referrer entry if they don't exist yet, then credit them
+    cur = _conn.execute(
+        "INSERT OR IGNORE INTO users (user_id, joined_at) VALUES (?, ?)",
+        (str(referred_by), datetime.utcnow().isoformat())
+    )
+    if cur.rowcount > 0:
+        _bump('total_users')
+    # A count left from an earlier period starts over
+    _conn.execute(
+        "UPDATE users SET referral_count = CASE WHEN period = ? THEN referral_count + 1 ELSE 1 END, "
+        "period = ? WHERE user_id = ?",
+        (_period, _period, str(referred_by))
+    )
+    _bump('total_referrals')
+    return True
+
+def mark_user_joined_group(user_id: str, group_id: str, total_groups: int) -> bool:
+    """Mark that a user has clicked join for a group. Count referral only when all groups joined"""
+    with _conn:
+        return _apply_group_join(str(user_id), group_id, total_groups)
+
+def record_group_memberships(events: List[tuple]) -> int:
+    """Apply a batch of (chat_id, user_id, is_member) membership changes in one transaction"""
+    total_groups = _conn.execute("SELECT COUNT(*) FROM groups").fetchone()[0]
+    group_ids = {}
+    credited = 0
+    with _conn:
+        for chat_id, user_id, is_member in events:
+            if chat_id not in group_ids:
+                group = get_group_by_chat_id(chat_id)
+                group_ids[chat_id] = group['id'] if group else None
+            group_id = group_ids[chat_id]
+            if not group_id:
+                continue
+            user_id_str = str(user_id)
+            row = _conn.execute(
+                "SELECT has_joined_group FROM users WHERE user_id = ?", (user_id_str,)
+            ).fetchone()
+            if not row:
+                continue
+            if is_member:
+                already_joined = _conn.execute(
+                    "SELECT 1 FROM group_joins WHERE user_id = ? AND group_id = ?",
+                    (user_id_str, group_id)
+                ).fetchone()
+                if already_joined:
+                    continue
+                if _apply_group_join(user_id_str, group_id, total_groups) and not row['has_joined_group']:
+                    credited += 1
+            elif not row['has_joined_group']:
+                _conn.execute(
+                    "DELETE FROM group_joins WHERE user_id = ? AND group_id = ?",
+                    (user_id_str, group_id)
+                )
+    return credited
+
+def get_all_referral_stats() -> List[Dict]:
+    """Get all users with their referral stats, sorted by referral count"""
+    rows = _conn.execute(
+        "SELECT user_id, CASE WHEN period = ? THEN referral_count ELSE 0 END AS referral_count, "
+        "referred_by, joined_at FROM users ORDER BY referral_count DESC, rowid",
+        (_period,)
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+def get_top_referrers(limit: int = 10) -> List[Dict]:
+    """Get the top referrers with referral_count > 0, highest first"""
+    rows = _conn.execute(
+        "SELECT user_id, referral_count, username, first_name FROM users "
+        "WHERE period = ? AND referral_count > 0 ORDER BY referral_count DESC LIMIT ?",
+        (_period, limit)
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+def get_total_users() -> int:
+    """Get total number of registered users"""
+    return _get_counter('total_users')
+
+def get_total_referrals() -> int:
+    """Get total number of successful referrals"""
+    return _get_counter('total_referrals')
+
+def get_users_who_joined_groups() -> int:
+    """Get count of users who have joined all groups"""
+    return _get_counter('joined_users')
+
+def get_user_ids_chunk(after: Optional[str], limit: int) -> List[str]:
+    """Get up to limit user ids following the user id after (None: from the start), in registration order"""
+    if after is None:
+        rows = _conn.execute("SELECT user_id FROM users ORDER BY rowid LIMIT ?", (limit,)).fetchall()
+    else:
+        # Keyset paging: seek past the cursor's rowid instead of skipping rows.
+        # An unknown cursor compares with NULL and returns nothing.
+        rows = _conn.execute(
+            "SELECT user_id FROM users WHERE rowid > (SELECT rowid FROM users WHERE user_id = ?) "
+            "ORDER BY rowid LIMIT ?",
+            (after, limit)
+        ).fetchall()
+    return [row[0] for row in rows]
+
+def get_snapshot_source(since_version: Optional[int] = None) -> Optional[tuple]:
+    """(version, aggregates, rows) for a stats snapshot, or None if nothing was committed since since_version.
+
+    Reads on its own read-only connection, so callers don't need the storage
+    lock. rows are (user_id, referral_count, joined_at, has_joined_group,
+    referred_by, username, first_name), consistent with the aggregates.
+    """
+    global _snapshot_conn
+    if _snapshot_conn is None:
+        _snapshot_conn = sqlite3.connect(
+            f"file:{_path}?mode=ro", uri=True, check_same_thread=False, isolation_level=None
+        )
+    conn = _snapshot_conn
+    # Changes whenever another connection commits
+    version = conn.execute("PRAGMA data_version").fetchone()[0]
+    if since_version is not None and version == since_version:
+        return None
+    conn.execute("BEGIN")
+    try:
+        aggregates = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+        row = conn.execute("SELECT value FROM meta WHERE key = 'period'").fetchone()
+        rows = conn.execute(
+            "SELECT user_id, CASE WHEN period = ? THEN referral_count ELSE 0 END, joined_at, "
+            "has_joined_group, referred_by, username, first_name FROM users",
+            (int(row[0]) if row else 1,)
+        ).fetchall()
+    finally:
+        conn.execute("COMMIT")
+    return version, {name: aggregates.get(name, 0) for name in AGGREGATE_KEYS}, rows
+
+# ============================================
+# Competition periods
+# ============================================
+
+def _set_period(period: int, started_at: Optional[str]) -> None:
+    """Store the current period in meta (caller holds the transaction)"""
+    _conn.executemany(
+        "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+        [('period', str(period)), ('period_started_at', started_at)]
+    )
+
+def get_competition() -> Dict:
+    """Get the current period and when it started"""
+    row = _conn.execute("SELECT value FROM meta WHERE key = 'period_started_at'").fetchone()
+    return {'period': _period, 'started_at': row[0] if row else None}
+
+def start_new_period(archive_size: int) -> Dict:
+    """Archive the top archive_size referrers and total of the current period, then start the next one"""
+    global _period
+    started_at = get_competition()['started_at']
+    ended_at = datetime.utcnow().isoformat()
+    archived = {
+        'period': _period,
+        'started_at': started_at,
+        'ended_at': ended_at,
+        'total_referrals': _get_counter('total_referrals'),
+        'top': get_top_referrers(archive_size)
+    }
+    with _conn:
+        _conn.execute(
+            "INSERT OR REPLACE INTO periods (period, started_at, ended_at, total_referrals, top) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (_period, started_at, ended_at, archived['total_referrals'],
+             json.dumps(archived['top'], ensure_ascii=False))
+        )
+        _set_period(_period + 1, ended_at)
+        _store_counters({'total_referrals': 0})
+    _period += 1
+    return archived
+
+def get_archived_periods() -> List[Dict]:
+    """Get finished periods, newest first, without their leaderboards"""
+    rows = _conn.execute(
+        "SELECT period, started_at, ended_at, total_referrals FROM periods ORDER BY period DESC"
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+def get_period_leaderboard(period: int, limit: int = 10) -> Optional[List[Dict]]:
+    """Get the top referrers of the current or an archived period, None if there is no such period"""
+    if period == _period:
+        return get_top_referrers(limit)
+    row = _conn.execute("SELECT top FROM periods WHERE period = ?", (period,)).fetchone()
+    return json.loads(row[0])[:limit] if row else None
+
+# ============================================
+# Export / Import
+# ============================================
+
+IMPORT_BATCH_SIZE = 10000
+
+def iter_users() -> Iterator[tuple]:
+    """Yield (user_id, record) for every user, records in the config.json layout.
+
+    Users and group joins are read as two cursors ordered by user_id and
+    merged, instead of one query per user.
+    """
+    users = _conn.execute("SELECT * FROM users ORDER BY user_id")
+    joins = _conn.execute("SELECT user_id, group_id FROM group_joins ORDER BY user_id, rowid")
+    pending = next(joins, None)
+    for row in users:
+        user_id = row['user_id']
+        # Skip joins of users that no longer exist
+        while pending is not None and pending[0] < user_id:
+            pending = next(joins, None)
+        groups_joined = []
+        while pending is not None and pending[0] == user_id:
+            groups_joined.append(pending[1])
+            pending = next(joins, None)
+        yield user_id, {
+            'referral_count': row['referral_count'],
+            'period': row['period'],
+            'referred_by': row['referred_by'],
+            'joined_at': row['joined_at'],
+            'has_joined_group': bool(row['has_joined_group']),
+            'groups_joined': groups_joined,
+            'username': row['username'],
+            'first_name': row['first_name']
+        }
+
+def import_users(users: Iterable[tuple], replace: bool = False) -> int:
+    """Insert or overwrite (user_id, record) pairs in batches, in one transaction.
+
+    With replace=True all existing users are removed first. Returns users imported.
+    """
+    count = 0
+    users = iter(users)
+    with _conn:
+        if replace:
+            _conn.execute("DELETE FROM users")
+            _conn.execute("DELETE FROM group_joins")
+        while True:
+            batch = list(itertools.islice(users, IMPORT_BATCH_SIZE))
+            if not batch:
+                break
+            if not replace:
+                _conn.executemany(
+                    "DELETE FROM group_joins WHERE user_id = ?", [(user_id,) for user_id, _ in batch]
+                )
+            _conn.executemany(
+                "INSERT OR REPLACE INTO users (user_id, referral_count, period, referred_by, joined_at, "
+                "has_joined_group, username, first_name) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [_user_row(user_id, data) for user_id, data in batch]
+            )
+            _conn.executemany(
+                "INSERT OR IGNORE INTO group_joins (user_id, group_id) VALUES (?, ?)",
+                [
+                    (user_id, group_id)
+                    for user_id, data in batch
+                    for group_id in data.get('groups_joined', [])
+                ]
+            )
+            count += len(batch)
+        _store_counters(_compute_counters())
+    return count
@@ -0,0 +1,68 @@
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+# Default lifetime in seconds for cached static Telegram lookups
+TELEGRAM_CACHE_TTL = float(os.getenv('TELEGRAM_CACHE_TTL', '3600'))
+
+class TTLCache:
+    """Async cache for Telegram API lookups whose results rarely change.
+
+    Values expire ttl seconds after they were fetched. Concurrent misses for
+    the same key share a single API request.
+    """
+
+    def __init__(self, ttl: float = TELEGRAM_CACHE_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[Hashable, Tuple[Any, float]] = {}
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+
+    async def get(self, key: Hashable, fetch: Callable[[], Awaitable[Any]], ttl: Optional[float] = None) -> Any:
+        """Return the cached value for key, calling fetch() if it is missing or expired"""
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            self.hits += 1
+            return entry[0]
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.hits += 1
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        task = asyncio.ensure_future(fetch())
+        self._pending[key] = task
+        try:
+            value = await asyncio.shield(task)
+        finally:
+            self._pending.pop(key, None)
+
+        self._entries[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        return value
+
+    def invalidate(self, key: Optional[Hashable] = None) -> None:
+        """Drop one cached key, or everything if key is None"""
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def stats(self) -> Dict:
+        """Get hit/miss counters and the number of cached keys"""
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+# Shared cache used by the bot handlers
+lookups = TTLCache()
+
+async def get_bot_username(bot) -> str:
+    """Get the bot's @username, calling getMe at most once per TTL"""
+    async def fetch():
+        try:
+            # Application.initialize() already called getMe
+            return bot.username
+        except RuntimeError:
+            return (await bot.get_me()).username
+    return await lookups.get(('bot_username', bot.token), fetch)
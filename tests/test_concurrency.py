@@ -0,0 +1,55 @@
+"""Concurrent registrations and group joins through async_storage, on both backends.
+
+A scaled-down benchmarks/bench_concurrency.py; run that script for large user counts.
+"""
+import asyncio
+import unittest
+
+from storage_case import StorageTestCase, storage
+import async_storage
+
+USERS = 500
+REFERRERS = 10
+GROUPS = 3
+
+class ConcurrentJoinsTest(StorageTestCase):
+
+    def test_referral_counts_and_aggregates_stay_exact(self):
+        groups = [storage.add_group(f'Group {i}', f'https://t.me/+g{i}')['id'] for i in range(GROUPS)]
+        referrers = [str(1000 + i) for i in range(REFERRERS)]
+        for referrer in referrers:
+            storage.register_user(referrer)
+
+        async def user_flow(i):
+            user_id = str(100000 + i)
+            await async_storage.register_user(user_id, referred_by=referrers[i % REFERRERS])
+            # Double clicks race with each other as well
+            await asyncio.gather(*(
+                async_storage.mark_user_joined_group(user_id, group_id, GROUPS)
+                for group_id in groups * 2
+            ))
+
+        async def run():
+            await asyncio.gather(*(user_flow(i) for i in range(USERS)))
+
+        asyncio.run(run())
+
+        for r, referrer in enumerate(referrers):
+            self.assertEqual(storage.get_user_referral_count(referrer), len(range(r, USERS, REFERRERS)))
+        check = storage.check_aggregates(fix=False)
+        self.assertTrue(check['consistent'], check)
+        self.assertEqual(check['actual'], {
+            'total_users': USERS + REFERRERS, 'joined_users': USERS, 'total_referrals': USERS
+        })
+
+        # And the same after a restart, from what reached the disk
+        storage.flush_config()
+        self.restart()
+        self.assertEqual(storage.get_total_referrals(), USERS)
+        self.assertTrue(storage.check_aggregates(fix=False)['consistent'])
+
+class SQLiteConcurrentJoinsTest(ConcurrentJoinsTest):
+    backend = 'sqlite'
+
+if __name__ == '__main__':
+    unittest.main()
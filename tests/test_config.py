@@ -0,0 +1,41 @@
+"""Loading config.json (JSON backend)."""
+import os
+import unittest
+
+from storage_case import StorageTestCase, storage
+
+class ConfigLoadTest(StorageTestCase):
+
+    def test_missing_file_gets_defaults(self):
+        self.assertFalse(os.path.exists(storage.CONFIG_FILE))
+        self.assertEqual(storage.get_groups(), [])
+        self.assertTrue(os.path.exists(storage.CONFIG_FILE))
+
+    def test_unreadable_file_stops_loading_without_touching_data(self):
+        storage.add_group('Group', 'https://t.me/+g')
+        storage.register_user('1')
+        storage.flush_config()
+        with open(storage.CONFIG_FILE, 'rb') as f:
+            data = f.read()
+        with open(storage.CONFIG_FILE, 'wb') as f:
+            f.write(data[:len(data) // 2])
+        with open(storage.JOURNAL_FILE, 'rb') as f:
+            journal = f.read()
+
+        self.restart()
+        with self.assertRaises(storage.ConfigError):
+            storage.load_config()
+        # Writes keep failing instead of saving defaults over the file
+        with self.assertRaises(storage.ConfigError):
+            storage.register_user('2')
+        with self.assertRaises(storage.ConfigError):
+            storage.update_welcome_message('Hi')
+        storage.flush_config()
+
+        with open(storage.CONFIG_FILE, 'rb') as f:
+            self.assertEqual(f.read(), data[:len(data) // 2])
+        with open(storage.JOURNAL_FILE, 'rb') as f:
+            self.assertEqual(f.read(), journal)
+
+if __name__ == '__main__':
+    unittest.main()
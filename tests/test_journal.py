@@ -0,0 +1,134 @@
+"""Replay of the storage event journal (JSON backend)."""
+import json
+import os
+import unittest
+
+from storage_case import StorageTestCase, storage
+from journal import JournalError
+
+class JournalReplayTest(StorageTestCase):
+
+    def journal_lines(self):
+        with open(storage.JOURNAL_FILE, 'rb') as f:
+            return f.read().splitlines(keepends=True)
+
+    def write_journal(self, lines):
+        with open(storage.JOURNAL_FILE, 'wb') as f:
+            f.writelines(lines)
+
+    def populate(self):
+        """One referrer with two referred users who joined both groups; all of it only in the journal"""
+        groups = [storage.add_group(f'Group {i}', f'https://t.me/+g{i}')['id'] for i in range(2)]
+        storage.register_user('1')
+        for user_id in ('2', '3'):
+            storage.register_user(user_id, referred_by='1')
+            for group_id in groups:
+                storage.mark_user_joined_group(user_id, group_id, len(groups))
+        storage.register_user('4', referred_by='1')
+        storage.mark_user_joined_group('4', groups[0], len(groups))
+        return groups
+
+    def test_replays_events_newer_than_snapshot(self):
+        self.populate()
+        self.assertGreater(len(self.journal_lines()), 0)
+
+        self.restart()
+        self.assertEqual(storage.get_user_referral_count('1'), 2)
+        self.assertEqual(storage.get_total_users(), 4)
+        self.assertEqual(len(storage.get_referral_data('4')['groups_joined']), 1)
+        self.assertTrue(storage.check_aggregates(fix=False)['consistent'])
+
+    def test_torn_last_line_is_skipped_and_cut_before_next_append(self):
+        self.populate()
+        lines = self.journal_lines()
+        self.write_journal(lines + [b'{"type": "user_regis'])
+
+        self.restart()
+        self.assertEqual(storage.get_user_referral_count('1'), 2)
+        storage.register_user('5')
+        self.assertEqual(len(self.journal_lines()), len(lines) + 1)
+
+        self.restart()
+        self.assertEqual(storage.get_total_users(), 5)
+
+    def test_corrupt_line_stops_loading_without_touching_data(self):
+        self.populate()
+        lines = self.journal_lines()
+        lines[2] = lines[2][:10] + b'\n'
+        self.write_journal(lines)
+        with open(storage.CONFIG_FILE, 'rb') as f:
+            config_before = f.read()
+
+        self.restart()
+        with self.assertRaises(JournalError):
+            storage.load_config()
+        # Later calls keep failing instead of working on an empty config
+        with self.assertRaises(JournalError):
+            storage.add_group('New', 'https://t.me/+new')
+        storage.flush_config()
+
+        with open(storage.CONFIG_FILE, 'rb') as f:
+            self.assertEqual(f.read(), config_before)
+        self.assertEqual(self.journal_lines(), lines)
+        self.assertFalse(os.path.exists(storage.JOURNAL_ARCHIVE_DIR))
+
+    def test_unknown_event_stops_loading(self):
+        self.populate()
+        self.write_journal(self.journal_lines() + [
+            json.dumps({'type': 'from_the_future', 'seq': 10 ** 6}).encode() + b'\n'
+        ])
+        self.restart()
+        with self.assertRaises(JournalError):
+            storage.load_config()
+
+    def test_snapshot_without_rotation_is_not_applied_twice(self):
+        self.populate()
+        lines = self.journal_lines()
+        # Crash right after the snapshot was written, before the journal was archived
+        storage._rotate_journal = lambda config: None
+        storage.save_config(storage.load_config())
+        self.write_journal(lines)
+
+        self.restart()
+        self.assertEqual(storage.get_user_referral_count('1'), 2)
+        self.assertEqual(storage.get_total_users(), 4)
+        self.assertTrue(storage.check_aggregates(fix=False)['consistent'])
+
+    def test_counts_reset_replays_as_new_period(self):
+        self.populate()
+        self.write_journal(self.journal_lines() + [
+            json.dumps({'type': 'counts_reset', 'seq': 10 ** 6, 'at': 1700000000}).encode() + b'\n'
+        ])
+
+        self.restart()
+        self.assertEqual(storage.get_user_referral_count('1'), 0)
+        self.assertEqual(storage.get_total_referrals(), 0)
+        archived = storage.get_archived_periods()
+        self.assertEqual(len(archived), 1)
+        self.assertEqual(archived[0]['total_referrals'], 2)
+        self.assertEqual(storage.get_period_leaderboard(archived[0]['period'])[0]['user_id'], '1')
+        self.assertTrue(storage.check_aggregates(fix=False)['consistent'])
+
+    def test_only_referral_users_load_as_records(self):
+        self.populate()
+        config = storage.load_config()
+        lookalike = {'referral_count': 3, 'has_joined_group': True, 'note': 'not a user'}
+        config['imported'] = {'1': dict(lookalike)}
+        storage.save_config(config)
+
+        self.restart()
+        config = storage.load_config()
+        self.assertEqual(config['imported'], {'1': lookalike})
+        self.assertIsInstance(config['referrals']['users']['2'], storage.UserRecord)
+
+    def test_snapshot_rotates_journal(self):
+        self.restart(JOURNAL_SNAPSHOT_EVENTS='5')
+        self.populate()
+        self.assertTrue(os.listdir(storage.JOURNAL_ARCHIVE_DIR))
+
+        self.restart(JOURNAL_SNAPSHOT_EVENTS='5')
+        self.assertEqual(storage.get_user_referral_count('1'), 2)
+        self.assertTrue(storage.check_aggregates(fix=False)['consistent'])
+
+if __name__ == '__main__':
+    unittest.main()
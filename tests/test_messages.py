@@ -0,0 +1,27 @@
+"""Markdown escaping for parse_mode='Markdown' messages."""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import messages
+
+class MarkdownTest(unittest.TestCase):
+
+    def test_md_escapes_outside_entities(self):
+        self.assertEqual(messages.md('VIP_Club [*]`'), 'VIP\\_Club \\[\\*]\\`')
+
+    def test_bold_keeps_value_literal(self):
+        # Inside an entity a backslash would be shown as is
+        self.assertEqual(messages.bold('VIP_Club [1]`'), '*VIP_Club [1]`*')
+
+    def test_bold_falls_back_to_escaped_text_for_asterisks(self):
+        self.assertEqual(messages.bold('5* Club_'), '5\\* Club\\_')
+
+    def test_display_name_is_escaped(self):
+        self.assertEqual(messages.display_name({'username': 'a_b', 'user_id': '1'}), '@a\\_b')
+        self.assertEqual(messages.display_name({'user_id': '1'}), 'ID: 1')
+
+if __name__ == '__main__':
+    unittest.main()
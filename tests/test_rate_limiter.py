@@ -0,0 +1,120 @@
+"""PriorityRateLimiter with a fake callback and a fake clock."""
+import asyncio
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from telegram.error import RetryAfter
+
+import rate_limiter
+from rate_limiter import PRIORITY_ADMIN, PRIORITY_BULK, PRIORITY_USER, PriorityRateLimiter
+
+class FakeClock:
+    """Stands in for time and asyncio in rate_limiter: sleeping advances the clock instantly"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, delay):
+        self.now += max(delay, 0)
+        await _real_sleep(0)
+
+    def __getattr__(self, name):
+        return getattr(asyncio, name)
+
+_real_sleep = asyncio.sleep
+
+class PriorityRateLimiterTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        for name in ('time', 'asyncio'):
+            patcher = mock.patch.object(rate_limiter, name, self.clock)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.calls = []
+
+    async def request(self, limiter, chat_id=None, priority=None, endpoint='sendMessage', callback=None):
+        async def record(*args, **kwargs):
+            self.calls.append((endpoint, chat_id, self.clock.now))
+            return True
+        data = {} if chat_id is None else {'chat_id': chat_id}
+        return await limiter.process_request(
+            callback or record, (), {}, endpoint, data,
+            None if priority is None else {'priority': priority}
+        )
+
+    async def test_waiters_are_released_by_priority(self):
+        limiter = PriorityRateLimiter(overall_rate=1)
+        limiter._overall.tokens = 0
+        await asyncio.gather(
+            self.request(limiter, 1, PRIORITY_BULK, 'bulk'),
+            self.request(limiter, 2, PRIORITY_ADMIN, 'admin'),
+            self.request(limiter, 3, PRIORITY_BULK, 'bulk-2'),
+            self.request(limiter, 4, PRIORITY_USER, 'user')
+        )
+        self.assertEqual([call[0] for call in self.calls], ['user', 'admin', 'bulk', 'bulk-2'])
+        # One global token per second for the four of them
+        self.assertEqual(self.clock.now, 1004)
+        self.assertEqual(limiter.metrics()['throttled'], 4)
+
+    async def test_private_chat_bucket_limits_one_chat_only(self):
+        limiter = PriorityRateLimiter(private_chat_rate=1, private_chat_burst=3)
+        for _ in range(5):
+            await self.request(limiter, 42)
+        await self.request(limiter, 43)
+        self.assertEqual([call[2] for call in self.calls], [1000, 1000, 1000, 1001, 1002, 1002])
+
+    async def test_group_bucket_is_slower(self):
+        limiter = PriorityRateLimiter(group_rate=20 / 60, group_burst=3)
+        for _ in range(4):
+            await self.request(limiter, -100)
+        await self.request(limiter, '@channel')
+        self.assertAlmostEqual(self.calls[3][2], 1003)
+        self.assertAlmostEqual(self.calls[4][2], 1003)
+
+    async def test_calls_without_chat_id_use_the_global_bucket(self):
+        limiter = PriorityRateLimiter(overall_rate=2)
+        for _ in range(4):
+            await self.request(limiter, endpoint='answerCallbackQuery')
+        self.assertEqual([call[2] for call in self.calls], [1000, 1000, 1000.5, 1001])
+
+    async def test_retry_after_pauses_everyone_and_retries(self):
+        limiter = PriorityRateLimiter()
+        attempts = []
+
+        async def flooded(*args, **kwargs):
+            attempts.append(self.clock.now)
+            if len(attempts) == 1:
+                raise RetryAfter(5)
+            return 'ok'
+
+        self.assertEqual(await self.request(limiter, 1, callback=flooded), 'ok')
+        self.assertGreaterEqual(attempts[1] - attempts[0], 5)
+        # Other chats wait out the pause as well
+        await self.request(limiter, 2)
+        self.assertGreaterEqual(self.calls[0][2], attempts[0] + 5)
+        self.assertEqual(limiter.metrics()['retried'], 1)
+
+    async def test_retry_after_gives_up_after_max_retries(self):
+        limiter = PriorityRateLimiter(max_retries=2)
+        attempts = []
+
+        async def flooded(*args, **kwargs):
+            attempts.append(self.clock.now)
+            raise RetryAfter(1)
+
+        with self.assertRaises(RetryAfter):
+            await self.request(limiter, 1, callback=flooded)
+        self.assertEqual(len(attempts), 3)
+        self.assertEqual(limiter.metrics()['failed'], 1)
+        self.assertEqual(limiter.metrics()['retried'], 2)
+
+if __name__ == '__main__':
+    unittest.main()
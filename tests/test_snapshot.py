@@ -0,0 +1,64 @@
+"""Stats snapshot sources, on both backends."""
+import os
+import threading
+import unittest
+
+from storage_case import StorageTestCase, storage
+import snapshot
+
+class SnapshotSourceTest(StorageTestCase):
+
+    def populate(self):
+        group = storage.add_group('Group', 'https://t.me/+g')['id']
+        storage.register_user('1', username='referrer')
+        for user_id in ('2', '3'):
+            storage.register_user(user_id, referred_by='1')
+            storage.mark_user_joined_group(user_id, group, 1)
+
+    def test_snapshot_matches_storage(self):
+        self.populate()
+        version, aggregates, rows = storage.get_snapshot_source()
+        path = os.path.join(self.storage_dir, 'stats.snap')
+        self.assertEqual(snapshot.write_snapshot(path, aggregates, rows), 3)
+
+        snap = snapshot.Snapshot(path)
+        self.addCleanup(snap.close)
+        self.assertEqual(snap.aggregates, {'total_users': 3, 'joined_users': 2, 'total_referrals': 2})
+        top = snap.top(10)
+        self.assertEqual([(r['user_id'], r['referral_count'], r['username']) for r in top], [('1', 2, 'referrer')])
+
+    def test_unchanged_data_is_skipped(self):
+        self.populate()
+        version = storage.get_snapshot_source()[0]
+        self.assertIsNone(storage.get_snapshot_source(version))
+        storage.register_user('4', referred_by='1')
+        version, aggregates, rows = storage.get_snapshot_source(version)
+        self.assertEqual(aggregates['total_users'], 4)
+        self.assertEqual(len(list(rows)), 4)
+
+class SQLiteSnapshotSourceTest(SnapshotSourceTest):
+    backend = 'sqlite'
+
+    def test_reads_without_the_storage_lock(self):
+        self.populate()
+        storage.get_snapshot_source()
+        held = threading.Event()
+        release = threading.Event()
+
+        def hold_lock():
+            with storage._io_lock:
+                held.set()
+                release.wait(5)
+
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+        self.addCleanup(holder.join)
+        self.addCleanup(release.set)
+        held.wait(5)
+        version, aggregates, rows = storage.get_snapshot_source()
+        self.assertEqual(len(list(rows)), 3)
+        # Had it waited for the lock, the holder would have given up by now
+        self.assertTrue(holder.is_alive())
+
+if __name__ == '__main__':
+    unittest.main()
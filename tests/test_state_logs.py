@@ -0,0 +1,108 @@
+"""Operational state kept in its own logs instead of config.json (JSON backend)."""
+import json
+import unittest
+
+from storage_case import StorageTestCase, storage
+
+class StateLogTest(StorageTestCase):
+
+    def restart(self, **env):
+        super().restart(**env)
+        storage.init()
+
+    def test_deletions_survive_restart_without_config_writes(self):
+        stamp = self.config_stamp()
+        for message_id in range(1, 6):
+            storage.schedule_message_deletion(100, message_id, 1000 + message_id)
+        storage.schedule_message_deletions([(200, 1, 500), (200, 2, 2000)])
+        self.assertEqual(storage.pop_due_deletions(1002), [(200, 1), (100, 1), (100, 2)])
+        self.assertEqual(self.config_stamp(), stamp)
+
+        self.restart()
+        self.assertEqual(storage.get_pending_deletion_count(), 4)
+        self.assertEqual(storage.pop_due_deletions(10 ** 6), [(100, 3), (100, 4), (100, 5), (200, 2)])
+
+    def test_deletions_log_is_compacted(self):
+        storage._deletions_log.compact_events = 10
+        for message_id in range(25):
+            storage.schedule_message_deletion(100, message_id, 1000 + message_id)
+        storage.pop_due_deletions(1009)
+        with open(storage.DELETIONS_FILE) as f:
+            self.assertLess(len(f.readlines()), 10)
+
+        self.restart()
+        self.assertEqual(storage.get_pending_deletion_count(), 15)
+        self.assertEqual(storage.pop_due_deletions(1010), [(100, 10)])
+
+    def test_deletions_move_out_of_config(self):
+        config = storage.load_config()
+        config['pending_deletions'] = [[1001, 100, 1], [1000, 100, 2]]
+        storage.save_config(config)
+
+        self.restart()
+        self.assertEqual(storage.get_pending_deletion_count(), 2)
+        with open(storage.CONFIG_FILE) as f:
+            self.assertNotIn('pending_deletions', json.load(f))
+
+        self.restart()
+        self.assertEqual(storage.pop_due_deletions(10 ** 6), [(100, 2), (100, 1)])
+
+    def test_invite_pool_survives_restart_without_config_writes(self):
+        group = storage.add_group('Group', 'https://t.me/+g', chat_id=-100)
+        stamp = self.config_stamp()
+        self.assertEqual(storage.pop_invite_link(group['id'], 0), (None, 0))
+        storage.add_invite_links(group['id'], [
+            {'link': f'https://t.me/+l{i}', 'chat_id': -100, 'expires_at': 1000 + i} for i in range(5)
+        ])
+        entry, left = storage.pop_invite_link(group['id'], 1001)
+        self.assertEqual((entry['link'], left), ('https://t.me/+l2', 2))
+        self.assertEqual(storage.take_stale_invite_links(1004), [(-100, 'https://t.me/+l3')])
+        self.assertEqual(self.config_stamp(), stamp)
+
+        self.restart()
+        self.assertEqual(storage.get_invite_pool_sizes(), {group['id']: 1})
+        storage.delete_group(group['id'])
+        self.assertEqual(storage.take_stale_invite_links(0), [(-100, 'https://t.me/+l4')])
+
+        self.restart()
+        self.assertEqual(storage.get_invite_pool_sizes(), {})
+
+    def test_broadcast_state_survives_restart_without_config_writes(self):
+        stamp = self.config_stamp()
+        broadcast = storage.start_broadcast(1, 2, 3)
+        for chunk in range(1, 4):
+            self.assertTrue(storage.update_broadcast_progress(broadcast['id'], str(chunk * 200), chunk * 200, chunk * 190, 5, 0))
+            storage.mark_users_blocked([chunk, chunk + 1000])
+        self.assertTrue(storage.clear_user_blocked('2'))
+        self.assertFalse(storage.clear_user_blocked('2'))
+        self.assertEqual(self.config_stamp(), stamp)
+
+        self.restart()
+        state = storage.get_broadcast()
+        self.assertEqual((state['status'], state['last_user_id'], state['processed']), ('running', '600', 600))
+        self.assertEqual(sorted(storage.get_blocked_user_ids()), ['1', '1001', '1002', '1003', '3'])
+        self.assertTrue(storage.finish_broadcast(broadcast['id'], 'done'))
+        self.assertFalse(storage.update_broadcast_progress(broadcast['id'], '800', 800, 0, 0, 0))
+
+        self.restart()
+        self.assertEqual(storage.get_broadcast()['status'], 'done')
+        self.assertEqual(storage.start_broadcast(1, 2, 3)['processed'], 0)
+
+    def test_broadcast_state_moves_out_of_config(self):
+        config = storage.load_config()
+        config['broadcast'] = {'id': 'b', 'status': 'running', 'last_user_id': '5', 'processed': 5}
+        config['blocked_users'] = {'7': '2025-01-01T00:00:00'}
+        storage.save_config(config)
+
+        self.restart()
+        with open(storage.CONFIG_FILE) as f:
+            config = json.load(f)
+        self.assertNotIn('broadcast', config)
+        self.assertNotIn('blocked_users', config)
+
+        self.restart()
+        self.assertEqual(storage.get_broadcast()['last_user_id'], '5')
+        self.assertEqual(storage.get_blocked_user_ids(), ['7'])
+
+if __name__ == '__main__':
+    unittest.main()
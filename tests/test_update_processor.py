@@ -0,0 +1,81 @@
+"""PerUserUpdateProcessor ordering and concurrency with fake updates."""
+import asyncio
+import os
+import sys
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from telegram import Chat, Message, Update, User
+
+from update_processor import PerUserUpdateProcessor
+
+def make_update(update_id: int, user_id: int) -> Update:
+    return Update(update_id, message=Message(
+        message_id=update_id, date=datetime.now(),
+        chat=Chat(user_id, Chat.PRIVATE), from_user=User(user_id, 'User', False), text='hi'
+    ))
+
+class PerUserUpdateProcessorTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.events = []
+
+    def handler(self, name, delay=0.0, gate=None):
+        async def run():
+            self.events.append(('start', name))
+            if gate is not None:
+                await gate.wait()
+            await asyncio.sleep(delay)
+            self.events.append(('end', name))
+        return run()
+
+    async def test_one_users_updates_run_one_at_a_time_in_arrival_order(self):
+        processor = PerUserUpdateProcessor(max_concurrent_updates=4)
+        # Earlier updates take longer; without ordering they would finish last
+        await asyncio.gather(*(
+            processor.process_update(make_update(i, 1), self.handler(i, delay=0.01 * (5 - i)))
+            for i in range(5)
+        ))
+        expected = []
+        for i in range(5):
+            expected += [('start', i), ('end', i)]
+        self.assertEqual(self.events, expected)
+        self.assertEqual(processor.metrics()['active_users'], 0)
+
+    async def test_other_users_run_in_parallel_up_to_the_limit(self):
+        processor = PerUserUpdateProcessor(max_concurrent_updates=3)
+        gate = asyncio.Event()
+        tasks = [
+            asyncio.create_task(processor.process_update(make_update(i, 100 + i), self.handler(i, gate=gate)))
+            for i in range(5)
+        ]
+        for _ in range(10):
+            await asyncio.sleep(0)
+        self.assertEqual(processor.in_flight, 3)
+        self.assertEqual(len(self.events), 3)
+
+        gate.set()
+        await asyncio.gather(*tasks)
+        self.assertEqual(processor.peak_in_flight, 3)
+        self.assertEqual(processor.processed, 5)
+
+    async def test_flooding_user_holds_one_slot(self):
+        processor = PerUserUpdateProcessor(max_concurrent_updates=2)
+        gate = asyncio.Event()
+        flood = [
+            asyncio.create_task(processor.process_update(make_update(i, 1), self.handler(('flood', i), gate=gate)))
+            for i in range(10)
+        ]
+        other = asyncio.create_task(processor.process_update(make_update(99, 2), self.handler('other')))
+        # The other user's update finishes while the flood is still blocked
+        await asyncio.wait_for(other, 1)
+        self.assertEqual(self.events, [('start', ('flood', 0)), ('start', 'other'), ('end', 'other')])
+
+        gate.set()
+        await asyncio.gather(*flood)
+        self.assertEqual([name for kind, name in self.events if kind == 'end'][1:], [('flood', i) for i in range(10)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+"""Keyset paging through registered users, as used by broadcasts, on both backends."""
+import unittest
+
+from storage_case import StorageTestCase, storage
+
+class UserPagingTest(StorageTestCase):
+
+    def page(self, after, limit=3):
+        ids = []
+        while True:
+            chunk = storage.get_user_ids_chunk(after, limit)
+            if not chunk:
+                return ids
+            ids.extend(chunk)
+            after = chunk[-1]
+
+    def test_pages_in_registration_order(self):
+        for user_id in ('30', '10', '20', '50', '40'):
+            storage.register_user(user_id)
+        self.assertEqual(self.page(None), ['30', '10', '20', '50', '40'])
+        self.assertEqual(self.page('20', limit=1), ['50', '40'])
+        self.assertEqual(storage.get_user_ids_chunk('99', 3), [])
+
+    def test_users_registered_while_paging_come_last(self):
+        for user_id in ('1', '2', '3', '4'):
+            storage.register_user(user_id)
+        first = storage.get_user_ids_chunk(None, 2)
+        storage.register_user('5')
+        self.assertEqual(first + self.page(first[-1], limit=2), ['1', '2', '3', '4', '5'])
+
+    def test_resumes_after_restart(self):
+        for user_id in ('1', '2', '3', '4'):
+            storage.register_user(user_id)
+        after = storage.get_user_ids_chunk(None, 2)[-1]
+        self.restart()
+        self.assertEqual(self.page(after), ['3', '4'])
+
+class SQLiteUserPagingTest(UserPagingTest):
+    backend = 'sqlite'
+
+if __name__ == '__main__':
+    unittest.main()
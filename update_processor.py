@@ -0,0 +1,91 @@
+import asyncio
+from typing import Any, Awaitable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Process updates concurrently while keeping each user's updates in order.
+
+    Updates from the same user (or chat, if there is no user) run one at a
+    time in arrival order, so ConversationHandler state transitions stay
+    correct. Updates from different users run in parallel, at most
+    max_concurrent_updates at once. The ordering wait happens before a
+    slot is taken, so one user flooding the bot can't hold every slot.
+    """
+
+    def __init__(self, max_concurrent_updates: int, max_pending_updates: Optional[int] = None):
+        # The base class semaphore only bounds how many updates may be
+        # pending; the running limit is enforced by _slots below
+        super().__init__(max_pending_updates or max_concurrent_updates * 8)
+        self.max_running_updates = max_concurrent_updates
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._key_locks: Dict[int, asyncio.Lock] = {}
+        self._key_refs: Dict[int, int] = {}
+
+        self.pending = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.processed = 0
+
+    @staticmethod
+    def _ordering_key(update: object) -> Optional[int]:
+        """Return the id whose updates must be processed in order, if any"""
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self._ordering_key(update)
+        self.pending += 1
+        try:
+            if key is None:
+                await self._run(coroutine)
+                return
+
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = asyncio.Lock()
+            self._key_refs[key] = self._key_refs.get(key, 0) + 1
+            try:
+                async with lock:
+                    await self._run(coroutine)
+            finally:
+                self._key_refs[key] -= 1
+                if not self._key_refs[key]:
+                    del self._key_refs[key]
+                    del self._key_locks[key]
+        finally:
+            self.pending -= 1
+            self.processed += 1
+
+    async def _run(self, coroutine: Awaitable[Any]) -> None:
+        """Wait for a free slot, then run the handler coroutine"""
+        async with self._slots:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            try:
+                await coroutine
+            finally:
+                self.in_flight -= 1
+
+    def metrics(self) -> Dict:
+        """Get queue depth and in-flight counters"""
+        return {
+            'max_concurrent': self.max_running_updates,
+            'waiting': self.pending - self.in_flight,
+            'in_flight': self.in_flight,
+            'peak_in_flight': self.peak_in_flight,
+            'processed': self.processed,
+            'active_users': len(self._key_locks)
+        }
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -0,0 +1,30 @@
+"""Export or import referral users as line-delimited JSON.
+
+Usage (with the bot's STORAGE_DIR / STORAGE_BACKEND environment):
+    python user_dump.py export users.ndjson
+    python user_dump.py import users.ndjson [--replace]
+
+Stop the bot before importing; it keeps its own copy of the data in memory.
+"""
+import argparse
+import time
+
+import storage
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export or import referral users as line-delimited JSON")
+    parser.add_argument('action', choices=('export', 'import'))
+    parser.add_argument('path')
+    parser.add_argument('--replace', action='store_true', help="remove existing users before importing")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.action == 'export':
+        count = storage.export_users(args.path)
+        print(f"Exported {count} users to {args.path} in {time.perf_counter() - started:.1f}s")
+    else:
+        count = storage.import_users(args.path, replace=args.replace)
+        print(f"Imported {count} users from {args.path} in {time.perf_counter() - started:.1f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+# Compact in-memory representation of referrals.users entries. config.json
+# keeps the original layout: records are converted on load and written back
+# as the same dicts, so older versions of the bot can still read the file.
+
+# Group UUIDs are interned to small ints for the lifetime of the process, so
+# each user's groups_joined is a tuple of shared small ints rather than a list
+# of 36-character strings
+_group_ids: List[str] = []
+_group_indices: Dict[str, int] = {}
+
+def group_index(group_id: str) -> int:
+    """Get the process-wide integer for a group UUID"""
+    index = _group_indices.get(group_id)
+    if index is None:
+        index = _group_indices[group_id] = len(_group_ids)
+        _group_ids.append(group_id)
+    return index
+
+def now() -> int:
+    """Current time as an epoch int"""
+    return int(time.time())
+
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_UTC = _EPOCH.replace(tzinfo=timezone.utc)
+_SECOND = timedelta(seconds=1)
+
+def to_epoch(value: str) -> int:
+    """Parse an ISO timestamp as stored in config.json (naive means UTC)"""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        return (parsed - _EPOCH) // _SECOND
+    return (parsed - _EPOCH_UTC) // _SECOND
+
+def to_iso(value: Optional[int]) -> Optional[str]:
+    """Format an epoch int the way config.json stores timestamps"""
+    if value is None:
+        return None
+    return (_EPOCH + timedelta(seconds=value)).isoformat()
+
+class UserRecord:
+    """One user of the referral system, stored in slots instead of a per-user dict"""
+
+    __slots__ = (
+        'referral_count', 'period', 'referred_by', 'joined_at', 'has_joined_group',
+        'groups', 'username', 'first_name', 'extra'
+    )
+
+    FIELDS = frozenset((
+        'referral_count', 'period', 'referred_by', 'joined_at', 'has_joined_group',
+        'groups_joined', 'username', 'first_name'
+    ))
+
+    def __init__(
+        self,
+        referral_count: int = 0,
+        period: int = 1,
+        referred_by: Optional[str] = None,
+        joined_at: Optional[int] = None,
+        has_joined_group: bool = False,
+        groups: tuple = (),
+        username: Optional[str] = None,
+        first_name: Optional[str] = None,
+        extra: Optional[Dict] = None
+    ):
+        self.referral_count = referral_count
+        # Competition period referral_count belongs to; it counts as 0 in any other
+        self.period = period
+        self.referred_by = referred_by
+        self.joined_at = joined_at
+        self.has_joined_group = has_joined_group
+        self.groups = groups
+        self.username = username
+        self.first_name = first_name
+        # Keys this version doesn't know, kept so they survive a save
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'UserRecord':
+        """Build a record from the config.json layout"""
+        extra = None
+        if not cls.FIELDS.issuperset(data):
+            extra = {key: value for key, value in data.items() if key not in cls.FIELDS}
+        joined_at = data.get('joined_at')
+        if joined_at is not None:
+            try:
+                joined_at = to_epoch(joined_at)
+            except (TypeError, ValueError):
+                extra = dict(extra or {}, joined_at=joined_at)
+                joined_at = None
+        return cls(
+            referral_count=data.get('referral_count', 0),
+            period=data.get('period', 1),
+            referred_by=data.get('referred_by'),
+            joined_at=joined_at,
+            has_joined_group=bool(data.get('has_joined_group', False)),
+            groups=tuple(group_index(group_id) for group_id in data.get('groups_joined', ())),
+            username=data.get('username'),
+            first_name=data.get('first_name'),
+            extra=extra
+        )
+
+    def to_dict(self) -> Dict:
+        """Convert to the config.json layout"""
+        data = {
+            'referral_count': self.referral_count,
+            'period': self.period,
+            'referred_by': self.referred_by,
+            'joined_at': to_iso(self.joined_at),
+            'has_joined_group': self.has_joined_group,
+            'groups_joined': self.groups_joined,
+            'username': self.username,
+            'first_name': self.first_name
+        }
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def count_in(self, period: int) -> int:
+        """Referral count in the given competition period"""
+        return self.referral_count if self.period == period else 0
+
+    def credit(self, period: int) -> None:
+        """Count one referral in the given period, dropping a count left from an earlier one"""
+        if self.period != period:
+            self.referral_count = 0
+            self.period = period
+        self.referral_count += 1
+
+    @property
+    def groups_joined(self) -> List[str]:
+        """Group UUIDs this user joined, in join order"""
+        return [_group_ids[index] for index in self.groups]
+
+    def has_group(self, group_id: str) -> bool:
+        return group_index(group_id) in self.groups
+
+    def add_group(self, group_id: str) -> bool:
+        """Record a joined group. Returns False if it was already recorded"""
+        index = group_index(group_id)
+        if index in self.groups:
+            return False
+        self.groups += (index,)
+        return True
+
+    def remove_group(self, group_id: str) -> bool:
+        """Forget a joined group. Returns False if it wasn't recorded"""
+        index = group_index(group_id)
+        if index not in self.groups:
+            return False
+        self.groups = tuple(i for i in self.groups if i != index)
+        return True
+
+def encode(value):
+    """json default hook writing records in the config.json layout"""
+    if isinstance(value, UserRecord):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")